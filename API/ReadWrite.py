@@ -92,16 +92,26 @@ class ReadWrite():
         """
         return SubjectList(normal_list_of_subjects)
 
-    def read_dicom_folder(self):
+    def read_dicom_folder(self, incremental=True):
         """
         Read a DICOM folder, create XML and refresh display.
+        If incremental=True and the folder is open already, only the files that were added, 
+        changed or removed since the XML file was written are read and the XML tree is updated in place.
         """
         if self.DICOMFolder:
             self.close_subwindows()
             self.cursor_arrow_to_hourglass()
-            XML_File_Path = WriteXMLfromDICOM.makeDICOM_XML_File(self, self.DICOMFolder)
-            self.cursor_hourglass_to_arrow()
-            self.treeView = TreeView(self, XML_File_Path)
+            XML_File_Path = os.path.join(self.DICOMFolder, os.path.basename(os.path.normpath(self.DICOMFolder)) + '.xml')
+            if (incremental and self.treeView is not None and self.objXMLReader is not None
+                and os.path.normpath(self.objXMLReader.file) == os.path.normpath(XML_File_Path)):
+                WriteXMLfromDICOM.refreshDICOM_XML_File(self, self.DICOMFolder, xml_root=self.objXMLReader.root)
+                self.objXMLReader.buildHierarchyIndex()
+                self.cursor_hourglass_to_arrow()
+                self.treeView.refreshDICOMStudiesTreeView()
+            else:
+                XML_File_Path = WriteXMLfromDICOM.makeDICOM_XML_File(self, self.DICOMFolder)
+                self.cursor_hourglass_to_arrow()
+                self.treeView = TreeView(self, XML_File_Path)
               
     def open_dicom_folder(self): 
         """
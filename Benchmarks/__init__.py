@@ -0,0 +1,6 @@
+"""
+Scripts that time the optimised routines of Weasel against the implementations they replaced.
+
+Each script keeps a frozen copy of the previous implementation, checks that both give the same result and prints the timings.
+Run them from the Weasel folder, for example `python -m Benchmarks.benchmark_createNewPixelArray`.
+"""
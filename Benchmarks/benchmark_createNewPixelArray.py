@@ -0,0 +1,132 @@
+"""
+Times SaveDICOM_Image.createNewPixelArray against the encoder it replaced, for 256², 512² and 1024² images.
+
+Both encoders write float32 images into 16-bit datasets and the PixelData, rescale parameters and tags they write
+are checked to be identical before timing. A 4-frame enhanced dataset is also checked, so that every frame is encoded.
+
+    python -m Benchmarks.benchmark_createNewPixelArray
+"""
+
+import time
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+import DICOM.SaveDICOM_Image as SaveDICOM_Image
+
+IMAGE_SIZES = [256, 512, 1024]
+NUMBER_OF_REPEATS = 20
+
+
+def previousCreateNewPixelArray(imageArray, dataset):
+    """createNewPixelArray before the single scan encoder, without the binary mask branch and the error handling"""
+    numberFrames = 1
+    enhancedArrayInt = []
+    numDimensions = len(np.shape(imageArray))
+    if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+        if numDimensions == 2:
+            dataset.NumberOfFrames = 1
+        else:
+            dataset.NumberOfFrames = np.shape(imageArray)[0]
+        del dataset.PerFrameFunctionalGroupsSequence[dataset.NumberOfFrames:]
+        numberFrames = dataset.NumberOfFrames
+    for index in range(numberFrames):
+        if len(np.shape(imageArray)) == 2:
+            tempArray = imageArray
+        else:
+            tempArray = np.squeeze(imageArray[index, ...])
+        dataset.PixelRepresentation = 0
+        target = (np.power(2, dataset.BitsAllocated) - 1) * np.ones(np.shape(tempArray))
+        maximum = np.ones(np.shape(tempArray)) * np.amax(tempArray)
+        minimum = np.ones(np.shape(tempArray)) * np.amin(tempArray)
+        imageScaled = target * (tempArray - minimum) / (maximum - minimum)
+        slope =  target / (maximum - minimum)
+        intercept = (- target * minimum)/ (maximum - minimum)
+        rescaleSlope = np.ones(np.shape(tempArray)) / slope
+        rescaleIntercept = - intercept / slope
+        imageArrayInt = imageScaled.astype(np.uint16)
+        dataset.add_new('0x00280106', 'US', int(np.amin(imageArrayInt)))
+        dataset.add_new('0x00280107', 'US', int(np.amax(imageArrayInt)))
+        if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+            enhancedArrayInt.append(np.transpose(imageArrayInt))
+            dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleSlope = rescaleSlope.flatten()[0]
+            dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleIntercept = rescaleIntercept.flatten()[0]
+            center = (np.amax(tempArray) + np.amin(tempArray)) / 2
+            width = np.amax(tempArray) - np.amin(tempArray)
+            if width == 1.0: width = 1.1
+            dataset.PerFrameFunctionalGroupsSequence[index].FrameVOILUTSequence[0].WindowCenter = center
+            dataset.PerFrameFunctionalGroupsSequence[index].FrameVOILUTSequence[0].WindowWidth = width
+        else:
+            imageArrayInt = np.transpose(imageArrayInt)
+            dataset.RescaleSlope = rescaleSlope.flatten()[0]
+            dataset.RescaleIntercept = rescaleIntercept.flatten()[0]
+            center = (np.amax(tempArray) + np.amin(tempArray)) / 2
+            width = np.amax(tempArray) - np.amin(tempArray)
+            if width == 1.0: width = 1.1
+            dataset.add_new('0x00281050', 'DS', center)
+            dataset.add_new('0x00281051', 'DS', width)
+    if enhancedArrayInt:
+        imageArrayInt = np.array(enhancedArrayInt)
+    dataset.Rows = np.shape(imageArrayInt)[-2]
+    dataset.Columns = np.shape(imageArrayInt)[-1]
+    dataset.PixelData = imageArrayInt.tobytes()
+    return dataset
+
+
+def newDataset(numberFrames=None):
+    """Returns a 16-bit dataset, enhanced with numberFrames per-frame groups if numberFrames is given"""
+    dataset = Dataset()
+    dataset.BitsAllocated = 16
+    if numberFrames is not None:
+        frameList = []
+        for _ in range(numberFrames):
+            frame = Dataset()
+            frame.PixelValueTransformationSequence = Sequence([Dataset()])
+            frame.FrameVOILUTSequence = Sequence([Dataset()])
+            frameList.append(frame)
+        dataset.PerFrameFunctionalGroupsSequence = Sequence(frameList)
+    return dataset
+
+
+def writtenValues(dataset):
+    """Returns what the encoders write into dataset, so that the outputs of both can be compared"""
+    values = {'PixelData': dataset.PixelData, 'Rows': dataset.Rows, 'Columns': dataset.Columns,
+              'SmallestPixelValue': dataset[0x00280106].value, 'LargestPixelValue': dataset[0x00280107].value}
+    if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+        values['NumberOfFrames'] = dataset.NumberOfFrames
+        values['Frames'] = [(float(frame.PixelValueTransformationSequence[0].RescaleSlope), float(frame.PixelValueTransformationSequence[0].RescaleIntercept),
+                             float(frame.FrameVOILUTSequence[0].WindowCenter), float(frame.FrameVOILUTSequence[0].WindowWidth))
+                            for frame in dataset.PerFrameFunctionalGroupsSequence]
+    else:
+        values['Rescale'] = (float(dataset.RescaleSlope), float(dataset.RescaleIntercept))
+        values['Window'] = (float(dataset[0x00281050].value), float(dataset[0x00281051].value))
+    return values
+
+
+def bestTime(function, imageArray):
+    """Returns the fastest of NUMBER_OF_REPEATS runs of function on a new dataset, in milliseconds"""
+    best = None
+    for _ in range(NUMBER_OF_REPEATS):
+        dataset = newDataset()
+        start = time.perf_counter()
+        function(imageArray, dataset)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    generator = np.random.default_rng(0)
+    frames = (generator.standard_normal((4, 64, 64)) * 300 + 1000).astype(np.float32)
+    identical = writtenValues(previousCreateNewPixelArray(frames, newDataset(6))) == writtenValues(SaveDICOM_Image.createNewPixelArray(frames, newDataset(6)))
+    print("Enhanced dataset with 4 frames: identical={}".format(identical))
+    print("{:>6}  {:>10}  {:>10}  {:>7}  {}".format("size", "before", "after", "speedup", "identical"))
+    for size in IMAGE_SIZES:
+        imageArray = (generator.standard_normal((size, size)) * 300 + 1000).astype(np.float32)
+        identical = writtenValues(previousCreateNewPixelArray(imageArray, newDataset())) == writtenValues(SaveDICOM_Image.createNewPixelArray(imageArray, newDataset()))
+        before = bestTime(previousCreateNewPixelArray, imageArray)
+        after = bestTime(SaveDICOM_Image.createNewPixelArray, imageArray)
+        print("{:>5}²  {:>7.2f} ms  {:>7.2f} ms  {:>6.1f}x  {}".format(size, before, after, before / after, identical))
+
+
+if __name__ == '__main__':
+    main()
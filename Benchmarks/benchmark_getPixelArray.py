@@ -0,0 +1,125 @@
+"""
+Times ReadDICOM_Image.getPixelArray against the decode path it replaced, for 256², 512² and 1024² slices.
+
+The slices are 16-bit with a rescale slope, intercept and Philips private scale. Both decode paths are checked
+to return the same pixel values before timing, the previous one in float64 and the present one in float32.
+A 4-frame enhanced dataset with a different slope and intercept on each frame, and 6 items in its
+PerFrameFunctionalGroupsSequence, is also checked. The pixel data is replaced before every call,
+so that each call decodes it as a newly read slice would.
+
+    python -m Benchmarks.benchmark_getPixelArray
+"""
+
+import time
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian
+import DICOM.ReadDICOM_Image as ReadDICOM_Image
+
+IMAGE_SIZES = [256, 512, 1024]
+NUMBER_OF_REPEATS = 20
+# Largest difference relative to the range of the pixel values allowed between the float64 and the float32 results
+TOLERANCE = 1e-6
+
+
+def previousGetPixelArray(dataset):
+    """getPixelArray before the single float32 pass, without the error handling"""
+    if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+        imageList = list()
+        originalArray = dataset.pixel_array.astype(np.float32)
+        if len(np.shape(originalArray)) == 2:
+            slope = float(getattr(dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0], 'RescaleSlope', 1)) * np.ones(originalArray.shape)
+            intercept = float(getattr(dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0], 'RescaleIntercept', 0)) * np.ones(originalArray.shape)
+            pixelArray = np.transpose(originalArray * slope + intercept)
+        else:
+            for index in range(np.shape(originalArray)[0]):
+                sliceArray = np.squeeze(originalArray[index, ...])
+                slope = float(getattr(dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0], 'RescaleSlope', 1)) * np.ones(sliceArray.shape)
+                intercept = float(getattr(dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0], 'RescaleIntercept', 0)) * np.ones(sliceArray.shape)
+                tempArray = np.transpose(sliceArray * slope + intercept)
+                imageList.append(tempArray)
+            pixelArray = np.array(imageList)
+    else:
+        slope = float(getattr(dataset, 'RescaleSlope', 1)) * np.ones(dataset.pixel_array.shape)
+        intercept = float(getattr(dataset, 'RescaleIntercept', 0)) * np.ones(dataset.pixel_array.shape)
+        if len(dataset.pixel_array.shape) == 3:
+            pixelArray = np.rot90(np.array(dataset.pixel_array.astype(np.float32) * slope + intercept), k=1, axes=(0, 1))
+        else:
+            pixelArray = np.transpose(dataset.pixel_array.astype(np.float32) * slope + intercept)
+    if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
+        pixelArray = pixelArray / (slope * dataset[(0x2005, 0x100E)].value)
+    return np.nan_to_num(pixelArray)
+
+
+def newDataset(pixelArray, numberOfItems=None):
+    """Returns a 16-bit dataset holding pixelArray, enhanced with numberOfItems per-frame groups if numberOfItems is given"""
+    dataset = Dataset()
+    dataset.file_meta = FileMetaDataset()
+    dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = 'MONOCHROME2'
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 0
+    dataset.Rows, dataset.Columns = np.shape(pixelArray)[-2:]
+    if numberOfItems is None:
+        dataset.RescaleSlope = 0.75
+        dataset.RescaleIntercept = -1024
+        dataset.add_new((0x2005, 0x100E), 'FL', 2.5)
+    else:
+        dataset.NumberOfFrames = np.shape(pixelArray)[0]
+        frameList = []
+        for index in range(numberOfItems):
+            transformation = Dataset()
+            transformation.RescaleSlope = 0.5 + index
+            transformation.RescaleIntercept = -100 * index
+            frame = Dataset()
+            frame.PixelValueTransformationSequence = Sequence([transformation])
+            frameList.append(frame)
+        dataset.PerFrameFunctionalGroupsSequence = Sequence(frameList)
+    dataset.PixelData = pixelArray.astype(np.uint16).tobytes()
+    return dataset
+
+
+def sameValues(previousArray, pixelArray):
+    """Returns True if both decode paths returned the same values, within the float32 rounding of the present one"""
+    if np.shape(previousArray) != np.shape(pixelArray):
+        return False
+    valueRange = max(np.ptp(previousArray), 1.0)
+    return bool(np.amax(np.abs(previousArray - pixelArray)) <= TOLERANCE * valueRange)
+
+
+def bestTime(function, dataset):
+    """Returns the fastest of NUMBER_OF_REPEATS calls of function on dataset, in milliseconds"""
+    best = None
+    pixelData = dataset.PixelData
+    for _ in range(NUMBER_OF_REPEATS):
+        # A new PixelData object, so that pydicom decodes it again instead of returning the pixel array of the last call
+        dataset.PixelData = bytes(pixelData)
+        start = time.perf_counter()
+        function(dataset)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    generator = np.random.default_rng(0)
+    frames = generator.integers(0, 4096, (4, 64, 64))
+    identical = sameValues(previousGetPixelArray(newDataset(frames, 6)), ReadDICOM_Image.getPixelArray(newDataset(frames, 6)))
+    print("Enhanced dataset with 4 frames and 6 per-frame groups: identical={}".format(identical))
+    print("{:>6}  {:>10}  {:>10}  {:>7}  {}".format("size", "before", "after", "speedup", "identical"))
+    for size in IMAGE_SIZES:
+        dataset = newDataset(generator.integers(0, 4096, (size, size)))
+        identical = sameValues(previousGetPixelArray(dataset), ReadDICOM_Image.getPixelArray(dataset))
+        before = bestTime(previousGetPixelArray, dataset)
+        after = bestTime(ReadDICOM_Image.getPixelArray, dataset)
+        print("{:>5}²  {:>7.2f} ms  {:>7.2f} ms  {:>6.1f}x  {}".format(size, before, after, before / after, identical))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Times HelperFunctions.polygonToMask against the matplotlib Path.contains_points mask that createMaskFromDrawnROI built before,
+for freehand polygons of several sizes. The masks of both are checked to be identical, first on random polygons
+(integer and float vertices, some of them self-intersecting) and then on each benchmarked polygon.
+
+    python -m Benchmarks.benchmark_polygonToMask
+"""
+
+import time
+import numpy as np
+from matplotlib.path import Path as MplPath
+from Displays.ImageViewers.ComponentsUI.FreeHandROI.HelperFunctions import polygonToMask
+
+NUMBER_OF_RANDOM_POLYGONS = 300
+NUMBER_OF_VERTICES = 400
+# (image size, polygon radius) of the benchmarked polygons
+POLYGON_SIZES = [(512, 20), (512, 100), (512, 250), (1024, 450)]
+
+
+def previousPolygonToMask(vertices, shape):
+    """The mask createMaskFromDrawnROI built before polygonToMask, with every pixel tested by contains_points"""
+    ny, nx = shape
+    x, y = np.meshgrid(np.arange(nx), np.arange(ny))
+    points = list(zip(x.flatten(),y.flatten()))
+    roiPath = MplPath(vertices, closed=True)
+    return roiPath.contains_points(points, radius=0.0).reshape((ny, nx))
+
+
+def freehandPolygon(generator, numberOfVertices, radius, centreX, centreY, integer=True):
+    """Returns the vertices of a star-shaped polygon like the ones drawn with the mouse, rounded to pixels if integer is True"""
+    angles = np.sort(generator.uniform(0, 2*np.pi, numberOfVertices))
+    radii = radius * (0.6 + 0.4 * generator.random(numberOfVertices))
+    vertices = np.column_stack((centreX + radii * np.cos(angles), centreY + radii * np.sin(angles)))
+    if integer:
+        return [[int(x), int(y)] for x, y in np.round(vertices)]
+    return vertices.tolist()
+
+
+def main():
+    generator = np.random.default_rng(1)
+    mismatches = 0
+    for index in range(NUMBER_OF_RANDOM_POLYGONS):
+        shape = (int(generator.integers(20, 80)), int(generator.integers(20, 80)))
+        if index % 5 == 0:
+            # Random vertices give self-intersecting polygons
+            vertices = [[int(value) for value in generator.integers(-5, 85, 2)] for _ in range(int(generator.integers(3, 15)))]
+        else:
+            vertices = freehandPolygon(generator, int(generator.integers(3, 40)), generator.uniform(3, 60),
+                                       generator.uniform(-10, 90), generator.uniform(-10, 90), integer=(index % 2 == 0))
+        # closed=True makes contains_points ignore the last vertex, so the first one is repeated at the end
+        if not np.array_equal(previousPolygonToMask(vertices + [vertices[0]], shape), polygonToMask(vertices, shape)):
+            mismatches += 1
+    print("Random polygons: {} of {} masks differ".format(mismatches, NUMBER_OF_RANDOM_POLYGONS))
+
+    print("{:>5}  {:>6}  {:>15}  {:>13}  {:>7}  {}".format("image", "radius", "contains_points", "polygonToMask", "speedup", "identical"))
+    for size, radius in POLYGON_SIZES:
+        vertices = freehandPolygon(generator, NUMBER_OF_VERTICES, radius, size/2, size/2)
+        start = time.perf_counter()
+        previousMask = previousPolygonToMask(vertices + [vertices[0]], (size, size))
+        before = time.perf_counter() - start
+        start = time.perf_counter()
+        mask = polygonToMask(vertices, (size, size))
+        after = time.perf_counter() - start
+        print("{:>5}  {:>6}  {:>12.1f} ms  {:>10.2f} ms  {:>6.0f}x  {}".format(size, radius, before*1000, after*1000,
+                                                                                  before/after, np.array_equal(previousMask, mask)))
+
+
+if __name__ == '__main__':
+    main()
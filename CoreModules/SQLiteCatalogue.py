@@ -0,0 +1,387 @@
+"""
+SQLite catalogue of the contents of a DICOM folder.
+
+The catalogue holds the same subject/study/series/image hierarchy as the XML file
+written by WriteXMLfromDICOM, in indexed tables of an SQLite database that is
+stored next to the XML file. It can be used by WeaselXMLReader to load and save
+its tree instead of the XML file, in which case only the rows that changed are written
+when the tree is saved, and the XML file is written once, when the DICOM folder is closed.
+WeaselXMLReader then answers the checkedImages/checkedSeries/checkedStudies/checkedSubjects,
+getImagePathList and getNumImagesInSeries queries from the indexed tables of the catalogue
+instead of searching its tree.
+
+WeaselXMLReader and TreeView still hold the whole tree in memory, 
+so opening a folder takes as long and as much memory as with the XML file.
+
+The module can be run as a script to convert an XML file into an SQLite catalogue
+and back, for example
+
+    python -m CoreModules.SQLiteCatalogue path/to/folder/folder.xml
+    python -m CoreModules.SQLiteCatalogue path/to/folder/folder.db
+"""
+import os
+import argparse
+import sqlite3
+import xml.etree.cElementTree as ET
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_FILE_SUFFIX = ".db"
+
+# Columns holding the IDs of an element and its parents, and the columns holding its data.
+# The data columns of subjects, studies and series are the attributes of their elements
+# and those of images are the checked attribute and the child elements of the image element.
+KEY_COLUMNS = {
+    'subject': ['subject_id'],
+    'study': ['subject_id', 'study_id'],
+    'series': ['subject_id', 'study_id', 'series_id'],
+    'image': ['subject_id', 'study_id', 'series_id', 'name']}
+DATA_COLUMNS = {
+    'subject': ['typeID', 'checked'],
+    'study': ['uid', 'typeID', 'checked'],
+    'series': ['uid', 'typeID', 'checked'],
+    'image': ['checked', 'label', 'time', 'date']}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS properties (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS subject (position INTEGER PRIMARY KEY,
+        subject_id TEXT, typeID TEXT, checked TEXT);
+    CREATE TABLE IF NOT EXISTS study (position INTEGER PRIMARY KEY,
+        subject_id TEXT, study_id TEXT, uid TEXT, typeID TEXT, checked TEXT);
+    CREATE TABLE IF NOT EXISTS series (position INTEGER PRIMARY KEY,
+        subject_id TEXT, study_id TEXT, series_id TEXT, uid TEXT, typeID TEXT, checked TEXT);
+    CREATE TABLE IF NOT EXISTS image (position INTEGER PRIMARY KEY,
+        subject_id TEXT, study_id TEXT, series_id TEXT, name TEXT, checked TEXT, label TEXT, time TEXT, date TEXT);
+    CREATE INDEX IF NOT EXISTS subject_key ON subject (subject_id);
+    CREATE INDEX IF NOT EXISTS study_key ON study (subject_id, study_id);
+    CREATE INDEX IF NOT EXISTS series_key ON series (subject_id, study_id, series_id);
+    CREATE INDEX IF NOT EXISTS image_key ON image (subject_id, study_id, series_id);
+    CREATE INDEX IF NOT EXISTS image_name ON image (name);
+    CREATE INDEX IF NOT EXISTS image_checked ON image (checked);
+    CREATE INDEX IF NOT EXISTS series_checked ON series (checked);
+    CREATE INDEX IF NOT EXISTS study_checked ON study (checked);
+    CREATE INDEX IF NOT EXISTS subject_checked ON subject (checked);
+"""
+
+
+def getCatalogueFilePath(xmlFile):
+    """Returns the path of the SQLite catalogue kept next to the XML file, xmlFile"""
+    return os.path.splitext(xmlFile)[0] + CATALOGUE_FILE_SUFFIX
+
+
+def getFileStamp(filePath):
+    """Returns a string that changes whenever the file in filePath is rewritten"""
+    fileStat = os.stat(filePath)
+    return str(fileStat.st_mtime_ns) + "_" + str(fileStat.st_size)
+
+
+def insertStatement(element, parentIDs):
+    """
+    Returns the SQL statement and its parameters that add the element of the XML tree,
+    but not its children, to the catalogue. parentIDs is the tuple of IDs of the element's parents.
+    """
+    table = element.tag
+    if table == 'image':
+        keys = tuple(parentIDs) + (element.find('name').text,)
+        data = [element.attrib.get('checked')] + [_getText(element, child) for child in DATA_COLUMNS['image'][1:]]
+    else:
+        keys = tuple(parentIDs) + (element.attrib['id'],)
+        data = [element.attrib.get(attribute) for attribute in DATA_COLUMNS[table]]
+    columns = KEY_COLUMNS[table] + DATA_COLUMNS[table]
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(columns), ", ".join("?"*len(columns)))
+    return sql, keys + tuple(data)
+
+
+def deleteStatement(element, parentIDs):
+    """
+    Returns the SQL statement and its parameters that remove the element of the XML tree,
+    but not its children, from the catalogue. parentIDs is the tuple of IDs of the element's parents.
+    """
+    table = element.tag
+    if table == 'image':
+        keys = tuple(parentIDs) + (element.find('name').text,)
+    else:
+        keys = tuple(parentIDs) + (element.attrib['id'],)
+    return "DELETE FROM {} WHERE {}".format(table, _whereKeys(table)), keys
+
+
+def fileStampStatement(xmlFile):
+    """
+    Returns the SQL statement and its parameters that record that the catalogue
+    holds the present version of the XML file, xmlFile.
+    """
+    return "INSERT OR REPLACE INTO properties (key, value) VALUES (?, ?)", ('xml_file_stamp', getFileStamp(xmlFile))
+
+
+def checkedStatement(table, keys, checkedState):
+    """
+    Returns the SQL statement and its parameters that set the checked state
+    of the subject, study, series or image with the IDs in keys.
+    """
+    return "UPDATE {} SET checked = ? WHERE {}".format(table, _whereKeys(table)), (checkedState,) + tuple(keys)
+
+
+# Joins the rows of a table to the rows of its parents, so that the rows can be sorted in the order of the XML tree
+PARENT_JOINS = {
+    'study': "JOIN subject ON subject.subject_id = study.subject_id",
+    'series': "JOIN study ON study.subject_id = series.subject_id AND study.study_id = series.study_id "
+              "JOIN subject ON subject.subject_id = series.subject_id",
+    'image': "JOIN series ON series.subject_id = image.subject_id AND series.study_id = image.study_id AND series.series_id = image.series_id "
+             "JOIN study ON study.subject_id = image.subject_id AND study.study_id = image.study_id "
+             "JOIN subject ON subject.subject_id = image.subject_id"}
+TREE_ORDER = {
+    'subject': "subject.position",
+    'study': "subject.position, study.position",
+    'series': "subject.position, study.position, series.position",
+    'image': "subject.position, study.position, series.position, image.position"}
+
+
+def _whereKeys(table):
+    return " AND ".join(column + " = ?" for column in KEY_COLUMNS[table])
+
+
+def _getText(element, tag):
+    child = element.find(tag)
+    if child is None:
+        return None
+    return child.text
+
+
+class SQLiteCatalogue:
+    """Reads and writes the SQLite catalogue of a DICOM folder."""
+
+    def __init__(self, dbFile):
+        """
+        Opens the catalogue in dbFile, creating it if it does not exist.
+
+        Input arguments
+        -----------------
+        dbFile: the SQLite database file
+        """
+        try:
+            self.file = dbFile
+            self.connection = sqlite3.connect(dbFile)
+            # Write-ahead logging, so that small updates do not rewrite the database file
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+            logger.info('In module ' + __name__ + ' Created SQLite Catalogue Object')
+        except Exception as e:
+            print('Error in SQLiteCatalogue.__init__: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.__init__: ' + str(e))
+
+
+    def __repr__(self):
+       """Represents this class's objects as a string"""
+       return '{}, {!r}'.format(
+           self.__class__.__name__,
+           self.file)
+
+
+    def close(self):
+        """Closes the connection to the database"""
+        self.connection.close()
+
+
+    def getProperty(self, key):
+        """Returns the value stored under key in the properties table, or None"""
+        row = self.connection.execute("SELECT value FROM properties WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+
+    def isCurrent(self, xmlFile):
+        """Returns True if the catalogue was written from the present version of the XML file, xmlFile"""
+        try:
+            return self.getProperty('xml_file_stamp') == getFileStamp(xmlFile)
+        except Exception as e:
+            print('Error in SQLiteCatalogue.isCurrent: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.isCurrent: ' + str(e))
+            return False
+
+
+    def execute(self, statements):
+        """Executes a list of (sql, parameters) statements in one transaction"""
+        try:
+            with self.connection:
+                for sql, parameters in statements:
+                    self.connection.execute(sql, parameters)
+        except Exception as e:
+            print('Error in SQLiteCatalogue.execute: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.execute: ' + str(e))
+
+
+    def writeTree(self, root, xmlFile=None):
+        """
+        Replaces the contents of the catalogue by the XML tree with root element, root.
+
+        If xmlFile is given, the catalogue records that it holds the present version of that file.
+        """
+        try:
+            logger.info("SQLiteCatalogue.writeTree called")
+            statements = []
+            for subject in root.iter('subject'):
+                statements.append(insertStatement(subject, ()))
+                for study in subject:
+                    statements.append(insertStatement(study, (subject.attrib['id'],)))
+                    for series in study:
+                        statements.append(insertStatement(series, (subject.attrib['id'], study.attrib['id'])))
+                        seriesIDs = (subject.attrib['id'], study.attrib['id'], series.attrib['id'])
+                        for image in series:
+                            statements.append(insertStatement(image, seriesIDs))
+            with self.connection:
+                for table in KEY_COLUMNS:
+                    self.connection.execute("DELETE FROM " + table)
+                for sql, parameters in statements:
+                    self.connection.execute(sql, parameters)
+                if xmlFile is not None:
+                    self.connection.execute(*fileStampStatement(xmlFile))
+        except Exception as e:
+            print('Error in SQLiteCatalogue.writeTree: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.writeTree: ' + str(e))
+
+
+    def readTree(self):
+        """Returns the root element of an XML tree built from the contents of the catalogue"""
+        try:
+            logger.info("SQLiteCatalogue.readTree called")
+            root = ET.Element('DICOM')
+            elements = {(): root}
+            for table in ['subject', 'study', 'series']:
+                columns = KEY_COLUMNS[table] + DATA_COLUMNS[table]
+                sql = "SELECT {} FROM {} ORDER BY position".format(", ".join(columns), table)
+                for row in self.connection.execute(sql):
+                    keys = row[:len(KEY_COLUMNS[table])]
+                    parent = elements.get(keys[:-1])
+                    if parent is None or keys in elements:
+                        continue
+                    attributes = {'id': keys[-1]}
+                    for column, value in zip(DATA_COLUMNS[table], row[len(keys):]):
+                        if value is not None:
+                            attributes[column] = value
+                    elements[keys] = ET.SubElement(parent, table, attributes)
+            sql = "SELECT subject_id, study_id, series_id, name, checked, label, time, date FROM image ORDER BY position"
+            for row in self.connection.execute(sql):
+                series = elements.get(row[:3])
+                if series is None:
+                    continue
+                image = ET.SubElement(series, 'image', {'checked': row[4] or 'False'})
+                for tag, text in zip(['label', 'name', 'time', 'date'], [row[5], row[3], row[6], row[7]]):
+                    if text is not None or tag == 'name':
+                        ET.SubElement(image, tag).text = text
+            return root
+        except Exception as e:
+            print('Error in SQLiteCatalogue.readTree: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.readTree: ' + str(e))
+
+
+    def checkedIDs(self, table):
+        """
+        Returns the IDs of the subjects, studies, series or images (table) checked by the user, 
+        in the order of the XML tree. The IDs of an image end with its file path.
+        """
+        try:
+            columns = ", ".join(table + "." + column for column in KEY_COLUMNS[table])
+            sql = "SELECT {} FROM {} {} WHERE {}.checked = 'True' ORDER BY {}".format(
+                columns, table, PARENT_JOINS.get(table, ""), table, TREE_ORDER[table])
+            return [tuple(row) for row in self.connection.execute(sql)]
+        except Exception as e:
+            print('Error in SQLiteCatalogue.checkedIDs: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.checkedIDs: ' + str(e))
+
+
+    def checkedSeriesImages(self):
+        """
+        Returns a list of the IDs of the series checked by the user, each with 
+        the list of the file paths of its images, in the order of the XML tree.
+        """
+        try:
+            sql = ("SELECT series.subject_id, series.study_id, series.series_id, image.name FROM series {} "
+                   "LEFT JOIN image ON image.subject_id = series.subject_id AND image.study_id = series.study_id AND image.series_id = series.series_id "
+                   "WHERE series.checked = 'True' ORDER BY {}, image.position").format(PARENT_JOINS['series'], TREE_ORDER['series'])
+            seriesList = []
+            for row in self.connection.execute(sql):
+                if not seriesList or seriesList[-1][0] != tuple(row[:3]):
+                    seriesList.append((tuple(row[:3]), []))
+                if row[3] is not None:
+                    seriesList[-1][1].append(row[3])
+            return seriesList
+        except Exception as e:
+            print('Error in SQLiteCatalogue.checkedSeriesImages: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.checkedSeriesImages: ' + str(e))
+
+
+    def getImagePathList(self, subjectID, studyID, seriesID):
+        """
+        Returns a list of the file paths of the images in a given series.
+        """
+        try:
+            sql = "SELECT name FROM image WHERE " + _whereKeys('series') + " ORDER BY position"
+            return [row[0] for row in self.connection.execute(sql, (subjectID, studyID, seriesID))]
+        except Exception as e:
+            print('Error in SQLiteCatalogue.getImagePathList: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.getImagePathList: ' + str(e))
+
+
+    def getNumImagesInSeries(self, subjectID, studyID, seriesID):
+        """
+        Returns the number of images in a given series.
+        """
+        try:
+            sql = "SELECT COUNT(*) FROM image WHERE " + _whereKeys('series')
+            return self.connection.execute(sql, (subjectID, studyID, seriesID)).fetchone()[0]
+        except Exception as e:
+            print('Error in SQLiteCatalogue.getNumImagesInSeries: ' + str(e))
+            logger.error('Error in SQLiteCatalogue.getNumImagesInSeries: ' + str(e))
+
+
+def convertXMLToSQLite(xmlFile, dbFile=None):
+    """Writes the contents of the XML file, xmlFile, to an SQLite catalogue and returns the path of the catalogue"""
+    try:
+        logger.info("SQLiteCatalogue.convertXMLToSQLite called")
+        if dbFile is None:
+            dbFile = getCatalogueFilePath(xmlFile)
+        catalogue = SQLiteCatalogue(dbFile)
+        catalogue.writeTree(ET.parse(xmlFile).getroot(), xmlFile=xmlFile)
+        catalogue.close()
+        return dbFile
+    except Exception as e:
+        print('Error in SQLiteCatalogue.convertXMLToSQLite: ' + str(e))
+        logger.error('Error in SQLiteCatalogue.convertXMLToSQLite: ' + str(e))
+
+
+def convertSQLiteToXML(dbFile, xmlFile=None):
+    """Writes the contents of the SQLite catalogue, dbFile, to an XML file and returns the path of the XML file"""
+    try:
+        logger.info("SQLiteCatalogue.convertSQLiteToXML called")
+        if xmlFile is None:
+            xmlFile = os.path.splitext(dbFile)[0] + ".xml"
+        catalogue = SQLiteCatalogue(dbFile)
+        ET.ElementTree(catalogue.readTree()).write(xmlFile)
+        # The catalogue now holds the present version of the XML file
+        catalogue.execute([fileStampStatement(xmlFile)])
+        catalogue.close()
+        return xmlFile
+    except Exception as e:
+        print('Error in SQLiteCatalogue.convertSQLiteToXML: ' + str(e))
+        logger.error('Error in SQLiteCatalogue.convertSQLiteToXML: ' + str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts the XML file of a DICOM folder into an SQLite catalogue (.db) or back.")
+    parser.add_argument("input_file", help="the .xml file to convert to SQLite or the .db file to convert to XML")
+    parser.add_argument("output_file", nargs="?", default=None, help="the file to write, next to the input file by default")
+    args = parser.parse_args()
+    if args.input_file.endswith(".xml"):
+        print(convertXMLToSQLite(args.input_file, args.output_file))
+    elif args.input_file.endswith(CATALOGUE_FILE_SUFFIX):
+        print(convertSQLiteToXML(args.input_file, args.output_file))
+    else:
+        parser.error("the input file must be an .xml or a " + CATALOGUE_FILE_SUFFIX + " file")
+
+
+if __name__ == '__main__':
+    main()
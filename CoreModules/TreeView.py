@@ -36,6 +36,9 @@ class TreeView():
             if os.path.exists(XML_File_Path):
                 QApplication.setOverrideCursor(Qt.WaitCursor)
                 self.weasel = weasel
+                if getattr(self.weasel, 'objXMLReader', None) is not None:
+                    # The XML file may have just been rebuilt, so the previous tree is not saved over it
+                    self.weasel.objXMLReader.close(save=False)
                 self.weasel.objXMLReader = WeaselXMLReader(weasel, XML_File_Path)
                 self.treeViewColumnWidths = { 1: 0, 2: 0, 3: 0} 
 
@@ -327,7 +330,7 @@ class TreeView():
         containing the DICOM data displayed in the tree view.
         """
         try:
-            self.weasel.objXMLReader.save()
+            self.weasel.objXMLReader.close()
             self.weasel.objXMLReader = None
             self.treeViewWidget.clear()
             self.treeViewWidget.close()
@@ -467,7 +470,7 @@ class TreeView():
                 checkedState = 'True' 
             else:
                 checkedState = 'False'
-            item.element.set('checked', checkedState)
+            self.weasel.objXMLReader.setChecked(item.element, checkedState)
         except Exception as e:
                 print('Error in TreeView.saveCheckedState: ' + str(e))
                 logger.exception('Error in TreeView.saveCheckedState: ' + str(e))
@@ -3,9 +3,15 @@ Class for reading, editing and writing to the XML file summarising
 the contents of a DICOM folder.
 """
 import xml.etree.cElementTree as ET  
+import os
+import atexit
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
+import DICOM.MetadataIndex as MetadataIndex
+import CoreModules.SQLiteCatalogue as SQLiteCatalogue
 from DICOM.Classes import (ImagesList, SeriesList, StudyList, SubjectList, Image, Series, Study, Subject)
 
 
@@ -13,30 +19,161 @@ logger = logging.getLogger(__name__)
 
 __author__ = "Steve Shillitoe"
 
+# The readers that are open, so that they can be closed when Weasel exits
+_openReaders = weakref.WeakSet()
+
+
+def closeReaders():
+    """Closes the WeaselXMLReader objects that are still open, saving their trees"""
+    for reader in list(_openReaders):
+        reader.close()
+
+
+atexit.register(closeReaders)
+
 class WeaselXMLReader:
     """Reads, edits and writes the XML file summarising the DICOM folder.
 
     WeaselXMLReader represents the XML file in memory as an ElementTree,
     and uses the ElementTree functionality to edit the XML file. 
+
+    If the catalogue backend is 'sqlite', the tree is loaded from and saved to 
+    an SQLite catalogue next to the XML file instead (see SQLiteCatalogue.py),
+    and only the changes made since the last save are written. The XML file 
+    is then brought up to date when the reader is closed. The checkedImages, 
+    checkedSeries, checkedStudies, checkedSubjects, getImagePathList and 
+    getNumImagesInSeries queries are then answered by the catalogue.
     """
-    def __init__(self, weasel, xml_file): 
+    def __init__(self, weasel, xml_file, catalogue=None): 
         """ Initialise an object of  WeaselXMLReader class
 
         Input arguments
         -----------------
         weasel: instance of Weasel
         xml_file: the XML file to be represented
+        catalogue: 'xml' or 'sqlite'. By default, the catalogue backend in config.xml is used.
         """
         try:
             self.weasel = weasel
             self.file = xml_file
-            self.tree = ET.parse(xml_file)
+            self.catalogue = None
+            self.catalogueChanges = None
+            self.xmlFileStale = False
+            if catalogue is None:
+                catalogue = self._getCatalogueBackend()
+            if catalogue == 'sqlite':
+                self.catalogue = SQLiteCatalogue.SQLiteCatalogue(SQLiteCatalogue.getCatalogueFilePath(xml_file))
+                _openReaders.add(self)
+            if self.catalogue is not None and self.catalogue.isCurrent(xml_file):
+                self.tree = ET.ElementTree(self.catalogue.readTree())
+            else:
+                self.tree = ET.parse(xml_file)
+                if self.catalogue is not None:
+                    self.catalogue.writeTree(self.tree.getroot(), xmlFile=xml_file)
             self.root = self.tree.getroot()
+            self.buildHierarchyIndex()
+            self.rewriteCatalogue = False
+            self.dirty = False
+            self.transactionDepth = 0
+            self.queuedRemovals = []
+            MetadataIndex.loadIndex(xml_file)
             logger.info('In module ' + __name__ + ' Created XML Reader Object')
         except Exception as e:
             print('Error in WeaselXMLReader.__init__: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.__init__: ' + str(e)) 
-            
+
+
+    def buildHierarchyIndex(self):
+        """
+        Builds the dictionaries used to look up elements of the XML tree without searching it.
+
+        elementIndex maps (subjectID,), (subjectID, studyID) and (subjectID, studyID, seriesID)
+        to the subject, study and series elements, elementIDs maps these elements back to their IDs
+        and imageIndex maps an image file path to its image element and its parent IDs.
+        This method must be called again if the XML tree is edited from outside this class.
+        """
+        try:
+            self.elementIndex = {}
+            self.elementIDs = {}
+            self.imageIndex = {}
+            # The edits of the tree are not recorded while the index is built,
+            # the whole tree is written to the SQLite catalogue on the next save instead
+            self.catalogueChanges = None
+            # Reversed, so that the first of any duplicate IDs is kept, as with XPath find
+            for subject in reversed(list(self.root)):
+                self._addToIndex(subject, reverse=True)
+            if self.catalogue is not None:
+                self.catalogueChanges = []
+                self.rewriteCatalogue = True
+        except Exception as e:
+            print('Error in WeaselXMLReader.buildHierarchyIndex: ' + str(e))
+            logger.error('Error in WeaselXMLReader.buildHierarchyIndex: ' + str(e))
+
+
+    def _getCatalogueBackend(self):
+        """
+        Returns the catalogue backend set in config.xml, 'xml' or 'sqlite'
+        """
+        objConfigXMLReader = getattr(self.weasel, 'objConfigXMLReader', None)
+        if objConfigXMLReader is None:
+            return 'xml'
+        return objConfigXMLReader.getCatalogueBackend()
+
+
+    def _addToIndex(self, element, parentIDs=(), reverse=False):
+        """
+        Adds an element of the XML tree and all its children to the lookup dictionaries
+        and marks the tree as changed. parentIDs is the tuple of IDs of the element's parents.
+        """
+        self.dirty = True
+        if self.catalogueChanges is not None:
+            self.catalogueChanges.append(SQLiteCatalogue.insertStatement(element, parentIDs))
+        if element.tag == 'image':
+            self.imageIndex[element.find('name').text] = (element, parentIDs)
+        else:
+            ids = parentIDs + (element.attrib['id'],)
+            self.elementIndex[ids] = element
+            self.elementIDs[element] = ids
+            children = reversed(list(element)) if reverse else element
+            for child in children:
+                self._addToIndex(child, ids, reverse=reverse)
+
+
+    def _removeFromIndex(self, element, parentIDs=()):
+        """
+        Removes an element of the XML tree and all its children from the lookup dictionaries
+        and marks the tree as changed. parentIDs is the tuple of IDs of the element's parents.
+        """
+        self.dirty = True
+        if self.catalogueChanges is not None:
+            self.catalogueChanges.append(SQLiteCatalogue.deleteStatement(element, parentIDs))
+        if element.tag == 'image':
+            imagePath = element.find('name').text
+            if imagePath in self.imageIndex and self.imageIndex[imagePath][0] is element:
+                del self.imageIndex[imagePath]
+        else:
+            ids = parentIDs + (element.attrib['id'],)
+            if self.elementIndex.get(ids) is element:
+                del self.elementIndex[ids]
+            self.elementIDs.pop(element, None)
+            for child in element:
+                self._removeFromIndex(child, ids)
+
+
+    def _getImage(self, subjectID, studyID, seriesID, imageName):
+        """
+        Returns the image element with the file path imageName in a specific series
+        """
+        entry = self.imageIndex.get(imageName)
+        if entry is not None and entry[1] == (subjectID, studyID, seriesID):
+            return entry[0]
+        # The same file can be listed in more than one series
+        series = self.getSeries(subjectID, studyID, seriesID)
+        if series is not None:
+            for image in series:
+                if image.find('name').text == imageName:
+                    return image
+
 
     def __repr__(self):
        """Represents this class's objects as a string"""
@@ -48,18 +185,123 @@ class WeaselXMLReader:
     def save(self):
         """
         Saves the contents of the XML tree in memory to a physical file.
+
+        Nothing is written if the tree has not changed since it was last saved 
+        or inside a transaction, which saves the tree when it ends. 
+        The tree is written to a temporary file first, which then replaces the XML file, 
+        so that the XML file is never left half written.
+        With an SQLite catalogue, only the changes since the last save are written to the catalogue.
         """
         try:
-            self.tree.write(self.file)
+            if not self.dirty or self.transactionDepth > 0:
+                return
+            if self.catalogue is not None:
+                if self.rewriteCatalogue:
+                    self.catalogue.writeTree(self.root, xmlFile=self.file)
+                else:
+                    self.catalogue.execute(self.catalogueChanges)
+                self.catalogueChanges = []
+                self.rewriteCatalogue = False
+                self.xmlFileStale = True
+            else:
+                self._writeXMLFile()
+            self.dirty = False
         except Exception as e:
             print('Error in WeaselXMLReader.saveXMLFile: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.saveXMLFile: ' + str(e))
 
-    
+
+    def _writeXMLFile(self):
+        """
+        Writes the XML tree to a temporary file, which then replaces the XML file
+        """
+        tempFile = self.file + '.tmp'
+        self.tree.write(tempFile)
+        os.replace(tempFile, self.file)
+
+
+    def close(self, save=True):
+        """
+        Saves the tree, unless save is False, and closes the SQLite catalogue.
+
+        If the tree was only saved to the catalogue, the XML file is written too, 
+        unless it was rewritten since the catalogue was loaded (by makeDICOM_XML_File, 
+        for example), in which case it is newer than the tree and is left as it is.
+        """
+        try:
+            if save:
+                self.save()
+            if self.catalogue is not None:
+                if self.xmlFileStale and not self.dirty and self.catalogue.isCurrent(self.file):
+                    self._writeXMLFile()
+                    self.catalogue.execute([SQLiteCatalogue.fileStampStatement(self.file)])
+                self.xmlFileStale = False
+                self.catalogue.close()
+                self.catalogue = None
+                self.catalogueChanges = None
+            _openReaders.discard(self)
+        except Exception as e:
+            print('Error in WeaselXMLReader.close: ' + str(e)) 
+            logger.error('Error in WeaselXMLReader.close: ' + str(e))
+
+
+    def setChecked(self, element, checkedState):
+        """
+        Sets the checked state, 'True' or 'False', of a subject, study, series or image element.
+        """
+        try:
+            element.set('checked', checkedState)
+            self.dirty = True
+            if self.catalogueChanges is not None:
+                self.catalogueChanges.append(SQLiteCatalogue.checkedStatement(element.tag, self.objectID(element), checkedState))
+        except Exception as e:
+            print('Error in WeaselXMLReader.setChecked: ' + str(e))
+            logger.error('Error in WeaselXMLReader.setChecked: ' + str(e))
+
+
+    def _useCatalogue(self):
+        """
+        Returns True if queries can be answered by the SQLite catalogue, after saving to it
+        the edits of the tree. Inside a transaction, queries are answered from the tree.
+        """
+        if self.catalogue is None or self.transactionDepth > 0:
+            return False
+        self.save()
+        return not self.dirty
+
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups edits of the XML tree, for example
+
+            with weasel.objXMLReader.transaction():
+                for series in weasel.series():
+                    series.delete()
+
+        Image removals are queued until the end of the transaction and then applied 
+        together in one pass. The XML file is saved once when the transaction ends.
+        Transactions can be nested, in which case the outermost one applies the changes.
+        """
+        self.transactionDepth += 1
+        try:
+            yield self
+        finally:
+            self.transactionDepth -= 1
+            if self.transactionDepth == 0:
+                queuedRemovals, self.queuedRemovals = self.queuedRemovals, []
+                self._removeImagesFromXML(queuedRemovals)
+                self.save()
+
+
     def checkedImages(self, root=None):
         """
         Returns a list of images checked by the user.
         """
+        if root is None and self._useCatalogue():
+            ids = self.catalogue.checkedIDs('image')
+            if ids is not None:
+                return ImagesList([Image(self.weasel, *id) for id in ids])
         list = []
         if root is None:
             root = self.root
@@ -75,6 +317,10 @@ class WeaselXMLReader:
         """
         Returns a list of  series checked by the user.
         """
+        if root is None and self._useCatalogue():
+            seriesList = self.catalogue.checkedSeriesImages()
+            if seriesList is not None:
+                return SeriesList([Series(self.weasel, *id, listPaths=images) for id, images in seriesList])
         list = []
         if root is None:
             root = self.root
@@ -91,6 +337,10 @@ class WeaselXMLReader:
         """
         Returns a list of studies checked by the user.
         """
+        if root is None and self._useCatalogue():
+            ids = self.catalogue.checkedIDs('study')
+            if ids is not None:
+                return StudyList([Study(self.weasel, *id) for id in ids])
         list = []
         if root is None:
             root = self.root
@@ -106,6 +356,10 @@ class WeaselXMLReader:
         """
         Returns a list of  subjects checked by the user.
         """
+        if self._useCatalogue():
+            ids = self.catalogue.checkedIDs('subject')
+            if ids is not None:
+                return SubjectList([Subject(self.weasel, *id) for id in ids])
         list = []
         root = self.root
         for subject in root.iter('subject'):
@@ -130,6 +384,10 @@ class WeaselXMLReader:
         *******
         The number of images in a series
         """
+        if self._useCatalogue():
+            numImages = self.catalogue.getNumImagesInSeries(subjectID, studyID, seriesID)
+            if numImages is not None:
+                return numImages
         return len(self._getImageList(subjectID, studyID, seriesID))
 
 
@@ -149,11 +407,10 @@ class WeaselXMLReader:
         """
         try:
             #print("getImageList: studyID={}, seriesID={}".format(studyID, seriesID))
-
-            xPath = './/subject[@id='+ chr(34) + subjectID + chr(34) + \
-                    ']/study[@id=' + chr(34) + studyID + chr(34) + \
-                    ']/series[@id=' + chr(34) + seriesID + chr(34) + ']/image'        
-            return self.root.findall(xPath)
+            series = self.getSeries(subjectID, studyID, seriesID)
+            if series is None:
+                return []
+            return series.findall('image')
         except Exception as e:
             print('Error in WeaselXMLReader.getImageList: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getImageList: ' + str(e))
@@ -164,9 +421,7 @@ class WeaselXMLReader:
         Returns the subject with the ID, subjectID
         """
         try:
-            xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) + ']'
-            #print(xPath)
-            return self.root.find(xPath)
+            return self.elementIndex.get((subjectID,))
         except Exception as e:
             print('Error in WeaselXMLReader.getSubject: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getSubject: ' + str(e))
@@ -177,10 +432,7 @@ class WeaselXMLReader:
         Returns the study with the ID, studyID
         """
         try:
-            xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) +  \
-                    ']/study[@id=' + chr(34) + studyID + chr(34) + ']'
-            #print(xPath)
-            return self.root.find(xPath)
+            return self.elementIndex.get((subjectID, studyID))
         except Exception as e:
             print('Error in WeaselXMLReader.getStudy: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getStudy: ' + str(e))
@@ -191,11 +443,7 @@ class WeaselXMLReader:
         Returns the series with the ID, seriesID
         """
         try: 
-            xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) + ']' \
-                    '/study[@id=' + chr(34) + studyID + chr(34) + ']' + \
-                    '/series[@id=' + chr(34) + seriesID + chr(34) + ']'
-            #print ("get series Xpath = {}".format(xPath))
-            return self.root.find(xPath)
+            return self.elementIndex.get((subjectID, studyID, seriesID))
         except Exception as e:
             print('Error in WeaselXMLReader.getSeries: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getSeries_: ' + str(e))
@@ -221,11 +469,7 @@ class WeaselXMLReader:
             if imageName is None:
                 return "000000"
             else:
-                xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) +  \
-                        ']/study[@id=' + chr(34) + studyID + chr(34) + \
-                        ']/series[@id=' + chr(34) + seriesID + chr(34)  + \
-                        ']/image[name=' + chr(34) + imageName + chr(34) +']/label'
-                return self.root.find(xPath).text
+                return self._getImage(subjectID, studyID, seriesID, imageName).find('label').text
         except Exception as e:
             print('Error in WeaselXMLReader.getImageLabel: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getImageLabel: ' + str(e))
@@ -252,11 +496,7 @@ class WeaselXMLReader:
                 now = datetime.now()
                 return now.strftime("%H:%M:%S")
             else:
-                xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) +  \
-                        ']/study[@id=' + chr(34) + studyID + chr(34) + \
-                        ']/series[@id=' + chr(34) + seriesID + chr(34)  + \
-                        ']/image[name=' + chr(34) + imageName + chr(34) +']/time'
-                return self.root.find(xPath).text
+                return self._getImage(subjectID, studyID, seriesID, imageName).find('time').text
         except Exception as e:
             print('Error in WeaselXMLReader.getImageTime: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getImageTime: ' + str(e))
@@ -283,11 +523,7 @@ class WeaselXMLReader:
                 now = datetime.now()
                 return now.strftime("%d/%m/%Y") 
             else:
-                xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) +  \
-                        ']/study[@id=' + chr(34) + studyID + chr(34) + \
-                        ']/series[@id=' + chr(34) + seriesID + chr(34)  + \
-                        ']/image[name=' + chr(34) + imageName + chr(34) +']/date'
-                return self.root.find(xPath).text   
+                return self._getImage(subjectID, studyID, seriesID, imageName).find('date').text   
         except Exception as e:
             print('Error in WeaselXMLReader.getImageDate: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getImageDate: ' + str(e))
@@ -308,11 +544,11 @@ class WeaselXMLReader:
         list of the image file paths
         """
         try:
-            xPath = './/subject[@id=' + chr(34) + subjectID + chr(34) +  \
-                    ']/study[@id=' + chr(34) + studyID + chr(34) + \
-                    ']/series[@id=' + chr(34) + seriesID + chr(34) + ']/image'
-            # print(xPath)
-            images = self.root.findall(xPath)
+            if self._useCatalogue():
+                imageList = self.catalogue.getImagePathList(subjectID, studyID, seriesID)
+                if imageList is not None:
+                    return imageList
+            images = self._getImageList(subjectID, studyID, seriesID)
             #print("images={}".format(images))
             imageList = [image.find('name').text for image in images]
             #print("length imageList={}".format(len(imageList)))
@@ -337,22 +573,10 @@ class WeaselXMLReader:
         seriesID - ID of the series the image belongs to
         """
         try:
-            xPathSubject = './/subject/study/series/image[name=' + chr(34) + imageName + chr(34) +']/../../..'
-            if self.root.find(xPathSubject):
-                subjectID = self.root.find(xPathSubject).attrib['id']
-            else:
-                subjectID = None
-            xPathStudy = './/subject/study/series/image[name=' + chr(34) + imageName + chr(34) +']/../..'
-            if self.root.find(xPathStudy):
-                studyID = self.root.find(xPathStudy).attrib['id']
-            else:
-                studyID = None
-            xPathSeries = './/subject/study/series/image[name=' + chr(34) + imageName + chr(34) +']/..'
-            if self.root.find(xPathSeries):
-                seriesID = self.root.find(xPathSeries).attrib['id']
-            else:
-                seriesID = None
-            return (subjectID, studyID, seriesID)
+            entry = self.imageIndex.get(imageName)
+            if entry is None:
+                return (None, None, None)
+            return entry[1]
         except Exception as e:
             print('Error in WeaselXMLReader.getImageParentIDs: ' + str(e)) 
             logger.error('Error in WeaselXMLReader.getImageParentIDs: ' + str(e))
@@ -383,6 +607,13 @@ class WeaselXMLReader:
 
     def objectID(self, elem):
         """Returns the ID as currently used within weasel as a list"""
+        if elem.tag == 'image':
+            imageName = elem.find('name').text
+            entry = self.imageIndex.get(imageName)
+            if entry is not None and entry[0] is elem:
+                return list(entry[1]) + [imageName]
+        elif elem in self.elementIDs:
+            return list(self.elementIDs[elem])
         branch = self.branch(elem)
         if len(branch) == 2:
             return [branch[1].attrib['id']]
@@ -403,6 +634,7 @@ class WeaselXMLReader:
             subject = self.getSubject(subjectID)
             if subject:
                 self.root.remove(subject)
+                self._removeFromIndex(subject)
             else:
                 print("Unable to remove subject {}".format(subjectID))
         except Exception as e:
@@ -425,6 +657,7 @@ class WeaselXMLReader:
             study = self.getStudy(subjectID, studyID)
             if study and subject:
                 subject.remove(study)
+                self._removeFromIndex(study, (subjectID,))
             else:
                 print("Unable to remove study {}".format(studyID))
         except AttributeError as e:
@@ -451,6 +684,7 @@ class WeaselXMLReader:
             series = self.getSeries(subjectID, studyID, seriesID)
             if study and series:
                 study.remove(series)
+                self._removeFromIndex(series, (subjectID, studyID))
             else:
                 print("Unable to remove series {}".format(seriesID))
         except AttributeError as e:
@@ -478,6 +712,7 @@ class WeaselXMLReader:
                 for image in series:
                     if image.find('name').text == imagePath:
                         series.remove(image)
+                        self._removeFromIndex(image, (subjectID, studyID, seriesID))
                         break
         except Exception as e:
             print('Error in WeaselXMLReader.removeOneImageFromSeries: ' + str(e)) 
@@ -536,6 +771,9 @@ class WeaselXMLReader:
         """
         try:
             logger.info("WeaselXMLReader removeImageFromXMLFile called")
+            if self.transactionDepth > 0:
+                self.queuedRemovals.append(imageFileName)
+                return
             (subjectID, studyID, seriesID) = self.getImageParentIDs(imageFileName)
             images = self._getImageList(subjectID, studyID, seriesID)
             if len(images) == 1:
@@ -557,13 +795,51 @@ class WeaselXMLReader:
         """
         try:
             logger.info("WeaselXMLReader removeMultipleImagesFromXMLFile called")
-            for image in origImageList:
-                self.removeImageFromXMLFile(image)
+            if self.transactionDepth > 0:
+                self.queuedRemovals.extend(origImageList)
+            else:
+                self._removeImagesFromXML(origImageList)
         except Exception as e:
             print('Error in WeaselXMLReader removeMultipleImagesFromXMLFile: ' + str(e))
             logger.error('Error in WeaselXMLReader removeMultipleImagesFromXMLFile: ' + str(e))
 
 
+    def _removeImagesFromXML(self, imagePathList):
+        """
+        Removes a list of images from the XML tree in one pass.
+
+        The images are grouped by series so that each series is rebuilt once, 
+        and the series, studies and subjects left empty are removed as well.
+        """
+        try:
+            imagesToRemove = {}
+            for imagePath in imagePathList:
+                entry = self.imageIndex.get(imagePath)
+                if entry is not None:
+                    imagesToRemove.setdefault(entry[1], set()).add(entry[0])
+            for (subjectID, studyID, seriesID), images in imagesToRemove.items():
+                series = self.getSeries(subjectID, studyID, seriesID)
+                if series is None:
+                    continue
+                for image in images:
+                    self._removeFromIndex(image, (subjectID, studyID, seriesID))
+                series[:] = [image for image in series if image not in images]
+                if len(series) == 0:
+                    study = self.getStudy(subjectID, studyID)
+                    study.remove(series)
+                    self._removeFromIndex(series, (subjectID, studyID))
+                    if len(study) == 0:
+                        subject = self.getSubject(subjectID)
+                        subject.remove(study)
+                        self._removeFromIndex(study, (subjectID,))
+                        if len(subject) == 0:
+                            self.root.remove(subject)
+                            self._removeFromIndex(subject)
+        except Exception as e:
+            print('Error in WeaselXMLReader._removeImagesFromXML: ' + str(e))
+            logger.error('Error in WeaselXMLReader._removeImagesFromXML: ' + str(e))
+
+
     def moveImageInXMLFile(self, subjectID, studyID, seriesID, newSubjectID, newStudyID, newSeriesID, imageName, suffix):
         """
         Moves an image from one series to another.
@@ -620,12 +896,14 @@ class WeaselXMLReader:
             logger.error('Error in WeaselXMLReader.insertNewStudyInXMLFile: ' + str(e))
 
 
-    def insertNewSeriesInXMLFile(self, origImageList, newImageList, suffix, newSeriesName=None, newStudyName=None, newSubjectName=None):
+    def insertNewSeriesInXMLFile(self, origImageList, newImageList, suffix, newSeriesName=None, newStudyName=None, newSubjectName=None, imageLabels=None):
         """
         Creates a new series to hold a series of New images.
 
         If a new study name is specified, 
         then the new series is created within a new study.
+        imageLabels is the list of the instance numbers of the new images. By default, 
+        the new images have the labels of the images in origImageList, as copies do.
         """
         try:
             logger.info("InterfaceDICOMXMLFile insertNewSeriesInXMLFile called")
@@ -635,7 +913,7 @@ class WeaselXMLReader:
             if newSubjectName is not None: subjectID = newSubjectName
             newSeriesID = self.getNewSeriesName(subjectID, studyID, dataset, suffix, newSeriesName=newSeriesName) # If developer sets seriesName
             self.insertNewSeriesInXML(origImageList, 
-                        newImageList, subjectID, studyID, newSeriesID, seriesID, suffix)
+                        newImageList, subjectID, studyID, newSeriesID, seriesID, suffix, imageLabels=imageLabels)
             if self.weasel is None:
                 print('New series created: - ' + newSeriesID)
             else:
@@ -670,6 +948,7 @@ class WeaselXMLReader:
         the list newStudiesList
         """
         newSubject = ET.SubElement(self.root, 'subject', newAttributes)
+        self._addToIndex(newSubject)
         for newStudy in newStudiesList:
             dataset = ReadDICOM_Image.getDicomDataset(newStudy[0][0])
             newStudyID = str(dataset.StudyDate) + "_" + str(dataset.StudyTime).split(".")[0] + "_" + str(dataset.StudyDescription)
@@ -697,6 +976,7 @@ class WeaselXMLReader:
             if currentSubject is not None:
                 #Add new study to subject to hold new series+images
                 newStudy = ET.SubElement(currentSubject, 'study', newAttributes)
+                self._addToIndex(newStudy, (subjectID,))
                 for newSeries in newSeriesList:
                     dataset = ReadDICOM_Image.getDicomDataset(newSeries[0])
                     newSeriesID = str(dataset.SeriesNumber) + "_" + str(dataset.SeriesDescription)
@@ -711,10 +991,12 @@ class WeaselXMLReader:
 
 
     def insertNewSeriesInXML(self, origImageList, newImageList, subjectID,
-                     studyID, newSeriesID, seriesID, suffix):
+                     studyID, newSeriesID, seriesID, suffix, imageLabels=None):
         """
         Inserts a new series in the XML tree and populates it with new images
         that have the same attributes as an existing series of images.
+        The labels of the new images are the instance numbers in imageLabels or, 
+        by default, the labels of the images in origImageList, so the new files are not read.
         """
         try:
             dataset = ReadDICOM_Image.getDicomDataset(newImageList[0])
@@ -727,14 +1009,17 @@ class WeaselXMLReader:
             if currentStudy is not None:
                 #Add new series to study to hold new images
                 newSeries = ET.SubElement(currentStudy, 'series', newAttributes)
+                self._addToIndex(newSeries, (subjectID, studyID))
                 #Get image date & time from original image
                 for index, imageNewName in enumerate(newImageList):
-                    subjectID_Original, studyID_Original, seriesID_Original = self.getImageParentIDs(origImageList[index])
-                    if subjectID_Original is None or studyID_Original is None or seriesID_Original is None:
-                        imageLabel = str(index + 1).zfill(6) # + suffix
+                    if imageLabels is not None:
+                        imageLabel = str(imageLabels[index]).zfill(6)
                     else:
-                        imageLabel = str(ReadDICOM_Image.getImageTagValue(newImageList[index], 'InstanceNumber')).zfill(6)
-                        #imageLabel = self.getImageLabel(subjectID_Original, studyID_Original, seriesID_Original, origImageList[index])
+                        subjectID_Original, studyID_Original, seriesID_Original = self.getImageParentIDs(origImageList[index])
+                        if subjectID_Original is None or studyID_Original is None or seriesID_Original is None:
+                            imageLabel = str(index + 1).zfill(6) # + suffix
+                        else:
+                            imageLabel = self.getImageLabel(subjectID_Original, studyID_Original, seriesID_Original, origImageList[index])
                     imageTime = self._getImageTime(subjectID, studyID, seriesID)
                     imageDate = self._getImageDate(subjectID, studyID, seriesID)
                     newAttributes = {'checked':'False'}
@@ -749,6 +1034,7 @@ class WeaselXMLReader:
                     timeNewImage.text = imageTime
                     dateNewImage = ET.SubElement(newImage, 'date')
                     dateNewImage.text = imageDate
+                    self._addToIndex(newImage, (subjectID, studyID, newSeriesID))
             else:
                 self.insertNewStudyinXML([newImageList], subjectID, studyID, suffix)
                 #self.insertNewStudyinXML([[]], subjectID, studyID, '')
@@ -816,6 +1102,7 @@ class WeaselXMLReader:
 
                 #Add new series to study to hold new images
                 newSeries = ET.SubElement(currentStudy, 'series', newAttributes)     
+                self._addToIndex(newSeries, (subjectID, studyID))
                 #print("image time {}, date {}".format(imageTime, imageDate))
                 #Now add image element
                 newAttributes = {'checked':'False'}
@@ -830,6 +1117,7 @@ class WeaselXMLReader:
                 timeNewImage.text = imageTime
                 dateNewImage = ET.SubElement(newImage, 'date')
                 dateNewImage.text = imageDate
+                self._addToIndex(newImage, (subjectID, studyID, newSeriesID))
                 return newSeriesID
             else:
                 #A series already exists to hold new images from
@@ -847,6 +1135,7 @@ class WeaselXMLReader:
                 timeNewImage.text = imageTime
                 dateNewImage = ET.SubElement(newImage, 'date')
                 dateNewImage.text = imageDate
+                self._addToIndex(newImage, (subjectID, studyID, series.attrib['id']))
                 return series.attrib['id']
         except Exception as e:
             print('Error in WeaselXMLReader.insertNewImageInXML: ' + str(e)) 
@@ -867,7 +1156,10 @@ class WeaselXMLReader:
                 except:
                     newName = str(ReadDICOM_Image.getDicomDataset(imageList[0]).ProtocolName) if series_name is None else str(series_name)
             xmlSeriesName = seriesNumber + "_" + newName
-            self.getSeries(subjectID, studyID, seriesID).attrib['id'] = xmlSeriesName
+            series = self.getSeries(subjectID, studyID, seriesID)
+            self._removeFromIndex(series, (subjectID, studyID))
+            series.attrib['id'] = xmlSeriesName
+            self._addToIndex(series, (subjectID, studyID))
         except Exception as e:
             print('Error in InterfaceDICOMXMLFile removeOneSeriesFromStudy: ' + str(e))
             logger.error('Error in InterfaceDICOMXMLFile removeOneSeriesFromStudy: ' + str(e))
@@ -10,16 +10,25 @@ import pathlib
 import subprocess
 import re
 import datetime
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pydicom import Dataset, DataElement, dcmread
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 from collections import defaultdict
 from PyQt5.QtWidgets import (QApplication, QFileDialog, QMessageBox)
+import DICOM.MetadataIndex as MetadataIndex
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Number of files read between two updates of the progress bar
+PROGRESS_BAR_BATCH = 50
+# Number of files submitted to each thread of the pool before their results are collected
+MAX_FILES_IN_FLIGHT_PER_WORKER = 4
+
 
 def get_files_info(scan_directory):
     """This method returns the number of files and subfolders in a folder. It doesn't mean that they are all DICOM.
@@ -76,9 +85,73 @@ def scan_tree(scan_directory):
             yield entry
 
 
-def get_scan_data(scan_directory, progBarMsg, self):
+def read_dicom_header(filepath, list_tags):
+    """This method reads the tags in list_tags of the DICOM file in filepath. If the file has no
+        Series or Study Description, these are added to the file. It returns None if the file can't be read.
+    """
+    try:
+        dataset = dcmread(filepath, specific_tags=list_tags) # Check the force=True flag once in a while
+        if not hasattr(dataset, 'SeriesDescription') and not hasattr(dataset, 'StudyDescription'):
+            elemSeries = DataElement(0x0008103E, 'LO', 'No Series Description')
+            elemStudy = DataElement(0x00081030, 'LO', 'No Study Description')
+            with dcmread(filepath, force=True) as ds:
+                ds.add(elemSeries)
+                ds.add(elemStudy)
+                ds.save_as(filepath)
+            dataset.SeriesDescription = 'No Series Description'
+            dataset.StudyDescription = 'No Study Description'
+        elif not hasattr(dataset, 'SeriesDescription'):
+            elem = DataElement(0x0008103E, 'LO', 'No Series Description')
+            with dcmread(filepath, force=True) as ds:
+                ds.add(elem)
+                ds.save_as(filepath)
+            dataset.SeriesDescription = 'No Series Description'
+        elif not hasattr(dataset, 'StudyDescription'):
+            elem = DataElement(0x00081030, 'LO', 'No Study Description')
+            with dcmread(filepath, force=True) as ds:
+                ds.add(elem)
+                ds.save_as(filepath)
+            dataset.StudyDescription = 'No Study Description'
+        return dataset
+    except:
+        return None
+
+
+def is_valid_dicom(dataset, filepath):
+    """This method returns True if the DICOM file in filepath, read into dataset, is an image that is listed in the XML file"""
+    return (hasattr(dataset, 'InstanceNumber') and hasattr(dataset, 'SOPInstanceUID') and 
+            any(hasattr(dataset, attr) for attr in ['PixelData', 'FloatPixelData', 'DoubleFloatPixelData'])
+            and ('DIRFILE' not in filepath) and ('DICOMDIR' not in filepath))
+
+
+def scan_headers(file_list, list_tags, parallel=True, max_workers=None):
+    """This method yields the tuple (filepath, dataset) for each file in file_list, in the same order as file_list.
+        If parallel=True, the headers are read by a pool of threads with a bounded number of files in flight,
+        so that the memory used doesn't depend on the number of files.
+    """
+    if not parallel:
+        for filepath in file_list:
+            yield filepath, read_dicom_header(filepath, list_tags)
+        return
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    files = iter(file_list)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for filepath in itertools.islice(files, max_workers * MAX_FILES_IN_FLIGHT_PER_WORKER):
+            pending.append((filepath, executor.submit(read_dicom_header, filepath, list_tags)))
+        while pending:
+            filepath, future = pending.popleft()
+            for nextFilepath in itertools.islice(files, 1):
+                pending.append((nextFilepath, executor.submit(read_dicom_header, nextFilepath, list_tags)))
+            yield filepath, future.result()
+
+
+def get_scan_data(scan_directory, progBarMsg, self, parallel=True, max_workers=None):
     """This method opens all DICOM files in the provided path recursively and saves 
         each file individually as a variable into a list/array.
+        If parallel=True, the DICOM headers are read in a pool of max_workers threads.
+        The progress bar is updated in batches of PROGRESS_BAR_BATCH files.
     """
     try:
         logger.info("WriteXMLfromDICOM.get_scan_data called")
@@ -90,36 +163,17 @@ def get_scan_data(scan_directory, progBarMsg, self):
         self.progress_bar(max=len(file_list), index=0, msg=progBarMsg, title="Loading DICOM")
         fileCounter = 0
         multiframeCounter = 0
-        for filepath in file_list:
+        list_tags = ['InstanceNumber', 'SOPInstanceUID', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData', 'AcquisitionTime',
+                     'AcquisitionDate', 'SeriesTime', 'SeriesDate', 'PatientName', 'PatientID', 'StudyDate', 'StudyTime', 
+                     'SeriesDescription', 'StudyDescription', 'SequenceName', 'ProtocolName', 'SeriesNumber', 'PerFrameFunctionalGroupsSequence',
+                     'StudyInstanceUID', 'SeriesInstanceUID'] + MetadataIndex.INDEX_TAGS
+        for filepath, dataset in scan_headers(file_list, list_tags, parallel=parallel, max_workers=max_workers):
             try:
                 fileCounter += 1
-                self.update_progress_bar(index=fileCounter)
-                list_tags = ['InstanceNumber', 'SOPInstanceUID', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData', 'AcquisitionTime',
-                             'AcquisitionDate', 'SeriesTime', 'SeriesDate', 'PatientName', 'PatientID', 'StudyDate', 'StudyTime', 
-                             'SeriesDescription', 'StudyDescription', 'SequenceName', 'ProtocolName', 'SeriesNumber', 'PerFrameFunctionalGroupsSequence',
-                             'StudyInstanceUID', 'SeriesInstanceUID']
-                dataset = dcmread(filepath, specific_tags=list_tags) # Check the force=True flag once in a while
-                if not hasattr(dataset, 'SeriesDescription') and not hasattr(dataset, 'StudyDescription'):
-                    elemSeries = DataElement(0x0008103E, 'LO', 'No Series Description')
-                    elemStudy = DataElement(0x00081030, 'LO', 'No Study Description')
-                    with dcmread(filepath, force=True) as ds:
-                        ds.add(elemSeries)
-                        ds.add(elemStudy)
-                        ds.save_as(filepath)
-                    dataset.SeriesDescription = 'No Series Description'
-                    dataset.StudyDescription = 'No Study Description'
-                elif not hasattr(dataset, 'SeriesDescription'):
-                    elem = DataElement(0x0008103E, 'LO', 'No Series Description')
-                    with dcmread(filepath, force=True) as ds:
-                        ds.add(elem)
-                        ds.save_as(filepath)
-                    dataset.SeriesDescription = 'No Series Description'
-                elif not hasattr(dataset, 'StudyDescription'):
-                    elem = DataElement(0x00081030, 'LO', 'No Study Description')
-                    with dcmread(filepath, force=True) as ds:
-                        ds.add(elem)
-                        ds.save_as(filepath)
-                    dataset.StudyDescription = 'No Study Description'
+                if fileCounter % PROGRESS_BAR_BATCH == 0 or fileCounter == len(file_list):
+                    self.update_progress_bar(index=fileCounter)
+                if dataset is None:
+                    continue
                 # If Multiframe, use dcm4che to split into single-frame
                 if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
                     multiframeCounter += 1
@@ -175,9 +229,7 @@ def get_scan_data(scan_directory, progBarMsg, self):
                         print('Error in dcm4che: Could not split the detected Multi-frame DICOM file.\n'\
                               'The DICOM file ' + filepath + ' was not deleted.')
                     continue
-                if (hasattr(dataset, 'InstanceNumber') and hasattr(dataset, 'SOPInstanceUID') and 
-                    any(hasattr(dataset, attr) for attr in ['PixelData', 'FloatPixelData', 'DoubleFloatPixelData'])
-                    and ('DIRFILE' not in filepath) and ('DICOMDIR' not in filepath)):
+                if is_valid_dicom(dataset, filepath):
                     list_paths.extend([filepath])
                     list_dicom.extend([dataset])
             except:
@@ -194,7 +246,7 @@ def get_scan_data(scan_directory, progBarMsg, self):
                     self.update_progress_bar(index=fileCounter)
                     list_tags = ['InstanceNumber', 'SOPInstanceUID', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData', 'SliceLocation', (0x2001, 0x100a),
                                  'AcquisitionTime', 'AcquisitionDate', 'SeriesTime', 'SeriesDate', 'PatientName', 'PatientID', 'StudyDate', 'StudyTime', 
-                                 'SeriesDescription', 'StudyDescription', 'SequenceName', 'ProtocolName', 'SeriesNumber', 'StudyInstanceUID', 'SeriesInstanceUID']
+                                 'SeriesDescription', 'StudyDescription', 'SequenceName', 'ProtocolName', 'SeriesNumber', 'StudyInstanceUID', 'SeriesInstanceUID'] + MetadataIndex.INDEX_TAGS
                     dataset = dcmread(singleframe, specific_tags=list_tags) # Check the force=True flag once in a while
                     # The multiframe converter stores SliceLocation in tag (0x2001, 0x100a), so this step is to store it in SliceLocation.
                     dicomTag = (0x2001, 0x100a)
@@ -205,9 +257,7 @@ def get_scan_data(scan_directory, progBarMsg, self):
                             ds.add(elem)
                             ds.save_as(singleframe)
                     dataset.SliceLocation = sliceValue
-                    if (hasattr(dataset, 'InstanceNumber') and hasattr(dataset, 'SOPInstanceUID') and 
-                        any(hasattr(dataset, attr) for attr in ['PixelData', 'FloatPixelData', 'DoubleFloatPixelData'])
-                        and ('DIRFILE' not in singleframe) and ('DICOMDIR' not in singleframe)):
+                    if is_valid_dicom(dataset, singleframe):
                         list_paths.extend([singleframe])
                         list_dicom.extend([dataset])
                 except:
@@ -293,45 +343,154 @@ def open_dicom_to_xml(xml_dict, list_dicom, list_paths):
             image_root = series_root.find(series_search_string)
             series_root.set('uid', study_uid)
             image_root.set('uid', series_uid)
-            image_element = ET.SubElement(image_root, 'image')
-            image_element.set('checked', 'False')  #added by SS 16.03.21
-            label = ET.SubElement(image_element, 'label')
-            name = ET.SubElement(image_element, 'name')
-            time = ET.SubElement(image_element, 'time')
-            date = ET.SubElement(image_element, 'date')
-            label.text = str(dicomfile.InstanceNumber).zfill(6)
-            #label.text = str(len(list(image_root.iter('image')))).zfill(6)
-            name.text = os.path.normpath(list_paths[index])
-            
-            # The next lines save the time and date to XML - They consider multiple/eventual formats
-            if len(dicomfile.dir("AcquisitionTime"))>0:
-                try:
-                    time.text = datetime.datetime.strptime(dicomfile.AcquisitionTime, '%H%M%S').strftime('%H:%M')
-                except:
-                    time.text = datetime.datetime.strptime(dicomfile.AcquisitionTime, '%H%M%S.%f').strftime('%H:%M')
-                try:
-                    date.text = datetime.datetime.strptime(dicomfile.AcquisitionDate, '%Y%m%d').strftime('%d/%m/%Y')
-                except:
-                    date.text = datetime.datetime.strptime(dicomfile.StudyDate, '%Y%m%d').strftime('%d/%m/%Y')
-            elif len(dicomfile.dir("SeriesTime"))>0:
-                # It means it's Enhanced MRI
-                try:
-                    time.text = datetime.datetime.strptime(dicomfile.SeriesTime, '%H%M%S').strftime('%H:%M')
-                except:
-                    time.text = datetime.datetime.strptime(dicomfile.SeriesTime, '%H%M%S.%f').strftime('%H:%M')
-                try:
-                    date.text = datetime.datetime.strptime(dicomfile.SeriesDate, '%Y%m%d').strftime('%d/%m/%Y')
-                except:
-                    date.text = datetime.datetime.strptime(dicomfile.StudyDate, '%Y%m%d').strftime('%d/%m/%Y')
-            else:
-                time.text = datetime.datetime.strptime('000000', '%H%M%S').strftime('%H:%M')
-                date.text = datetime.datetime.strptime('20000101', '%Y%m%d').strftime('%d/%m/%Y')
+            write_image_element(image_root, dicomfile, list_paths[index])
         return DICOM_XML_object
     except Exception as e:
         print('Error in WriteXMLfromDICOM.open_dicom_to_xml: ' + str(e))
         logger.exception('Error in WriteXMLfromDICOM.open_dicom_to_xml: ' + str(e))
 
 
+def write_image_element(image_root, dicomfile, filepath):
+    """This method appends to the series element image_root the image element 
+        that describes the DICOM file in filepath, read into dicomfile.
+    """
+    try:
+        image_element = ET.SubElement(image_root, 'image')
+        image_element.set('checked', 'False')  #added by SS 16.03.21
+        label = ET.SubElement(image_element, 'label')
+        name = ET.SubElement(image_element, 'name')
+        time = ET.SubElement(image_element, 'time')
+        date = ET.SubElement(image_element, 'date')
+        label.text = str(dicomfile.InstanceNumber).zfill(6)
+        #label.text = str(len(list(image_root.iter('image')))).zfill(6)
+        name.text = os.path.normpath(filepath)
+
+        # The next lines save the time and date to XML - They consider multiple/eventual formats
+        if len(dicomfile.dir("AcquisitionTime"))>0:
+            try:
+                time.text = datetime.datetime.strptime(dicomfile.AcquisitionTime, '%H%M%S').strftime('%H:%M')
+            except:
+                time.text = datetime.datetime.strptime(dicomfile.AcquisitionTime, '%H%M%S.%f').strftime('%H:%M')
+            try:
+                date.text = datetime.datetime.strptime(dicomfile.AcquisitionDate, '%Y%m%d').strftime('%d/%m/%Y')
+            except:
+                date.text = datetime.datetime.strptime(dicomfile.StudyDate, '%Y%m%d').strftime('%d/%m/%Y')
+        elif len(dicomfile.dir("SeriesTime"))>0:
+            # It means it's Enhanced MRI
+            try:
+                time.text = datetime.datetime.strptime(dicomfile.SeriesTime, '%H%M%S').strftime('%H:%M')
+            except:
+                time.text = datetime.datetime.strptime(dicomfile.SeriesTime, '%H%M%S.%f').strftime('%H:%M')
+            try:
+                date.text = datetime.datetime.strptime(dicomfile.SeriesDate, '%Y%m%d').strftime('%d/%m/%Y')
+            except:
+                date.text = datetime.datetime.strptime(dicomfile.StudyDate, '%Y%m%d').strftime('%d/%m/%Y')
+        else:
+            time.text = datetime.datetime.strptime('000000', '%H%M%S').strftime('%H:%M')
+            date.text = datetime.datetime.strptime('20000101', '%Y%m%d').strftime('%d/%m/%Y')
+        return image_element
+    except Exception as e:
+        print('Error in WriteXMLfromDICOM.write_image_element: ' + str(e))
+        logger.exception('Error in WriteXMLfromDICOM.write_image_element: ' + str(e))
+
+
+def insert_image_in_xml(DICOM_XML_object, dicomfile, filepath):
+    """This method adds the DICOM file in filepath, read into dicomfile, to an existing XML tree/structure,
+        creating the subject, study and series elements it belongs to if they are not in the tree yet.
+    """
+    try:
+        subject, study, sequence, series_number, study_uid, series_uid = get_study_series(dicomfile)
+        elements = {}
+        parent_element = DICOM_XML_object
+        for tag, element_id in [('subject', subject), ('study', study), ('series', series_number + "_" + sequence)]:
+            element = next((child for child in parent_element.findall(tag) if child.get('id') == element_id), None)
+            if element is None:
+                element = ET.SubElement(parent_element, tag)
+                element.set('id', element_id)
+                element.set('checked', 'False')
+            elements[tag] = element
+            parent_element = element
+        elements['study'].set('uid', study_uid)
+        elements['series'].set('uid', series_uid)
+        return write_image_element(elements['series'], dicomfile, filepath)
+    except Exception as e:
+        print('Error in WriteXMLfromDICOM.insert_image_in_xml: ' + str(e))
+        logger.exception('Error in WriteXMLfromDICOM.insert_image_in_xml: ' + str(e))
+
+
+def remove_images_from_xml(DICOM_XML_object, list_paths):
+    """This method removes the image elements of the files in list_paths from the XML tree/structure 
+        and then removes the series, studies and subjects left without images.
+    """
+    try:
+        paths_to_remove = set(map(os.path.normpath, list_paths))
+        for subject_element in DICOM_XML_object.findall('subject'):
+            for study_element in subject_element.findall('study'):
+                for series_element in study_element.findall('series'):
+                    for image_element in series_element.findall('image'):
+                        if os.path.normpath(image_element.find('name').text) in paths_to_remove:
+                            series_element.remove(image_element)
+                    if len(series_element.findall('image')) == 0:
+                        study_element.remove(series_element)
+                if len(study_element.findall('series')) == 0:
+                    subject_element.remove(study_element)
+            if len(subject_element.findall('study')) == 0:
+                DICOM_XML_object.remove(subject_element)
+    except Exception as e:
+        print('Error in WriteXMLfromDICOM.remove_images_from_xml: ' + str(e))
+        logger.exception('Error in WriteXMLfromDICOM.remove_images_from_xml: ' + str(e))
+
+
+def get_checked_states(DICOM_XML_object, list_paths):
+    """This method returns the checked attributes of the image elements of the files in list_paths 
+        and of the series, studies and subjects they belong to, so that set_checked_states can 
+        put them back after the images are removed and inserted again.
+    """
+    try:
+        paths = set(map(os.path.normpath, list_paths))
+        checked_states = {}
+        for subject_element in DICOM_XML_object.findall('subject'):
+            for study_element in subject_element.findall('study'):
+                for series_element in study_element.findall('series'):
+                    for image_element in series_element.findall('image'):
+                        image_path = os.path.normpath(image_element.find('name').text)
+                        if image_path in paths:
+                            checked_states[image_path] = image_element.get('checked')
+                            checked_states[(subject_element.get('id'),)] = subject_element.get('checked')
+                            checked_states[(subject_element.get('id'), study_element.get('id'))] = study_element.get('checked')
+                            checked_states[(subject_element.get('id'), study_element.get('id'), series_element.get('id'))] = series_element.get('checked')
+        return checked_states
+    except Exception as e:
+        print('Error in WriteXMLfromDICOM.get_checked_states: ' + str(e))
+        logger.exception('Error in WriteXMLfromDICOM.get_checked_states: ' + str(e))
+
+
+def set_checked_states(DICOM_XML_object, checked_states):
+    """This method sets the checked attributes returned by get_checked_states 
+        on the elements of the XML tree/structure that are found again.
+    """
+    try:
+        for subject_element in DICOM_XML_object.findall('subject'):
+            subject_key = (subject_element.get('id'),)
+            if checked_states.get(subject_key) is not None:
+                subject_element.set('checked', checked_states[subject_key])
+            for study_element in subject_element.findall('study'):
+                study_key = subject_key + (study_element.get('id'),)
+                if checked_states.get(study_key) is not None:
+                    study_element.set('checked', checked_states[study_key])
+                for series_element in study_element.findall('series'):
+                    series_key = study_key + (series_element.get('id'),)
+                    if checked_states.get(series_key) is not None:
+                        series_element.set('checked', checked_states[series_key])
+                    for image_element in series_element.findall('image'):
+                        image_path = os.path.normpath(image_element.find('name').text)
+                        if checked_states.get(image_path) is not None:
+                            image_element.set('checked', checked_states[image_path])
+    except Exception as e:
+        print('Error in WriteXMLfromDICOM.set_checked_states: ' + str(e))
+        logger.exception('Error in WriteXMLfromDICOM.set_checked_states: ' + str(e))
+
+
 def create_XML_file(DICOM_XML_object, scan_directory):
     """This method creates a new XML file with the based on the structure of the selected DICOM folder"""
     try:
@@ -409,6 +568,8 @@ def makeDICOM_XML_File(self, scan_directory):
                 xml = open_dicom_to_xml(dictionary, scans, paths)
                 self.update_message("Saving XML file")
                 fullFilePath = create_XML_file(xml, scan_directory)
+                self.update_message("Saving DICOM metadata index")
+                MetadataIndex.writeIndex(MetadataIndex.buildIndex(scans, paths), fullFilePath)
                 self.close_message()
                 end_time=time.time()
                 xmlCreationTime = end_time - start_time 
@@ -418,4 +579,96 @@ def makeDICOM_XML_File(self, scan_directory):
         return fullFilePath
     except Exception as e:
         print('Error in function WriteXMLfromDICOM.makeDICOM_XML_File: ' + str(e))
-        logger.exception('Error in function WriteXMLfromDICOM.makeDICOM_XML_File: ' + str(e))
\ No newline at end of file
+        logger.exception('Error in function WriteXMLfromDICOM.makeDICOM_XML_File: ' + str(e))
+
+
+def refreshDICOM_XML_File(self, scan_directory, xml_root=None):
+    """Updates the XML file of the scan folder, scan_directory, with the files that were 
+    added, changed or removed since it was created, without reading the unchanged files again. 
+    If xml_root is given (the root of the XML tree held by WeaselXMLReader), that tree is patched 
+    in place and saving it is left to the caller, otherwise the XML file is patched and saved.
+    If there is no XML file yet, or new multiframe files are found, the XML file is created from scratch.
+    Returns the full file path of the XML file."""
+    try:
+        logger.info("WriteXMLfromDICOM.refreshDICOM_XML_File called.")
+        fullFilePath = ''
+        if scan_directory:
+            fullFilePath = os.path.join(scan_directory, os.path.basename(os.path.normpath(scan_directory)) + ".xml")
+            if not existsDICOMXMLFile(scan_directory):
+                return rebuildDICOM_XML_File(self, scan_directory, xml_root)
+            if xml_root is None:
+                xml_tree = ET.parse(fullFilePath)
+                xml_root = xml_tree.getroot()
+            else:
+                xml_tree = None
+            xml_paths = set(os.path.normpath(name.text) for name in xml_root.iter('name'))
+            file_stamps = MetadataIndex.getFileStamps(fullFilePath)
+            weasel_files = [os.path.normpath(path) for path in [fullFilePath] + MetadataIndex.getIndexFilePaths(fullFilePath)]
+            file_list = [item.path for item in scan_tree(scan_directory) if item.is_file() and os.path.normpath(item.path) not in weasel_files]
+            file_list.sort(key=natural_keys)
+            new_files = []
+            changed_files = []
+            for filepath in file_list:
+                normalised_path = os.path.normpath(filepath)
+                if normalised_path not in xml_paths:
+                    new_files.append(filepath)
+                elif normalised_path in file_stamps:
+                    file_stats = os.stat(filepath)
+                    if file_stamps[normalised_path] != (file_stats.st_mtime_ns, file_stats.st_size):
+                        changed_files.append(filepath)
+            removed_files = list(xml_paths - set(map(os.path.normpath, file_list)))
+            files_to_read = new_files + changed_files
+            logger.info("WriteXMLfromDICOM.refreshDICOM_XML_File found {} new, {} changed and {} removed files."
+                        .format(len(new_files), len(changed_files), len(removed_files)))
+            list_dicom = []
+            list_paths = []
+            if files_to_read:
+                self.progress_bar(max=len(files_to_read), index=0, msg="Reading {} new or modified files".format(len(files_to_read)), title="Refreshing DICOM folder")
+                list_tags = ['InstanceNumber', 'SOPInstanceUID', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData', 'AcquisitionTime',
+                             'AcquisitionDate', 'SeriesTime', 'SeriesDate', 'PatientName', 'PatientID', 'StudyDate', 'StudyTime', 
+                             'SeriesDescription', 'StudyDescription', 'SequenceName', 'ProtocolName', 'SeriesNumber', 'PerFrameFunctionalGroupsSequence',
+                             'StudyInstanceUID', 'SeriesInstanceUID'] + MetadataIndex.INDEX_TAGS
+                for fileCounter, (filepath, dataset) in enumerate(scan_headers(files_to_read, list_tags), 1):
+                    if fileCounter % PROGRESS_BAR_BATCH == 0 or fileCounter == len(files_to_read):
+                        self.update_progress_bar(index=fileCounter)
+                    if dataset is None:
+                        continue
+                    if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+                        # Multiframe files must be converted to single frame, which is done by the full import
+                        self.close_progress_bar()
+                        return rebuildDICOM_XML_File(self, scan_directory, xml_root)
+                    if is_valid_dicom(dataset, filepath):
+                        list_dicom.append(dataset)
+                        list_paths.append(filepath)
+                self.close_progress_bar()
+            # Changed files are removed and inserted again, so their checked states are carried across
+            checked_states = get_checked_states(xml_root, changed_files) if changed_files else {}
+            if changed_files or removed_files:
+                remove_images_from_xml(xml_root, changed_files + removed_files)
+            for dicomfile, filepath in zip(list_dicom, list_paths):
+                insert_image_in_xml(xml_root, dicomfile, filepath)
+            if checked_states:
+                set_checked_states(xml_root, checked_states)
+            if xml_tree is not None and (list_paths or changed_files or removed_files):
+                xml_tree.write(fullFilePath)
+            MetadataIndex.updateIndex(fullFilePath, list_dicom, list_paths, changed_files + removed_files)
+            logger.info("WriteXMLfromDICOM.refreshDICOM_XML_File returns {}.".format(fullFilePath))
+        return fullFilePath
+    except Exception as e:
+        print('Error in function WriteXMLfromDICOM.refreshDICOM_XML_File: ' + str(e))
+        logger.exception('Error in function WriteXMLfromDICOM.refreshDICOM_XML_File: ' + str(e))
+
+
+def rebuildDICOM_XML_File(self, scan_directory, xml_root=None):
+    """Creates the XML file of the scan folder, scan_directory, from scratch. If xml_root is given 
+    (the root of the XML tree held by WeaselXMLReader), its contents are replaced by the new XML tree.
+    Returns the full file path of the XML file."""
+    try:
+        logger.info("WriteXMLfromDICOM.rebuildDICOM_XML_File called.")
+        fullFilePath = makeDICOM_XML_File(self, scan_directory)
+        if fullFilePath and xml_root is not None:
+            xml_root[:] = list(ET.parse(fullFilePath).getroot())
+        return fullFilePath
+    except Exception as e:
+        print('Error in function WriteXMLfromDICOM.rebuildDICOM_XML_File: ' + str(e))
+        logger.exception('Error in function WriteXMLfromDICOM.rebuildDICOM_XML_File: ' + str(e))
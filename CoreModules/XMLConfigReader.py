@@ -56,3 +56,31 @@ class XMLConfigReader:
         except Exception as e:
             print('Error in XMLConfigReader.getWeaselDataFolder: ' + str(e)) 
             logger.exception('Error in XMLConfigReader.getWeaselDataFolder: ' + str(e))
+
+
+    def getCatalogueBackend(self):
+        """This method gets the backend of the DICOM folder catalogue, 'xml' or 'sqlite', in the `<catalogue>` field."""
+        try:
+            catalogue = self.root.find('./catalogue')
+            if catalogue is None or catalogue.text is None:
+                return 'xml'
+            elif catalogue.text.strip().lower() == 'sqlite':
+                return 'sqlite'
+            else:
+                return 'xml'
+        except Exception as e:
+            print('Error in XMLConfigReader.getCatalogueBackend: ' + str(e)) 
+            logger.exception('Error in XMLConfigReader.getCatalogueBackend: ' + str(e))
+
+
+    def getSliceCacheSize(self):
+        """This method gets the memory budget of the decoded slice cache in the `<slice_cache_mb>` field and returns it in bytes."""
+        try:
+            sliceCache = self.root.find('./slice_cache_mb')
+            if sliceCache is None or sliceCache.text is None or not sliceCache.text.strip().isdigit():
+                return 256 * 1024 * 1024
+            else:
+                return int(sliceCache.text.strip()) * 1024 * 1024
+        except Exception as e:
+            print('Error in XMLConfigReader.getSliceCacheSize: ' + str(e)) 
+            logger.exception('Error in XMLConfigReader.getSliceCacheSize: ' + str(e))
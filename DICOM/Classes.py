@@ -24,8 +24,10 @@ import pandas as pd
 import copy
 from ast import literal_eval # Convert strings to their actual content. Eg. "[a, b]" becomes the actual list [a, b]
 from DICOM.DeveloperTools import (PixelArrayDICOMTools, GenericDICOMTools)
+from DICOM.LazyPixelArray import LazyPixelArray
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
 import DICOM.SaveDICOM_Image as SaveDICOM_Image
+import DICOM.MetadataIndex as MetadataIndex
 
 import logging
 logger = logging.getLogger(__name__)
@@ -125,8 +127,8 @@ class ImagesList(ListOfDicomObjects):
         list_to_sort = []
         list_to_sort.append(self)
         for tag in argv:
-            if len(self.get_value(tag)) > 0:
-                attributeList = self.get_value(tag)
+            attributeList = self.get_value(tag)
+            if len(attributeList) > 0:
                 list_to_sort.append(attributeList)
         for index, _ in enumerate(self):
             individual_tuple = []
@@ -141,6 +143,10 @@ class ImagesList(ListOfDicomObjects):
         return self
 
     def where(self, tag, condition, target):
+        selectedPaths = MetadataIndex.where(self.paths, tag, condition, target)
+        if selectedPaths is not None:
+            selectedPaths = set(selectedPaths)
+            return ImagesList([image for image in self if image.path in selectedPaths])
         list_images = []
         for image in self:
             value = image[tag]
@@ -159,6 +165,10 @@ class ImagesList(ListOfDicomObjects):
         """
         Returns a list of values of the given DICOM tag in the list of images
         """
+        if not isinstance(tag, list):
+            attributes_list = MetadataIndex.getTagValues(self.paths, tag)
+            if attributes_list is not None:
+                return attributes_list
         attributes_list = []
         for image in self:
             attributes_list.append(image.get_value(tag))
@@ -966,24 +976,15 @@ class Series:
             print('Error in Series.remove: ' + str(e))
             logger.exception('Error in Series.remove: ' + str(e))
 
-    def write(self, pixelArray, output_dir=None, value_range=None, parametric_map=None, colourmap=None):
+    def write(self, pixelArray, output_dir=None, value_range=None, parametric_map=None, colourmap=None, non_finite='clip'):
+        """Writes pixelArray into the DICOM files of the series. NaN and infinite values are replaced 
+            according to value_range and non_finite (see PixelArrayDICOMTools.sanitisePixelArray)."""
         logger.info("Series.write called")
+        lazyPixelArray = pixelArray if isinstance(pixelArray, LazyPixelArray) else None
         try:
-            if isinstance(value_range, list):
-                pixelArray = np.nan_to_num(pixelArray, posinf=0, neginf=0)
-                pixelArray = np.clip(pixelArray, value_range[0], value_range[1])
-            else:
-                list_values = np.unique(pixelArray).flatten()
-                list_values = [x for x in list_values if np.isnan(x) == False]
-                if np.isposinf(list_values[-1]) or np.isinf(list_values[-1]):
-                    upper_value = list_values[-2]
-                else:
-                    upper_value = None
-                if np.isneginf(list_values[0]) or np.isinf(list_values[0]):
-                    lower_value = list_values[1]
-                else:
-                    lower_value = None
-                pixelArray = np.nan_to_num(pixelArray, posinf=upper_value, neginf=lower_value)
+            pixelArray = PixelArrayDICOMTools.sanitisePixelArray(pixelArray, value_range=value_range, non_finite=non_finite)
+            if isinstance(pixelArray, LazyPixelArray) and len(pixelArray) == 1:
+                pixelArray = pixelArray[0]
             if self.images:
                 PixelArrayDICOMTools.overwritePixelArray(pixelArray, self.images)
             else:
@@ -1000,6 +1001,10 @@ class Series:
         except Exception as e:
             print('Error in Series.write: ' + str(e))
             logger.exception('Error in Series.write: ' + str(e))
+        finally:
+            # The scratch file of a LazyPixelArray is only needed while the series is written
+            if lazyPixelArray is not None:
+                lazyPixelArray.close()
     
     def read(self):
         return self.PydicomList
@@ -1059,8 +1064,9 @@ class Series:
             tuple_to_sort = []
             list_to_sort = [self.images]
             for tag in argv:
-                if len(self.get_value(tag)) > 0:
-                    list_to_sort.append(self.get_value(tag))
+                attributeList = self.get_value(tag)
+                if len(attributeList) > 0:
+                    list_to_sort.append(attributeList)
             for index in range(len(self.images)):
                 individual_tuple = [individual_list[index] for individual_list in list_to_sort]
                 tuple_to_sort.append(tuple(individual_tuple))
@@ -1075,6 +1081,10 @@ class Series:
     def where(self, tag, condition, target):
         logger.info("Series.where called")
         try:
+            selectedPaths = MetadataIndex.where(self.images, tag, condition, target)
+            if selectedPaths is not None:
+                self.images = selectedPaths
+                return self
             list_images = []
             list_paths = []
             for image in self.children:
@@ -1229,6 +1239,20 @@ class Series:
         except Exception as e:
             print('Error in Series.PixelArray: ' + str(e))
             logger.exception('Error in Series.PixelArray: ' + str(e))
+
+    @property
+    def LazyPixelArray(self):
+        """Returns the PixelArray as a LazyPixelArray, which only decodes the slices that are indexed.
+            Series that can't be read lazily (eg. Enhanced MRI) return the PixelArray."""
+        logger.info("Series.LazyPixelArray called")
+        try:
+            if LazyPixelArray.isSupported(self.images):
+                return LazyPixelArray(self.images)
+            else:
+                return self.PixelArray
+        except Exception as e:
+            print('Error in Series.LazyPixelArray: ' + str(e))
+            logger.exception('Error in Series.LazyPixelArray: ' + str(e))
         
     def overlay_mask(self, maskInstance):
         """Returns the PixelArray masked.
@@ -1243,41 +1267,29 @@ class Series:
         """
         logger.info("Series.Mask called")
         try:
-            dataset = maskInstance.PydicomList
             mask_array = maskInstance.PixelArray
             mask_array[mask_array != 0] = 1
             mask_output = []
+            # The volume is decoded once instead of twice per image
+            volumeArray = ReadDICOM_Image.readSeriesVolume(self.images)
+            # The mask is mapped to all the images of the series in one go
+            targetAffines = ReadDICOM_Image.returnSeriesAffineArray(self.images)
             if isinstance(maskInstance, Image):
-                for dicomFile in self.images:
-                    dataset_original = ReadDICOM_Image.getDicomDataset(dicomFile)
-                    tempArray = np.zeros(np.shape(ReadDICOM_Image.getPixelArray(dataset_original)))
-                    affine_results = ReadDICOM_Image.mapMaskToImage(mask_array, dataset, dataset_original)
-                    if affine_results:
-                        coords = zip(*affine_results)
-                        tempArray[tuple(coords)] = list(np.ones(len(affine_results)).flatten())
-                    mask_output.append(np.transpose(tempArray) * ReadDICOM_Image.getPixelArray(dataset_original))
+                maskAffines = ReadDICOM_Image.returnSeriesAffineArray([maskInstance.path])
+                targetMasks = ReadDICOM_Image.mapMaskVolumeToImages(mask_array, maskAffines, targetAffines, np.shape(volumeArray[0]))
+                mask_output = np.transpose(targetMasks, (0, 2, 1)) * volumeArray
                 return np.nan_to_num(mask_output)
             elif isinstance(maskInstance, Series):
-                listImages = self.images
                 listMaskImages = maskInstance.images
-                if np.shape(mask_array) == np.shape(self.PixelArray) and maskInstance.Affine.all() == self.Affine.all():
+                if np.shape(mask_array) == np.shape(np.squeeze(volumeArray)) and maskInstance.Affine.all() == self.Affine.all():
                     if len(np.shape(mask_array)) == 3:
                         mask_output = [np.transpose(image2D) for image2D in mask_array]
                     else:
                         mask_output = np.transpose(mask_array)
                 else:
-                    for dicomFile in listImages:
-                        dataset_original = ReadDICOM_Image.getDicomDataset(dicomFile)
-                        tempArray = np.zeros(np.shape(ReadDICOM_Image.getPixelArray(dataset_original)))
-                        for maskFile in listMaskImages:
-                            dataset = ReadDICOM_Image.getDicomDataset(maskFile)
-                            mask_array = ReadDICOM_Image.getPixelArray(dataset)
-                            mask_array[mask_array != 0] = 1
-                            affine_results = ReadDICOM_Image.mapMaskToImage(mask_array, dataset, dataset_original)
-                            if affine_results:
-                                coords = zip(*affine_results)
-                                tempArray[tuple(coords)] = list(np.ones(len(affine_results)).flatten())
-                        mask_output.append(np.transpose(tempArray) * ReadDICOM_Image.getPixelArray(dataset_original))
+                    maskAffines = ReadDICOM_Image.returnSeriesAffineArray(listMaskImages)
+                    targetMasks = ReadDICOM_Image.mapMaskVolumeToImages(mask_array, maskAffines, targetAffines, np.shape(volumeArray[0]))
+                    mask_output = np.transpose(targetMasks, (0, 2, 1)) * volumeArray
                 return np.nan_to_num(mask_output)
         except Exception as e:
             print('Error in Series.Mask: ' + str(e))
@@ -1354,12 +1366,16 @@ class Series:
                 if isinstance(tag, list):
                     outputValuesList = []
                     for ind_tag in tag:
-                        if (ind_tag == "SliceLocation" or ind_tag == (0x0020,0x1041)) and not hasattr(self.PydicomList[0], "SliceLocation"): ind_tag = (0x2001, 0x100a)
+                        tagValues = MetadataIndex.getSeriesTagValues(self.images, ind_tag)
+                        if tagValues is not None:
+                            outputValuesList.append(tagValues[0])
+                            continue
+                        if (ind_tag == "SliceLocation" or ind_tag == (0x0020,0x1041)) and not hasattr(ReadDICOM_Image.getDicomHeader(self.images[0]), "SliceLocation"): ind_tag = (0x2001, 0x100a)
                         outputValuesList.append(ReadDICOM_Image.getSeriesTagValues(self.images, ind_tag)[0])
                     return outputValuesList
                 elif isinstance(tag, str) and len(tag.split(' ')) == 3:
                     dicom_tag = tag.split(' ')[0]
-                    if (dicom_tag == "SliceLocation" or dicom_tag == (0x0020,0x1041)) and not hasattr(self.PydicomList[0], "SliceLocation"): dicom_tag = (0x2001, 0x100a)
+                    if (dicom_tag == "SliceLocation" or dicom_tag == (0x0020,0x1041)) and not hasattr(ReadDICOM_Image.getDicomHeader(self.images[0]), "SliceLocation"): dicom_tag = (0x2001, 0x100a)
                     logical_operator = tag.split(' ')[1]
                     target_value = tag.split(' ')[2]
                     series_to_return = copy.copy(self)
@@ -1369,7 +1385,11 @@ class Series:
                 elif isinstance(tag, int):
                     return self.children[tag]
                 else:
-                    if (tag == "SliceLocation" or tag == (0x0020,0x1041)) and not hasattr(self.PydicomList[0], "SliceLocation"): tag = (0x2001, 0x100a)
+                    # Answer from the metadata index of the DICOM folder if the tag is indexed
+                    tagValues = MetadataIndex.getSeriesTagValues(self.images, tag)
+                    if tagValues is not None:
+                        return tagValues[0]
+                    if (tag == "SliceLocation" or tag == (0x0020,0x1041)) and not hasattr(ReadDICOM_Image.getDicomHeader(self.images[0]), "SliceLocation"): tag = (0x2001, 0x100a)
                     return ReadDICOM_Image.getSeriesTagValues(self.images, tag)[0]
             else:
                 return []
@@ -1381,20 +1401,19 @@ class Series:
         logger.info("Series.set_value called")
         try:
             if self.images:
-                comparisonDicom = self.PydicomList
+                comparisonDicom = ReadDICOM_Image.getSeriesDicomHeader(self.images)
                 oldSubjectID = self.subjectID
                 oldStudyID = self.studyID
                 oldSeriesID = self.seriesID
                 if isinstance(tag, list) and isinstance(newValue, list):
-                    for index, ind_tag in enumerate(tag):
-                        self.set_value(ind_tag, newValue[index])
-                        #GenericDICOMTools.editDICOMTag(self.images, ind_tag, newValue[index])
+                    # All tags are written to each file at once
+                    GenericDICOMTools.editDICOMTags(self.images, dict(zip(tag, newValue)))
                 elif isinstance(newValue, list):
                     for value in newValue:
                         GenericDICOMTools.editDICOMTag(self.images, tag, value)
                 else:
                     GenericDICOMTools.editDICOMTag(self.images, tag, newValue)
-                newDicomList = self.PydicomList
+                newDicomList = ReadDICOM_Image.getSeriesDicomHeader(self.images)
                 # Consider the case where other XML fields are changed
                 for index, dataset in enumerate(comparisonDicom):
                     changeXML = False
@@ -1465,7 +1484,7 @@ class Series:
         try:
             if directory is None: directory=os.path.dirname(self.images[0])
             if filename is None: filename=self.seriesID
-            dicomHeader = nib.nifti1.Nifti1DicomExtension(2, self.PydicomList[0])
+            dicomHeader = nib.nifti1.Nifti1DicomExtension(2, ReadDICOM_Image.getDicomDataset(self.images[0]))
             niftiObj = nib.Nifti1Image(np.flipud(np.rot90(np.transpose(self.PixelArray))), self.Affine)
             # The transpose is necessary in this case to be in line with the rest of Weasel. The rot90() can be a bit questionable, so this should be tested in as much data as possible.
             niftiObj.header.extensions.append(dicomHeader)
@@ -1625,24 +1644,12 @@ class Image:
             print('Error in Image.delete: ' + str(e))
             logger.exception('Error in Image.delete: ' + str(e))
 
-    def write(self, pixelArray, series=None, output_dir=None, value_range=None, parametric_map=None, colourmap=None):
+    def write(self, pixelArray, series=None, output_dir=None, value_range=None, parametric_map=None, colourmap=None, non_finite='clip'):
+        """Writes pixelArray into the DICOM file of the image. NaN and infinite values are replaced 
+            according to value_range and non_finite (see PixelArrayDICOMTools.sanitisePixelArray)."""
         logger.info("Image.write called")
         try:
-            if isinstance(value_range, list):
-                pixelArray = np.nan_to_num(pixelArray, posinf=0, neginf=0)
-                pixelArray = np.clip(pixelArray, value_range[0], value_range[1])
-            else:
-                list_values = np.unique(pixelArray).flatten()
-                list_values = [x for x in list_values if np.isnan(x) == False]
-                if np.isposinf(list_values[-1]) or np.isinf(list_values[-1]):
-                    upper_value = list_values[-2]
-                else:
-                    upper_value = None
-                if np.isneginf(list_values[0]) or np.isinf(list_values[0]):
-                    lower_value = list_values[1]
-                else:
-                    lower_value = None
-                pixelArray = np.nan_to_num(pixelArray, posinf=upper_value, neginf=lower_value)
+            pixelArray = PixelArrayDICOMTools.sanitisePixelArray(pixelArray, value_range=value_range, non_finite=non_finite)
             if os.path.exists(self.path):
                 PixelArrayDICOMTools.overwritePixelArray(pixelArray, self.path) # Include Colourmap and Parametric Map
             else:
@@ -1762,29 +1769,22 @@ class Image:
         logger.info("Image.Mask called")
         try:
             if isinstance(maskInstance, Image):
-                #for index, dicomFile in enumerate(targetPath):
-                tempArray = np.zeros(np.shape(self.PixelArray))
-                dataset_original = self.PydicomObject
-                dataset = maskInstance.PydicomObject
+                # The mask image is mapped as a volume of one slice, the same as a mask series
+                pixelArray = self.PixelArray
                 mask_array = maskInstance.PixelArray
                 mask_array[mask_array != 0] = 1
-                affine_results = ReadDICOM_Image.mapMaskToImage(mask_array, dataset, dataset_original)
-                if affine_results:
-                    coords = zip(*affine_results)
-                    tempArray[tuple(coords)] = list(np.ones(len(affine_results)).flatten())
-                return np.transpose(tempArray) * self.PixelArray
+                maskAffines = ReadDICOM_Image.returnSeriesAffineArray([maskInstance.path])
+                targetAffine = ReadDICOM_Image.returnSeriesAffineArray([self.path])
+                tempArray = ReadDICOM_Image.mapMaskVolumeToImages(mask_array[np.newaxis, ...], maskAffines, targetAffine, np.shape(pixelArray))[0]
+                return np.transpose(tempArray) * pixelArray
             elif isinstance(maskInstance, Series):
-                tempArray = np.zeros(np.shape(self.PixelArray))
-                for maskFile in maskInstance.images:
-                    dataset_original = self.PydicomObject
-                    dataset = ReadDICOM_Image.getDicomDataset(maskFile)
-                    mask_array = ReadDICOM_Image.getPixelArray(dataset)
-                    mask_array[mask_array != 0] = 1
-                    affine_results = ReadDICOM_Image.mapMaskToImage(mask_array, dataset, dataset_original)
-                    if affine_results:
-                        coords = zip(*affine_results)
-                        tempArray[tuple(coords)] = list(np.ones(len(affine_results)).flatten())
-                return np.transpose(tempArray) * self.PixelArray
+                pixelArray = self.PixelArray
+                maskVolume = ReadDICOM_Image.readSeriesVolume(maskInstance.images)
+                maskVolume[maskVolume != 0] = 1
+                maskAffines = ReadDICOM_Image.returnSeriesAffineArray(maskInstance.images)
+                targetAffine = ReadDICOM_Image.returnSeriesAffineArray([self.path])
+                tempArray = ReadDICOM_Image.mapMaskVolumeToImages(maskVolume, maskAffines, targetAffine, np.shape(pixelArray))[0]
+                return np.transpose(tempArray) * pixelArray
         except Exception as e:
             print('Error in Image.Mask: ' + str(e))
             logger.exception('Error in Image.Mask: ' + str(e))
@@ -1834,11 +1834,11 @@ class Image:
             if isinstance(tag, list):
                 outputValuesList = []
                 for ind_tag in tag:
-                    if (ind_tag == "SliceLocation" or ind_tag == (0x0020,0x1041)) and not hasattr(self.PydicomObject, "SliceLocation"): ind_tag = (0x2001, 0x100a)
+                    if (ind_tag == "SliceLocation" or ind_tag == (0x0020,0x1041)) and not hasattr(ReadDICOM_Image.getDicomHeader(self.path), "SliceLocation"): ind_tag = (0x2001, 0x100a)
                     outputValuesList.append(ReadDICOM_Image.getImageTagValue(self.path, ind_tag))
                 return outputValuesList
             else:
-                if (tag == "SliceLocation" or tag == (0x0020,0x1041)) and not hasattr(self.PydicomObject, "SliceLocation"): tag = (0x2001, 0x100a)
+                if (tag == "SliceLocation" or tag == (0x0020,0x1041)) and not hasattr(ReadDICOM_Image.getDicomHeader(self.path), "SliceLocation"): tag = (0x2001, 0x100a)
                 return ReadDICOM_Image.getImageTagValue(self.path, tag)
         except Exception as e:
             print('Error in Image.get_value: ' + str(e))
@@ -1847,7 +1847,7 @@ class Image:
     def set_value(self, tag, newValue):
         logger.info("Image.set_value called")
         try:
-            comparisonDicom = self.PydicomObject
+            comparisonDicom = ReadDICOM_Image.getDicomHeader(self.path)
             changeXML = False
             # Not necessary new IDs, but they may be new. The changeXML flag coordinates that.
             oldSubjectID = self.subjectID
@@ -1855,26 +1855,27 @@ class Image:
             oldSeriesID = self.seriesID
             # Set tag commands
             if isinstance(tag, list) and isinstance(newValue, list):
-                for index, ind_tag in enumerate(tag):
-                    GenericDICOMTools.editDICOMTag(self.path, ind_tag, newValue[index])
+                # All tags are written to the file at once
+                GenericDICOMTools.editDICOMTags(self.path, dict(zip(tag, newValue)))
             else:
                 GenericDICOMTools.editDICOMTag(self.path, tag, newValue)
+            newDicom = ReadDICOM_Image.getDicomHeader(self.path)
             # Consider the case where XML fields are changed
-            if comparisonDicom.SeriesDescription != self.PydicomObject.SeriesDescription or comparisonDicom.SeriesNumber != self.PydicomObject.SeriesNumber:
+            if comparisonDicom.SeriesDescription != newDicom.SeriesDescription or comparisonDicom.SeriesNumber != newDicom.SeriesNumber:
                 changeXML = True
-                newSeriesID = str(self.PydicomObject.SeriesNumber) + "_" + str(self.PydicomObject.SeriesDescription)
+                newSeriesID = str(newDicom.SeriesNumber) + "_" + str(newDicom.SeriesDescription)
                 self.seriesID = newSeriesID
             else:
                 newSeriesID = oldSeriesID
-            if comparisonDicom.StudyDate != self.PydicomObject.StudyDate or comparisonDicom.StudyTime != self.PydicomObject.StudyTime or comparisonDicom.StudyDescription != self.PydicomObject.StudyDescription:
+            if comparisonDicom.StudyDate != newDicom.StudyDate or comparisonDicom.StudyTime != newDicom.StudyTime or comparisonDicom.StudyDescription != newDicom.StudyDescription:
                 changeXML = True
-                newStudyID = str(self.PydicomObject.StudyDate) + "_" + str(self.PydicomObject.StudyTime).split(".")[0] + "_" + str(self.PydicomObject.StudyDescription)
+                newStudyID = str(newDicom.StudyDate) + "_" + str(newDicom.StudyTime).split(".")[0] + "_" + str(newDicom.StudyDescription)
                 self.studyID = newStudyID
             else:
                 newStudyID = oldStudyID
-            if comparisonDicom.PatientID != self.PydicomObject.PatientID:
+            if comparisonDicom.PatientID != newDicom.PatientID:
                 changeXML = True
-                newSubjectID = str(self.PydicomObject.PatientID)
+                newSubjectID = str(newDicom.PatientID)
                 self.subjectID = newSubjectID
             else:
                 newSubjectID = oldSubjectID
@@ -8,11 +8,17 @@ import os
 import numpy as np
 import random
 import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
 import DICOM.SaveDICOM_Image as SaveDICOM_Image
+from DICOM.LazyPixelArray import LazyPixelArray
 
 logger = logging.getLogger(__name__)
 
+# What PixelArrayDICOMTools.sanitisePixelArray does with NaN and infinite values
+NON_FINITE_POLICIES = ['clip', 'zero', 'raise']
+
 
 class GenericDICOMTools:
     """
@@ -34,30 +40,9 @@ class GenericDICOMTools:
                     _, series_uid = GenericDICOMTools.generateSeriesIDs(self, inputPath, seriesNumber=series_id, studyUID=study_uid)
                 elif (series_id is None) and (series_uid is not None):
                     series_id = int(str(ReadDICOM_Image.getDicomDataset(inputPath).SeriesNumber) + str(random.randint(0, 9999)))
-                newDataset = ReadDICOM_Image.getDicomDataset(inputPath)
                 derivedPath = SaveDICOM_Image.returnFilePath(inputPath, suffix, output_folder=output_dir)
-                SaveDICOM_Image.saveDicomToFile(newDataset, output_path=derivedPath)
-                # The next lines perform an overwrite operation over the copied images
-                if patient_id:
-                        SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "PatientID", patient_id)
-                if study_uid:
-                    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "StudyInstanceUID", study_uid)
-                if study_name:
-                    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "StudyDescription", study_name)
-                instance_uid = SaveDICOM_Image.generateUIDs(newDataset, seriesNumber=series_id, studyUID=study_uid)[2]
-                SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SOPInstanceUID", instance_uid)
-                SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SeriesInstanceUID", series_uid)
-                SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SeriesNumber", series_id)
-                if series_name:
-                    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SeriesDescription", series_name)
-                else:
-                    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SeriesDescription", str(newDataset.SeriesDescription + suffix))
-                    #if hasattr(newDataset, "SeriesDescription"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SeriesDescription", str(newDataset.SeriesDescription + suffix))
-                    #elif hasattr(newDataset, "SequenceName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "SequenceName", str(newDataset.SequenceName + suffix))
-                    #elif hasattr(newDataset, "ProtocolName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(derivedPath, "ProtocolName", str(newDataset.ProtocolName + suffix))
+                GenericDICOMTools.copyDICOMFile(inputPath, derivedPath, series_id, series_uid, series_name=series_name,
+                                                study_uid=study_uid, study_name=study_name, patient_id=patient_id, suffix=suffix)
                 newSeriesID = self.objXMLReader.insertNewImageInXMLFile(inputPath,
                                              derivedPath, suffix, newSeriesName=series_name, newStudyName=study_name, newSubjectName=patient_id)
             elif isinstance(inputPath, list) and os.path.exists(inputPath[0]):
@@ -67,33 +52,26 @@ class GenericDICOMTools:
                     _, series_uid = GenericDICOMTools.generateSeriesIDs(self, inputPath, seriesNumber=series_id, studyUID=study_uid)
                 elif (series_id is None) and (series_uid is not None):
                     series_id = int(str(ReadDICOM_Image.getDicomDataset(inputPath[0]).SeriesNumber) + str(random.randint(0, 9999)))
-                derivedPath = []
-                for path in inputPath:
-                    newDataset = ReadDICOM_Image.getDicomDataset(path)
-                    newFilePath = SaveDICOM_Image.returnFilePath(path, suffix, output_folder=output_dir)
-                    SaveDICOM_Image.saveDicomToFile(newDataset, output_path=newFilePath)
-                    derivedPath.append(newFilePath)
-                    # The next lines perform an overwrite operation over the copied images
-                    if patient_id:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "PatientID", patient_id)
-                    if study_uid:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "StudyInstanceUID", study_uid)
-                    if study_name:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "StudyDescription", study_name)
-                    instance_uid = SaveDICOM_Image.generateUIDs(newDataset, seriesNumber=series_id, studyUID=study_uid)[2]
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SOPInstanceUID", instance_uid)
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesInstanceUID", series_uid)
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesNumber", series_id)
-                    if series_name:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesDescription", series_name)
-                    else:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesDescription", str(newDataset.SeriesDescription + suffix))
-                        #if hasattr(newDataset, "SeriesDescription"):
-                        #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesDescription", str(newDataset.SeriesDescription + suffix))
-                        #elif hasattr(newDataset, "SequenceName"):
-                        #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SequenceName", str(newDataset.SequenceName + suffix))
-                        #elif hasattr(newDataset, "ProtocolName"):
-                        #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "ProtocolName", str(newDataset.ProtocolName + suffix))
+                # All the paths are allocated up front, so that no two images are given the same path
+                derivedPath = SaveDICOM_Image.returnFilePathList(inputPath, suffix, output_folder=output_dir)
+                copyImage = partial(GenericDICOMTools.copyDICOMFile, series_id=series_id, series_uid=series_uid, series_name=series_name,
+                                    study_uid=study_uid, study_name=study_name, patient_id=patient_id, suffix=suffix)
+                # The copies are mostly file I/O, so they run in a pool of threads
+                with ThreadPoolExecutor() as executor:
+                    futureList = [executor.submit(copyImage, path, newPath) for path, newPath in zip(inputPath, derivedPath)]
+                # Only the images that were copied are added to the XML file
+                copiedPathList, copiedDerivedPathList = [], []
+                for path, newPath, future in zip(inputPath, derivedPath, futureList):
+                    try:
+                        future.result()
+                        copiedPathList.append(path)
+                        copiedDerivedPathList.append(newPath)
+                    except Exception as e:
+                        print('Error in function GenericDICOMTools.copyDICOM copying ' + path + ': ' + str(e))
+                        logger.exception('Error in GenericDICOMTools.copyDICOM copying ' + path + ': ' + str(e))
+                if not copiedPathList:
+                    raise IOError('None of the images could be copied')
+                inputPath, derivedPath = copiedPathList, copiedDerivedPathList
                 newSeriesID = self.objXMLReader.insertNewSeriesInXMLFile(
                                 inputPath, derivedPath, suffix, newSeriesName=series_name, newStudyName=study_name, newSubjectName=patient_id)
             return derivedPath, newSeriesID
@@ -109,6 +87,7 @@ class GenericDICOMTools:
         try:
             if isinstance(inputPath, str) and os.path.exists(inputPath):
                 os.remove(inputPath)
+                ReadDICOM_Image.invalidateDatasetCache(inputPath)
                 self.objXMLReader.removeImageFromXMLFile(inputPath)
                 for displayWindow in self.mdiArea.subWindowList():
                     if displayWindow.windowTitle().split(" - ")[-1] == os.path.basename(inputPath):
@@ -116,6 +95,7 @@ class GenericDICOMTools:
             elif isinstance(inputPath, list) and os.path.exists(inputPath[0]):
                 for path in inputPath:
                     os.remove(path)
+                ReadDICOM_Image.invalidateDatasetCache(inputPath)
                 self.objXMLReader.removeMultipleImagesFromXMLFile(inputPath)
                 for displayWindow in self.mdiArea.subWindowList():
                     if displayWindow.windowTitle().split(" - ")[-1] in list(map(os.path.basename, inputPath)):
@@ -148,55 +128,31 @@ class GenericDICOMTools:
                 for index, path in enumerate(imagePathList):
                     if progress_bar == True: 
                         self.progressBar.set_value(index+1)
-                    if patient_id:
-                        SaveDICOM_Image.overwriteDicomFileTag(path, "PatientID", patient_id)
-                    if study_uid:
-                        SaveDICOM_Image.overwriteDicomFileTag(path, "StudyInstanceUID", study_uid)
-                    if study_name:
-                        SaveDICOM_Image.overwriteDicomFileTag(path, "StudyDescription", study_name)
-                    SaveDICOM_Image.overwriteDicomFileTag(path, "SeriesInstanceUID", series_uid)
-                    SaveDICOM_Image.overwriteDicomFileTag(path, "SeriesNumber", series_id)
-                    SaveDICOM_Image.overwriteDicomFileTag(path, "SeriesDescription", series_name)
-                    #dataset = ReadDICOM_Image.getDicomDataset(path)
-                    #if hasattr(dataset, "SeriesDescription"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(path, "SeriesDescription", series_name)
-                    #elif hasattr(dataset, "SequenceName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(path, "SequenceName", series_name)
-                    #elif hasattr(dataset, "ProtocolName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(path, "ProtocolName", series_name)
+                    SaveDICOM_Image.overwriteDicomFileTags(path, GenericDICOMTools.newSeriesTagValues(series_id, series_uid, series_name,
+                                                                    study_uid=study_uid, study_name=study_name, patient_id=patient_id))
                 newImagePathList = imagePathList
                 self.objXMLReader.insertNewSeriesInXMLFile(
                                 originalPathList, newImagePathList, suffix, newSeriesName=series_name, newStudyName=study_name, newSubjectName=patient_id)
                 self.objXMLReader.removeMultipleImagesFromXMLFile(originalPathList)
             else:
+                copiedPathList = []
                 if progress_bar == True: 
                     self.progressBar.set_maximum(len(imagePathList))
                 for index, path in enumerate(imagePathList):
                     if progress_bar == True: 
                         self.progressBar.set_value(len(index+1))
-                    newDataset = ReadDICOM_Image.getDicomDataset(path)
                     newFilePath = SaveDICOM_Image.returnFilePath(path, suffix)
-                    SaveDICOM_Image.saveDicomToFile(newDataset, output_path=newFilePath)
-                    # The next lines perform an overwrite operation over the copied images
-                    if patient_id:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "PatientID", patient_id)
-                    if study_uid:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "StudyInstanceUID", study_uid)
-                    if study_name:
-                        SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "StudyDescription", study_name)
-                    instance_uid = SaveDICOM_Image.generateUIDs(newDataset, seriesNumber=series_id, studyUID=study_uid)[2]
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SOPInstanceUID", instance_uid)
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesInstanceUID", series_uid)
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesNumber", series_id)
-                    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesDescription", series_name)
-                    #if hasattr(newDataset, "SeriesDescription"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SeriesDescription", series_name)
-                    #elif hasattr(newDataset, "SequenceName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "SequenceName", series_name)
-                    #elif hasattr(newDataset, "ProtocolName"):
-                    #    SaveDICOM_Image.overwriteDicomFileTag(newFilePath, "ProtocolName", series_name)
+                    try:
+                        GenericDICOMTools.copyDICOMFile(path, newFilePath, series_id, series_uid, series_name=series_name,
+                                                        study_uid=study_uid, study_name=study_name, patient_id=patient_id, suffix=suffix)
+                    except Exception as e:
+                        # The image is left out of the merged series
+                        print('Error in function GenericDICOMTools.mergeDicomIntoOneSeries copying ' + path + ': ' + str(e))
+                        logger.exception('Error in GenericDICOMTools.mergeDicomIntoOneSeries copying ' + path + ': ' + str(e))
+                        continue
+                    copiedPathList.append(path)
                     newImagePathList.append(newFilePath)
-                self.objXMLReader.insertNewSeriesInXMLFile(imagePathList, newImagePathList, suffix, newSeriesName=series_name, newStudyName=study_name, newSubjectName=patient_id)
+                self.objXMLReader.insertNewSeriesInXMLFile(copiedPathList, newImagePathList, suffix, newSeriesName=series_name, newStudyName=study_name, newSubjectName=patient_id)
             return newImagePathList
         except Exception as e:
             print('Error in function GenericDICOMTools.mergeDicomIntoOneSeries: ' + str(e))
@@ -228,6 +184,55 @@ class GenericDICOMTools:
             print('Error in function GenericDICOMTools.generateSeriesIDs: ' + str(e))
             logger.exception('Error in GenericDICOMTools.generateSeriesIDs: ' + str(e))
 
+    @staticmethod
+    def copyDICOMFile(inputPath, outputPath, series_id, series_uid, series_name=None, study_uid=None, study_name=None, patient_id=None, suffix="_Copy"):
+        """
+        Copies the DICOM file "inputPath" to "outputPath" as an image of the series with "series_id" and "series_uid".
+        Only the header is decoded and written again, the pixel data is copied as it is.
+        """
+        dataset = ReadDICOM_Image.getDicomHeader(inputPath)
+        instance_uid = SaveDICOM_Image.generateUIDs(dataset, seriesNumber=series_id, studyUID=study_uid)[2]
+        if not series_name:
+            series_name = str(dataset.SeriesDescription + suffix)
+        tagValues = GenericDICOMTools.newSeriesTagValues(series_id, series_uid, series_name,
+                                                         study_uid=study_uid, study_name=study_name, patient_id=patient_id, instance_uid=instance_uid)
+        SaveDICOM_Image.copyDicomFile(inputPath, outputPath, tagValues)
+        return outputPath
+
+    @staticmethod
+    def newSeriesTagValues(series_id, series_uid, series_name, study_uid=None, study_name=None, patient_id=None, instance_uid=None):
+        """
+        Returns the dictionary of DICOM tag -> new value that moves an image into the series
+        with "series_id", "series_uid" and "series_name", and optionally into another study or subject.
+        """
+        tagValues = {}
+        if patient_id:
+            tagValues["PatientID"] = patient_id
+        if study_uid:
+            tagValues["StudyInstanceUID"] = study_uid
+        if study_name:
+            tagValues["StudyDescription"] = study_name
+        if instance_uid:
+            tagValues["SOPInstanceUID"] = instance_uid
+        tagValues["SeriesInstanceUID"] = series_uid
+        tagValues["SeriesNumber"] = series_id
+        tagValues["SeriesDescription"] = series_name
+        return tagValues
+
+    @staticmethod
+    def editDICOMTags(inputPath, tagValues):
+        """
+        Overwrites the DICOM files in "inputPath" with all values of the dictionary
+        "tagValues" (DICOM tag -> new value), reading and writing each file once.
+        """
+        logger.info("GenericDICOMTools.editDICOMTags called")
+        try:
+            if (isinstance(inputPath, str) and os.path.exists(inputPath)) or (isinstance(inputPath, list) and os.path.exists(inputPath[0])):
+                SaveDICOM_Image.overwriteDicomFileTags(inputPath, tagValues)
+        except Exception as e:
+            print('Error in GenericDICOMTools.editDICOMTags: ' + str(e))
+            logger.exception('Error in GenericDICOMTools.editDICOMTags: ' + str(e))
+
     @staticmethod
     def editDICOMTag(inputPath, dicomTag, newValue):
         """
@@ -292,6 +297,67 @@ class PixelArrayDICOMTools:
             print('Error in PixelArrayDICOMTools.getDICOMobject: ' + str(e))
             logger.exception('Error in PixelArrayDICOMTools.getDICOMobject: ' + str(e))
 
+    @staticmethod
+    def sanitisePixelArray(pixelArray, value_range=None, non_finite='clip'):
+        """
+        Returns "pixelArray" without NaN or infinite values, ready to be saved. The values are checked 
+        with np.isfinite one slice at a time and only the slices with non-finite values are changed.
+        If "value_range" is a list [min, max], the non-finite values are set to 0 and the array is clipped to it.
+        Otherwise "non_finite" is one of NON_FINITE_POLICIES:
+            'clip' sets infinite values to the largest or smallest finite value of the array and NaN to 0,
+            'zero' sets the non-finite values to 0,
+            'raise' raises a ValueError before anything is written.
+        A LazyPixelArray is returned as a LazyPixelArray that is sanitised slice by slice when indexed.
+        The indices of the slices with non-finite values are reported in the log.
+        """
+        logger.info("PixelArrayDICOMTools.sanitisePixelArray called")
+        if non_finite not in NON_FINITE_POLICIES:
+            raise ValueError("non_finite must be one of {}, not {}".format(NON_FINITE_POLICIES, non_finite))
+        isLazy = isinstance(pixelArray, LazyPixelArray)
+        if not isLazy:
+            pixelArray = np.asarray(pixelArray)
+        isVolume = isLazy or pixelArray.ndim > 2
+        slices = pixelArray if isVolume else [pixelArray]
+        nonFiniteSlices = []
+        hasPosInf = hasNegInf = False
+        if isLazy or np.issubdtype(pixelArray.dtype, np.inexact):
+            for index, sliceArray in enumerate(slices):
+                if not np.all(np.isfinite(sliceArray)):
+                    nonFiniteSlices.append(index)
+                    hasPosInf = hasPosInf or bool(np.any(np.isposinf(sliceArray)))
+                    hasNegInf = hasNegInf or bool(np.any(np.isneginf(sliceArray)))
+        upper_value = lower_value = 0.0
+        if nonFiniteSlices:
+            if non_finite == 'raise' and not isinstance(value_range, list):
+                raise ValueError("The pixel array has NaN or infinite values in the slices {}".format(nonFiniteSlices))
+            logger.warning("PixelArrayDICOMTools.sanitisePixelArray replaced NaN or infinite values ({}) in the slices {}".format(
+                            'value_range' if isinstance(value_range, list) else non_finite, nonFiniteSlices))
+            if non_finite == 'clip' and not isinstance(value_range, list) and (hasPosInf or hasNegInf):
+                # The finite range is only needed, and found, when there are infinite values
+                finiteMinimums, finiteMaximums = [], []
+                for sliceArray in slices:
+                    finiteValues = sliceArray[np.isfinite(sliceArray)]
+                    if finiteValues.size:
+                        finiteMinimums.append(np.amin(finiteValues))
+                        finiteMaximums.append(np.amax(finiteValues))
+                if finiteMaximums:
+                    upper_value, lower_value = max(finiteMaximums), min(finiteMinimums)
+        if isLazy:
+            if nonFiniteSlices:
+                pixelArray = pixelArray.map(lambda sliceArray: np.nan_to_num(sliceArray, nan=0.0, posinf=upper_value, neginf=lower_value))
+            if isinstance(value_range, list):
+                pixelArray = pixelArray.map(lambda sliceArray: np.clip(sliceArray, value_range[0], value_range[1]))
+        else:
+            if nonFiniteSlices:
+                # Copied once, so that the array of the caller is not changed
+                pixelArray = pixelArray.copy()
+                for index in nonFiniteSlices:
+                    sliceArray = pixelArray[index] if isVolume else pixelArray
+                    np.nan_to_num(sliceArray, copy=False, nan=0.0, posinf=upper_value, neginf=lower_value)
+            if isinstance(value_range, list):
+                pixelArray = np.clip(pixelArray, value_range[0], value_range[1])
+        return pixelArray
+
     def writeNewPixelArray(self, pixelArray, inputPath, suffix, series_id=None, series_uid=None, series_name=None, parametric_map=None, colourmap=None, output_dir=None):
         """
         Saves the "pixelArray" into new DICOM files with a new series, based
@@ -315,15 +381,10 @@ class PixelArrayDICOMTools:
                 else:
                     # Iterate through list of images (slices) and save the resulting Map for each DICOM image
                     numImages = (1 if len(np.shape(pixelArray)) < 3 else np.shape(pixelArray)[0])
-                    derivedImagePathList = []
-                    derivedImageList = []
-                    for index in range(numImages):
-                        derivedImageFilePath = SaveDICOM_Image.returnFilePath(inputPath[index], suffix, output_folder=output_dir)
-                        derivedImagePathList.append(derivedImageFilePath)
-                        if numImages==1:
-                            derivedImageList.append(pixelArray)
-                        else:
-                            derivedImageList.append(pixelArray[index, ...])
+                    # All the paths are allocated up front, listing the output folder once
+                    derivedImagePathList = SaveDICOM_Image.returnFilePathList(inputPath[:numImages], suffix, output_folder=output_dir)
+                    # The slices are indexed one at a time when saved, so a LazyPixelArray is written without loading the whole series
+                    derivedImageList = ([pixelArray] if numImages==1 else pixelArray)
                     if len(inputPath) > len(derivedImagePathList):
                         inputPath = inputPath[:len(derivedImagePathList)]
 
@@ -335,8 +396,10 @@ class PixelArrayDICOMTools:
                 self.objXMLReader.insertNewImageInXMLFile((''.join(inputPath)), derivedImagePathList[0], suffix, newSeriesName=series_name)
             else:
                 SaveDICOM_Image.saveDicomNewSeries(derivedImagePathList, inputPath, derivedImageList, suffix, series_id=series_id, series_uid=series_uid, series_name=series_name, list_refs_path=[inputPath], parametric_map=parametric_map, colourmap=colourmap)
-                # Insert new series into the DICOM XML file
-                self.objXMLReader.insertNewSeriesInXMLFile(inputPath, derivedImagePathList, suffix, newSeriesName=series_name)            
+                # Insert new series into the DICOM XML file, labelled with the instance numbers 
+                # that saveDicomNewSeries gives to 2D slices, which saves reading the new files
+                imageLabels = list(range(1, len(derivedImagePathList)+1)) if len(np.shape(pixelArray)) == 3 else None
+                self.objXMLReader.insertNewSeriesInXMLFile(inputPath, derivedImagePathList, suffix, newSeriesName=series_name, imageLabels=imageLabels)            
                 
             return derivedImagePathList
 
@@ -353,11 +416,13 @@ class PixelArrayDICOMTools:
         logger.info("PixelArrayDICOMTools.overwritePixelArray called")
         try:
             if isinstance(inputPath, list) and len(inputPath) > 1:
-                datasetList = ReadDICOM_Image.getSeriesDicomDataset(inputPath)
-                for index, dataset in enumerate(datasetList):
+                # One dataset at a time, so that a LazyPixelArray is written slice by slice
+                for index, imagePath in enumerate(inputPath):
+                    dataset = ReadDICOM_Image.getDicomDataset(imagePath)
                     modifiedDataset = SaveDICOM_Image.createNewPixelArray(pixelArray[index], dataset)
-                    SaveDICOM_Image.saveDicomToFile(modifiedDataset, output_path=inputPath[index])
+                    SaveDICOM_Image.saveDicomToFile(modifiedDataset, output_path=imagePath)
             else:
+                if isinstance(inputPath, list): inputPath = inputPath[0]
                 dataset = ReadDICOM_Image.getDicomDataset(inputPath)
                 modifiedDataset = SaveDICOM_Image.createNewPixelArray(pixelArray, dataset)
                 SaveDICOM_Image.saveDicomToFile(modifiedDataset, output_path=inputPath)
@@ -0,0 +1,144 @@
+"""
+Array-like access to the pixel data of a DICOM series that does not hold the whole series in memory.
+
+A `LazyPixelArray` has the (N, Columns, Rows) shape and float32 dtype of `Series.PixelArray`, but a slice is only decoded
+when it is indexed. Decoded slices are kept in a disk-backed np.memmap scratch file, so reading a slice again doesn't decode
+the DICOM file again and memory use is bounded by what the operating system decides to keep in the page cache.
+
+Processing is also lazy: `map(function)` (and the unary minus) return a new LazyPixelArray that applies the function to each
+slice when it's indexed. Mapped arrays have no scratch file of their own: their slices are computed from the source every time
+they're indexed, so only the decoded DICOM slices are ever written to disk. `Series.write` accepts a LazyPixelArray, writes it
+slice by slice and closes the scratch file afterwards, so a read-process-write loop like
+
+    series.write(series.LazyPixelArray.map(np.sqrt))
+
+streams through the series without ever holding the full volume.
+"""
+
+import tempfile
+import numpy as np
+import DICOM.ReadDICOM_Image as ReadDICOM_Image
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LazyPixelArray:
+    """Array-like object with the PixelArray of the DICOM files in imagePathList, decoded slice by slice on demand.
+        If source and function are given, each slice is function(source[index]) instead, which must keep the slice shape,
+        computed whenever the slice is indexed."""
+
+    def __init__(self, imagePathList, source=None, function=None, scratchDir=None):
+        self.imagePathList = list(imagePathList)
+        self.source = source
+        self.function = function
+        self.scratchDir = scratchDir
+        if source is None:
+            header = ReadDICOM_Image.getDicomHeader(self.imagePathList[0])
+            self.shape = (len(self.imagePathList), int(header.Columns), int(header.Rows))
+        else:
+            self.shape = source.shape
+        self.dtype = np.dtype(np.float32)
+        self.decoded = np.zeros(self.shape[0], dtype=bool)
+        self.scratchFile = None
+        self.scratchArray = None
+
+    @staticmethod
+    def isSupported(imagePathList):
+        """Returns True if the DICOM files in imagePathList are single-frame, single-sample images that can be read lazily"""
+        header = ReadDICOM_Image.getDicomHeader(imagePathList[0])
+        return header is not None and int(getattr(header, 'NumberOfFrames', 1) or 1) == 1 and int(getattr(header, 'SamplesPerPixel', 1)) == 1
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for index in range(self.shape[0]):
+            yield self[index]
+
+    def __getitem__(self, key):
+        """Decodes the slices selected by the first index of key (if they weren't decoded yet) and returns a copy of the selection.
+            The slices of a mapped array are computed from the source instead, see _computeSlices."""
+        if self.source is not None:
+            return self._computeSlices(key)
+        sliceKey = key[0] if isinstance(key, tuple) and key else key
+        if sliceKey is Ellipsis:
+            sliceKey = slice(None)
+        for index in np.arange(self.shape[0])[sliceKey].flatten():
+            self._decodeSlice(int(index))
+        return np.array(self.scratchArray[key])
+
+    def __array__(self, dtype=None, copy=None):
+        """Decodes the whole series, so that numpy functions receive the LazyPixelArray as a regular array"""
+        pixelArray = self[:]
+        return pixelArray if dtype is None else pixelArray.astype(dtype)
+
+    def __neg__(self):
+        return self.map(np.negative)
+
+    def __repr__(self):
+        if self.source is not None:
+            return "LazyPixelArray(shape={}, dtype={}, mapped from {})".format(self.shape, self.dtype, self.source)
+        return "LazyPixelArray(shape={}, dtype={}, decoded={}/{})".format(self.shape, self.dtype, int(np.sum(self.decoded)), self.shape[0])
+
+    def map(self, function):
+        """Returns a new LazyPixelArray whose slices are function(slice) of this one. The function must keep the slice shape."""
+        return LazyPixelArray(self.imagePathList, source=self, function=function, scratchDir=self.scratchDir)
+
+    def _computeSlices(self, key):
+        """Returns the selection key of a mapped array, computing function(source[index]) for each slice selected by its first index.
+            Only the selected slices are computed and nothing is kept, so the memory used is that of the selection."""
+        sliceKey = key[0] if isinstance(key, tuple) and key else key
+        otherKeys = tuple(key[1:]) if isinstance(key, tuple) else ()
+        if sliceKey is Ellipsis:
+            # The whole array is computed and the Ellipsis then applies to it as in numpy
+            sliceIndices, positions = np.arange(self.shape[0]), Ellipsis
+        elif isinstance(sliceKey, slice):
+            # The slices are computed in the order of the slice, which then selects all of them
+            sliceIndices, positions = np.arange(self.shape[0])[sliceKey], slice(None)
+        else:
+            # Integers and index arrays select each slice once, repeated slices are picked from the computed ones
+            selectedIndices = np.arange(self.shape[0])[sliceKey]
+            sliceIndices = np.unique(selectedIndices)
+            positions = np.searchsorted(sliceIndices, selectedIndices)
+        pixelArray = np.empty((len(sliceIndices),) + tuple(self.shape[1:]), dtype=self.dtype)
+        for position, index in enumerate(sliceIndices):
+            sliceArray = self.function(self.source[int(index)])
+            if np.shape(sliceArray) != self.shape[1:]:
+                raise ValueError("The slice {} of the LazyPixelArray has shape {} instead of {}".format(index, np.shape(sliceArray), self.shape[1:]))
+            pixelArray[position] = sliceArray
+        return pixelArray[(positions,) + otherKeys]
+
+    def _decodeSlice(self, index):
+        """Writes the pixel array of the slice in `index` in the scratch file, unless it's there already"""
+        if self.decoded[index]:
+            return
+        if self.scratchArray is None:
+            # The temporary file is deleted by the operating system when it's closed or garbage collected
+            self.scratchFile = tempfile.TemporaryFile(prefix='weasel_', suffix='.dat', dir=self.scratchDir)
+            self.scratchArray = np.memmap(self.scratchFile, dtype=self.dtype, mode='w+', shape=self.shape)
+        pixelArray = ReadDICOM_Image.returnPixelArray(self.imagePathList[index])
+        if np.shape(pixelArray) != self.shape[1:]:
+            raise ValueError("The slice {} of the LazyPixelArray has shape {} instead of {}".format(index, np.shape(pixelArray), self.shape[1:]))
+        self.scratchArray[index] = pixelArray
+        self.decoded[index] = True
+
+    def close(self):
+        """Deletes the scratch file, or the one of the source of a mapped array. 
+            The slices are decoded again if the LazyPixelArray is indexed afterwards."""
+        logger.info("LazyPixelArray.close called")
+        if self.source is not None:
+            self.source.close()
+            return
+        self.scratchArray = None
+        if self.scratchFile is not None:
+            self.scratchFile.close()
+            self.scratchFile = None
+        self.decoded[:] = False
@@ -0,0 +1,452 @@
+"""
+Collection of functions that manage a columnar metadata index of a DICOM folder.
+
+The index is a pandas DataFrame with one row per DICOM file (indexed by file path) and one column per DICOM tag in INDEX_TAGS,
+plus the modification time and size of each file. It is created at import time by `WriteXMLfromDICOM.makeDICOM_XML_File`
+and saved as a JSON sidecar file next to the XML file, so that tag queries (`Series.get_value`, `Series.where`, the image sliders, etc.)
+are answered from memory with vectorized pandas filters instead of reading the header of every DICOM file again.
+The sidecar is plain data: the pydicom value types (DS, IS, PN, UI and bytes) are written as tagged strings and rebuilt when it's read,
+so opening a DICOM folder never runs code found in it. A tag that is not in a file is stored as NaN, an empty value as None.
+
+The index is refreshed incrementally: rows of files that were added or changed since the index was saved are read again when queried.
+Rows refreshed by queries are saved at most every INDEX_SAVE_INTERVAL seconds and when Weasel exits.
+"""
+
+import os
+import json
+import time
+import atexit
+import base64
+import operator
+import threading
+import numpy as np
+import pandas as pd
+import pydicom
+from pydicom.valuerep import DS, DSfloat, DSdecimal, IS, PersonName
+from pydicom.uid import UID
+import DICOM.ReadDICOM_Image as ReadDICOM_Image
+import logging
+logger = logging.getLogger(__name__)
+
+# DICOM tags stored in the index. These are the tags used by the image sliders and the most common geometry tags.
+INDEX_TAGS = ['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'SeriesNumber', 'SeriesDescription',
+              'InstanceNumber', 'ImageType', 'AcquisitionNumber', 'AcquisitionTime', 'SliceLocation', 'FlipAngle', 'RepetitionTime',
+              'InversionTime', 'EchoTime', 'DiffusionBValue', 'DiffusionGradientOrientation', 'ImagePositionPatient',
+              'ImageOrientationPatient', 'PixelSpacing', 'SliceThickness', 'Rows', 'Columns', (0x2005, 0x1572), (0x2001, 0x100a)]
+
+INDEX_FILE_SUFFIX = "_index.json"
+# Sidecar files of earlier versions of the index, which are never read
+PREVIOUS_INDEX_FILE_SUFFIXES = ["_index.pkl"]
+INDEX_FILE_VERSION = 1
+# Minimum number of seconds between two saves of an index by refreshIndex
+INDEX_SAVE_INTERVAL = 30
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# Indexes loaded in memory, {DICOM folder: {'dataFrame': DataFrame, 'path': path of the index file, 
+# 'savedTime': time of the last save, 'isSaved': False if it changed since}}. 
+# The DataFrames are never modified in place, a new one replaces the old one.
+_loadedIndexes = {}
+_indexLock = threading.Lock()
+# Held while an index file is written, so that an older version of the index never overwrites a newer one
+_saveLock = threading.Lock()
+
+
+def getColumnName(dicomTag):
+    """This method returns the name of the index column that stores the values of the given DICOM tag"""
+    if isinstance(dicomTag, str):
+        return dicomTag
+    return str(pydicom.tag.Tag(dicomTag))
+
+
+def getIndexFilePath(xmlFilePath):
+    """This method returns the path of the index file that is saved next to the XML file in xmlFilePath"""
+    return os.path.splitext(xmlFilePath)[0] + INDEX_FILE_SUFFIX
+
+
+def getIndexFilePaths(xmlFilePath):
+    """This method returns the paths of the index file of the XML file in xmlFilePath and of the 
+        index files of earlier versions, which are not DICOM files"""
+    return [getIndexFilePath(xmlFilePath)] + [os.path.splitext(xmlFilePath)[0] + suffix for suffix in PREVIOUS_INDEX_FILE_SUFFIXES]
+
+
+def _getFileStamp(imagePath):
+    """This method returns the modification time (ns) and size of the file in imagePath"""
+    fileStats = os.stat(imagePath)
+    return fileStats.st_mtime_ns, fileStats.st_size
+
+
+def _hasTag(dataset, dicomTag):
+    """This method returns True if the DICOM Dataset object/class has the given DICOM tag,
+        looking for the same tag as ReadDICOM_Image.getDatasetTagValue"""
+    if (dicomTag == "SliceLocation" or dicomTag == (0x0020,0x1041)) and not hasattr(dataset, "SliceLocation"): dicomTag = (0x2001, 0x100a)
+    try:
+        return pydicom.tag.Tag(dicomTag) in dataset
+    except Exception:
+        return False
+
+
+def _getRow(dataset):
+    """This method returns the values of INDEX_TAGS in the DICOM Dataset object/class as a list.
+        Multi-valued attributes are stored as tuples so that they can be compared and sorted.
+        Tags that are not in the dataset are stored as NaN, so that they are told apart from empty values (None)."""
+    row = []
+    for tag in INDEX_TAGS:
+        if not _hasTag(dataset, tag):
+            row.append(np.nan)
+            continue
+        value = ReadDICOM_Image.getDatasetTagValue(dataset, tag)
+        if isinstance(value, (pydicom.multival.MultiValue, list)):
+            value = tuple(value)
+        row.append(value)
+    return row
+
+
+def _encodeValue(value):
+    """This method returns value as JSON data. Tuples are written as lists and the values that are not 
+        JSON types as {type: string}, which _decodeValue turns back into the same values."""
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    if isinstance(value, tuple):
+        return [_encodeValue(item) for item in value]
+    if isinstance(value, (DSfloat, DSdecimal)):
+        return {'DS': str(value)}
+    if isinstance(value, IS):
+        return {'IS': str(value)}
+    if isinstance(value, PersonName):
+        return {'PN': str(value)}
+    if isinstance(value, UID):
+        return {'UI': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    return str(value)
+
+
+def _decodeValue(value):
+    """This method returns the value written as JSON data by _encodeValue"""
+    if isinstance(value, list):
+        return tuple(_decodeValue(item) for item in value)
+    if isinstance(value, dict):
+        valueType, text = next(iter(value.items()))
+        if valueType == 'DS':
+            return DS(text)
+        if valueType == 'IS':
+            return IS(text)
+        if valueType == 'PN':
+            return PersonName(text)
+        if valueType == 'UI':
+            return UID(text)
+        if valueType == 'bytes':
+            return base64.b64decode(text)
+        raise ValueError("Unknown type {} in the index file".format(valueType))
+    return value
+
+
+def _saveIndex(entry):
+    """This method writes the index DataFrame of the loaded index entry to its JSON file. 
+        The file is written next to the old one and replaces it once it's complete."""
+    with _saveLock:
+        with _indexLock:
+            dataFrame = entry['dataFrame']
+            entry['isSaved'] = True
+            entry['savedTime'] = time.monotonic()
+        content = {'version': INDEX_FILE_VERSION,
+                   'columns': list(dataFrame.columns),
+                   'index': list(dataFrame.index),
+                   'data': [[_encodeValue(value) for value in row] for row in dataFrame.itertuples(index=False, name=None)]}
+        temporaryFilePath = entry['path'] + '.tmp'
+        try:
+            with open(temporaryFilePath, 'w') as indexFile:
+                json.dump(content, indexFile)
+            os.replace(temporaryFilePath, entry['path'])
+        except Exception:
+            with _indexLock:
+                entry['isSaved'] = False
+            raise
+
+
+def _readIndex(indexFilePath):
+    """This method returns the index DataFrame saved in the JSON file in indexFilePath"""
+    with open(indexFilePath, 'r') as indexFile:
+        content = json.load(indexFile)
+    if content.get('version') != INDEX_FILE_VERSION:
+        raise ValueError("Index file version {} instead of {}".format(content.get('version'), INDEX_FILE_VERSION))
+    data = [[_decodeValue(value) for value in row] for row in content['data']]
+    return _newDataFrame(data, content['index'], content['columns'])
+
+
+def _newDataFrame(rows, index, columns):
+    """This method returns an index DataFrame. The columns are of object dtype, 
+        so that pandas keeps None, NaN and the DICOM value types as they are."""
+    return pd.DataFrame(rows, index=index, columns=columns, dtype=object)
+
+
+def saveIndexes():
+    """This method saves the loaded indexes that changed since they were saved. It is called when Weasel exits."""
+    logger.info("MetadataIndex.saveIndexes called")
+    try:
+        with _indexLock:
+            entries = [entry for entry in _loadedIndexes.values() if not entry['isSaved']]
+        for entry in entries:
+            _saveIndex(entry)
+    except Exception as e:
+        print('Error in function MetadataIndex.saveIndexes: ' + str(e))
+        logger.exception('Error in MetadataIndex.saveIndexes: ' + str(e))
+
+
+atexit.register(saveIndexes)
+
+
+def buildIndex(datasetList, imagePathList):
+    """This method creates the index DataFrame from the DICOM Dataset objects in datasetList,
+        which were read from the files in imagePathList. The datasets only need to contain the tags in INDEX_TAGS."""
+    logger.info("MetadataIndex.buildIndex called")
+    try:
+        rows = []
+        for dataset, imagePath in zip(datasetList, imagePathList):
+            mtime, size = _getFileStamp(imagePath)
+            rows.append(_getRow(dataset) + [mtime, size])
+        columns = [getColumnName(tag) for tag in INDEX_TAGS] + ['_mtime', '_size']
+        index = [os.path.normpath(imagePath) for imagePath in imagePathList]
+        return _newDataFrame(rows, index, columns)
+    except Exception as e:
+        print('Error in function MetadataIndex.buildIndex: ' + str(e))
+        logger.exception('Error in MetadataIndex.buildIndex: ' + str(e))
+
+
+def writeIndex(dataFrame, xmlFilePath):
+    """This method saves the index DataFrame next to the XML file in xmlFilePath and loads it in memory"""
+    logger.info("MetadataIndex.writeIndex called")
+    try:
+        entry = {'dataFrame': dataFrame, 'path': getIndexFilePath(xmlFilePath), 'savedTime': None, 'isSaved': False}
+        with _indexLock:
+            _loadedIndexes[os.path.dirname(os.path.abspath(xmlFilePath))] = entry
+        _saveIndex(entry)
+    except Exception as e:
+        print('Error in function MetadataIndex.writeIndex: ' + str(e))
+        logger.exception('Error in MetadataIndex.writeIndex: ' + str(e))
+
+
+def loadIndex(xmlFilePath):
+    """This method loads in memory the index saved next to the XML file in xmlFilePath, unless it's loaded already.
+        If there is no index file, an empty index is loaded and it is filled the first time it's queried."""
+    logger.info("MetadataIndex.loadIndex called")
+    try:
+        indexFilePath = getIndexFilePath(xmlFilePath)
+        with _indexLock:
+            entry = _loadedIndexes.get(os.path.dirname(os.path.abspath(xmlFilePath)))
+            if entry is not None and entry['path'] == indexFilePath:
+                return
+        dataFrame = None
+        if os.path.exists(indexFilePath):
+            try:
+                dataFrame = _readIndex(indexFilePath)
+            except Exception as e:
+                logger.warning('MetadataIndex.loadIndex could not read ' + indexFilePath + ': ' + str(e))
+        if dataFrame is None:
+            dataFrame = _newDataFrame([], [], [getColumnName(tag) for tag in INDEX_TAGS] + ['_mtime', '_size'])
+        with _indexLock:
+            _loadedIndexes[os.path.dirname(os.path.abspath(xmlFilePath))] = {'dataFrame': dataFrame, 'path': indexFilePath, 
+                                                                             'savedTime': time.monotonic(), 'isSaved': True}
+    except Exception as e:
+        print('Error in function MetadataIndex.loadIndex: ' + str(e))
+        logger.exception('Error in MetadataIndex.loadIndex: ' + str(e))
+
+
+def getFileStamps(xmlFilePath):
+    """This method returns a dictionary {file path: (modification time, size)} of the files 
+        recorded in the index of the XML file in xmlFilePath, as they were when they were indexed."""
+    logger.info("MetadataIndex.getFileStamps called")
+    try:
+        loadIndex(xmlFilePath)
+        with _indexLock:
+            dataFrame = _loadedIndexes[os.path.dirname(os.path.abspath(xmlFilePath))]['dataFrame']
+            return dict(zip(dataFrame.index, zip(dataFrame['_mtime'].astype(np.int64), dataFrame['_size'].astype(np.int64))))
+    except Exception as e:
+        print('Error in function MetadataIndex.getFileStamps: ' + str(e))
+        logger.exception('Error in MetadataIndex.getFileStamps: ' + str(e))
+        return {}
+
+
+def updateIndex(xmlFilePath, datasetList, imagePathList, removedPathList=None):
+    """This method removes the rows of the files in removedPathList from the index of the XML file in xmlFilePath,
+        adds the rows of the DICOM Dataset objects in datasetList (read from the files in imagePathList) and saves the index."""
+    logger.info("MetadataIndex.updateIndex called")
+    try:
+        if removedPathList is None:
+            removedPathList = []
+        if not datasetList and not removedPathList:
+            return
+        loadIndex(xmlFilePath)
+        with _indexLock:
+            entry = _loadedIndexes[os.path.dirname(os.path.abspath(xmlFilePath))]
+            pathsToDrop = [os.path.normpath(path) for path in list(removedPathList) + list(imagePathList)]
+            dataFrame = entry['dataFrame'].drop(index=pathsToDrop, errors='ignore')
+            if datasetList:
+                newRows = buildIndex(datasetList, imagePathList)
+                dataFrame = pd.concat([dataFrame, newRows]) if len(dataFrame) > 0 else newRows
+            entry['dataFrame'] = dataFrame
+            entry['isSaved'] = False
+        _saveIndex(entry)
+    except Exception as e:
+        print('Error in function MetadataIndex.updateIndex: ' + str(e))
+        logger.exception('Error in MetadataIndex.updateIndex: ' + str(e))
+
+
+def _findIndex(imagePath):
+    """This method returns the loaded index entry whose DICOM folder contains imagePath, or None"""
+    imagePath = os.path.abspath(imagePath)
+    for folder, entry in _loadedIndexes.items():
+        if imagePath.startswith(os.path.join(folder, '')):
+            return entry
+    return None
+
+
+def refreshIndex(imagePathList):
+    """This method makes sure that the rows of the files in imagePathList are up-to-date, reading again
+        only the headers of the files that are not in the index or that changed since they were indexed.
+        Rows of files that no longer exist are removed. It returns the index DataFrame or None if no index is loaded for these files.
+        The headers are read without holding the lock of the indexes and the index file is saved at most every INDEX_SAVE_INTERVAL seconds."""
+    logger.info("MetadataIndex.refreshIndex called")
+    try:
+        if len(imagePathList) == 0:
+            return None
+        with _indexLock:
+            entry = _findIndex(imagePathList[0])
+            if entry is None:
+                return None
+            dataFrame = entry['dataFrame']
+        paths = [os.path.normpath(imagePath) for imagePath in imagePathList]
+        indexed = dataFrame.index.isin(paths)
+        storedStamps = dict(zip(dataFrame.index[indexed], zip(dataFrame['_mtime'][indexed], dataFrame['_size'][indexed])))
+        stalePaths = []
+        removedPaths = []
+        for path in paths:
+            if not os.path.exists(path):
+                if path in storedStamps: removedPaths.append(path)
+            elif storedStamps.get(path) != _getFileStamp(path):
+                stalePaths.append(path)
+        if not stalePaths and not removedPaths:
+            return dataFrame
+        datasetList = [ReadDICOM_Image.getDicomHeader(path) for path in stalePaths]
+        newRows = buildIndex(datasetList, stalePaths)
+        with _indexLock:
+            # The index may have been updated by another thread while the headers were read
+            dataFrame = entry['dataFrame'].drop(index=stalePaths + removedPaths, errors='ignore')
+            dataFrame = pd.concat([dataFrame, newRows]) if len(dataFrame) > 0 else newRows
+            entry['dataFrame'] = dataFrame
+            entry['isSaved'] = False
+            isSaveDue = entry['savedTime'] is None or time.monotonic() - entry['savedTime'] >= INDEX_SAVE_INTERVAL
+        logger.info("MetadataIndex.refreshIndex updated {} and removed {} rows".format(len(stalePaths), len(removedPaths)))
+        if isSaveDue:
+            _saveIndex(entry)
+        return dataFrame
+    except Exception as e:
+        print('Error in function MetadataIndex.refreshIndex: ' + str(e))
+        logger.exception('Error in MetadataIndex.refreshIndex: ' + str(e))
+
+
+def getTagTable(imagePathList, tags):
+    """This method returns a DataFrame indexed by the paths in imagePathList with one column per DICOM tag in tags,
+        like `DICOM_to_DataFrame` but without reading the files.
+        It returns None if there is no index for these files or if any of the tags is not indexed."""
+    logger.info("MetadataIndex.getTagTable called")
+    try:
+        columns = [getColumnName(tag) for tag in tags]
+        indexedColumns = [getColumnName(tag) for tag in INDEX_TAGS]
+        if any(column not in indexedColumns for column in columns):
+            return None
+        dataFrame = refreshIndex(imagePathList)
+        if dataFrame is None:
+            return None
+        existingPaths = [imagePath for imagePath in imagePathList if os.path.exists(imagePath)]
+        table = dataFrame.loc[[os.path.normpath(imagePath) for imagePath in existingPaths], columns]
+        table.index = existingPaths
+        table.columns = list(tags)
+        return table
+    except Exception as e:
+        print('Error in function MetadataIndex.getTagTable: ' + str(e))
+        logger.exception('Error in MetadataIndex.getTagTable: ' + str(e))
+
+
+def _isTimeTag(dicomTag):
+    """This method returns True if the given DICOM tag has the TM value representation"""
+    try:
+        return pydicom.datadict.dictionary_VR(pydicom.tag.Tag(dicomTag)) == "TM"
+    except Exception:
+        return False
+
+
+def getSeriesTagValues(imagePathList, dicomTag):
+    """This method returns the list of values of the given DICOM tag in the files in imagePathList and the number of distinct values,
+        like ReadDICOM_Image.getSeriesTagValues: empty values are 0 and the output is (None, None) if any of the files 
+        doesn't have the tag. It returns None if the tag can't be answered from the index."""
+    logger.info("MetadataIndex.getSeriesTagValues called")
+    try:
+        # Times are converted to seconds and bytes unpacked by ReadDICOM_Image, so these are left to it
+        if _isTimeTag(dicomTag):
+            return None
+        table = getTagTable(imagePathList, [dicomTag])
+        if table is None or len(table) != len(imagePathList):
+            return None
+        attributeList = []
+        for value in table.iloc[:, 0]:
+            if _isMissing(value) and value is not None:
+                return None, None
+            if isinstance(value, bytes):
+                return None
+            attributeList.append(0 if value is None else (list(value) if isinstance(value, tuple) else value))
+        attributeListUnique = []
+        for attribute in attributeList:
+            if attribute not in attributeListUnique:
+                attributeListUnique.append(attribute)
+        return attributeList, len(attributeListUnique)
+    except Exception as e:
+        print('Error in function MetadataIndex.getSeriesTagValues: ' + str(e))
+        logger.exception('Error in MetadataIndex.getSeriesTagValues: ' + str(e))
+
+
+def getTagValues(imagePathList, dicomTag):
+    """This method returns the list of values of the given DICOM tag in the files in imagePathList,
+        or None if the tag can't be answered from the index."""
+    logger.info("MetadataIndex.getTagValues called")
+    try:
+        table = getTagTable(imagePathList, [dicomTag])
+        if table is None or len(table) != len(imagePathList):
+            return None
+        return [None if _isMissing(value) else (list(value) if isinstance(value, tuple) else value) for value in table.iloc[:, 0]]
+    except Exception as e:
+        print('Error in function MetadataIndex.getTagValues: ' + str(e))
+        logger.exception('Error in MetadataIndex.getTagValues: ' + str(e))
+
+
+def where(imagePathList, dicomTag, condition, target):
+    """This method returns the paths in imagePathList whose value of the given DICOM tag satisfies the condition
+        ('==', '!=', '<', '<=', '>' or '>=') with respect to target, or None if the tag can't be answered from the index.
+        Equality is tested on the string representations of the values, the other conditions are tested numerically."""
+    logger.info("MetadataIndex.where called")
+    try:
+        if condition not in OPERATORS:
+            return None
+        table = getTagTable(imagePathList, [dicomTag])
+        if table is None:
+            return None
+        values = table.iloc[:, 0].map(lambda value: 'None' if _isMissing(value) else (str(list(value)) if isinstance(value, tuple) else str(value)))
+        if condition in ['==', '!=']:
+            mask = OPERATORS[condition](values, str(target))
+        else:
+            numericValues = pd.to_numeric(values, errors='coerce')
+            mask = OPERATORS[condition](numericValues, float(target)) & numericValues.notnull()
+        return list(table.index[np.asarray(mask, dtype=bool)])
+    except Exception as e:
+        print('Error in function MetadataIndex.where: ' + str(e))
+        logger.exception('Error in MetadataIndex.where: ' + str(e))
+
+
+def _isMissing(value):
+    """This method returns True if value is a missing entry of the index (None or NaN)"""
+    return value is None or (isinstance(value, float) and np.isnan(value))
@@ -3,23 +3,48 @@ Collection of functions that read DICOM files and return meaningful content stor
 """
 
 import os
+import sys
+import copy
 import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from datetime import datetime
 import pydicom
+from pydicom.sequence import Sequence
+from pydicom.multival import MultiValue
 from nibabel.affines import apply_affine
 import logging
 logger = logging.getLogger(__name__)
 
+# Process-wide LRU cache of parsed DICOM datasets shared by every read path.
+# Entries are keyed on the file path and validated against (mtime, size), so that a file changed on disk
+# is never served stale. The cache is bounded by the estimated memory used by the cached datasets (see _datasetMemoryBytes).
+DATASET_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Approximate memory used by each parsed data element besides its value: the element object and its entry in the dataset
+DATA_ELEMENT_OVERHEAD_BYTES = 200
+_datasetCache = OrderedDict()
+_datasetCacheLock = threading.Lock()
+_datasetCacheStatistics = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+# Process-wide LRU cache of decoded float32 pixel arrays, shared by the image viewers and Image.PixelArray, so that
+# scrolling back and forth through a series doesn't decode the same slice again. Entries are validated like the dataset cache.
+# The memory budget is set from the `<slice_cache_mb>` field of config.xml when Weasel starts.
+SLICE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_sliceCache = OrderedDict()
+_sliceCacheLock = threading.Lock()
+_sliceCacheStatistics = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
 
 def returnPixelArray(imagePath):
-    """This method reads the DICOM file in imagePath and returns the Image/Pixel array"""
+    """This method reads the DICOM file in imagePath and returns the Image/Pixel array.
+        The array is a copy of the one in the slice cache, so the caller may modify it."""
     logger.info("ReadDICOM_Image.returnPixelArray called")
     try:
-        if os.path.exists(imagePath):
-            dataset = getDicomDataset(imagePath)
-            pixelArray = getPixelArray(dataset)
-            return pixelArray
+        pixelArray = getCachedPixelArray(imagePath)
+        if pixelArray is not None:
+            return np.array(pixelArray)
         else:
             return None
     except Exception as e:
@@ -42,25 +67,72 @@ def returnAffineArray(imagePath):
         logger.exception('Error in ReadDICOM_Image.returnAffineArray: ' + str(e))
 
 
+def returnSeriesAffineArray(imagePathList):
+    """This method reads the DICOM files in imagePathList and returns an (N, 4, 4) array 
+        with the Affine/Orientation matrix of each image"""
+    logger.info("ReadDICOM_Image.returnSeriesAffineArray called")
+    try:
+        # The shared cached datasets are only read, so they are not copied
+        return np.array([getAffineArray(_getCachedDataset(imagePath)) for imagePath in imagePathList])
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.returnSeriesAffineArray: ' + str(e))
+        logger.exception('Error in ReadDICOM_Image.returnSeriesAffineArray: ' + str(e))
+
+
 def returnSeriesPixelArray(imagePathList):
     """This method reads the DICOM files in imagePathList and 
     returns a list where each element is a DICOM Dataset object/class"""
     logger.info("ReadDICOM_Image.returnSeriesPixelArray called")
     try:
-        datasetList = getSeriesDicomDataset(imagePathList)
-        imageList = [getPixelArray(dataset) for dataset in datasetList]
-        if imageList:
-            volumeArray = np.array(imageList)
-            del imageList
-            return volumeArray
-        else:
-            del imageList
-            return None
+        return readSeriesVolume(imagePathList)
     except Exception as e:
         print('Error in function ReadDICOM_Image.returnSeriesPixelArray: ' + str(e))
         logger.exception('Error in ReadDICOM_Image.returnSeriesPixelArray: ' + str(e))
 
 
+def readSeriesVolume(imagePathList, maxWorkers=None):
+    """This method reads the DICOM files in imagePathList and returns the (N, Columns, Rows) float32 volume.
+        The volume is allocated once from the Rows/Columns of the first header and the slices are decoded 
+        into it in parallel. Series with multiframe, multi-sample or mixed-size images are stacked slice by slice.
+    """
+    logger.info("ReadDICOM_Image.readSeriesVolume called")
+    try:
+        imagePathList = [imagePath for imagePath in imagePathList if os.path.exists(imagePath)]
+        if not imagePathList:
+            return None
+        header = _getCachedDataset(imagePathList[0], headerOnly=True)
+        if int(getattr(header, 'NumberOfFrames', 1) or 1) > 1 or int(getattr(header, 'SamplesPerPixel', 1)) > 1:
+            return _stackSeriesPixelArray(imagePathList)
+        volumeArray = np.empty((len(imagePathList), int(header.Columns), int(header.Rows)), dtype=np.float32)
+
+        def readSlice(index):
+            # Shallow copy, so that the decoded pixel array is not kept by the dataset shared in the cache
+            pixelArray = getPixelArray(copy.copy(_getCachedDataset(imagePathList[index])))
+            if pixelArray is None or np.shape(pixelArray) != volumeArray.shape[1:]:
+                return False
+            volumeArray[index] = pixelArray
+            return True
+
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            sliceRead = list(executor.map(readSlice, range(len(imagePathList))))
+        if not all(sliceRead):
+            del volumeArray
+            return _stackSeriesPixelArray(imagePathList)
+        return volumeArray
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.readSeriesVolume: ' + str(e))
+        logger.exception('Error in ReadDICOM_Image.readSeriesVolume: ' + str(e))
+
+
+def _stackSeriesPixelArray(imagePathList):
+    """This method returns the pixel arrays of the DICOM files in imagePathList stacked with np.array"""
+    datasetList = getSeriesDicomDataset(imagePathList)
+    if datasetList:
+        return np.array([getPixelArray(dataset) for dataset in datasetList])
+    else:
+        return None
+
+
 def getMultiframeBySlices(dataset, sliceList=None, sort=False):
     """This method splits and sorts the slices in the variable `dataset`. In this case, `dataset` is an Enhanced DICOM object."""
     try:
@@ -104,58 +176,8 @@ def getImageTagValue(imagePath, dicomTag):
     logger.info("ReadDICOM_Image.getImageTagValue called")
     try:
         if os.path.exists(imagePath):
-            dataset = getDicomDataset(imagePath)
-            # The following if statement is an exception for Multi-frame / Enhanced DICOM images (13/08/2021)
-            if (dicomTag == "SliceLocation" or dicomTag == (0x0020,0x1041)) and not hasattr(dataset, "SliceLocation"): dicomTag = (0x2001, 0x100a)
-            # This is not for Enhanced MRI. Only Classic DICOM
-            if isinstance(dicomTag, str):
-                try:
-                    if isinstance(dataset.data_element(dicomTag).value, bytes) == True:
-                        try:
-                            attribute = list(struct.unpack('h', dataset.data_element(dicomTag).value))
-                            if len(attribute) == 1: attribute = attribute[0]
-                        except:
-                            attribute = dataset.data_element(dicomTag).value.decode('utf-8')
-                            if "\\" in attribute: attribute = list(map(eval, attribute.split("\\")))
-                    else:
-                        attribute = dataset.data_element(dicomTag).value
-                    if dataset.data_element(dicomTag).VR == "TM":
-                        if "." in attribute: attribute = (datetime.strptime(attribute, "%H%M%S.%f") - datetime(1900, 1, 1)).total_seconds()
-                        else: attribute = (datetime.strptime(attribute, "%H%M%S") - datetime(1900, 1, 1)).total_seconds()
-                except:
-                    return None
-            elif isinstance(dicomTag, tuple):
-                try:
-                    if isinstance(dataset[dicomTag].value, bytes) == True:
-                        try:
-                            attribute = list(struct.unpack('h', dataset[dicomTag].value))
-                            if len(attribute) == 1: attribute = attribute[0]
-                        except:
-                            attribute = dataset[dicomTag].value.decode('utf-8')
-                            if "\\" in attribute: attribute = list(map(eval, attribute.split("\\")))
-                    else:
-                        attribute = dataset[dicomTag].value
-                    if dataset[dicomTag].VR == "TM": 
-                        if "." in attribute: attribute = (datetime.strptime(attribute, "%H%M%S.%f") - datetime(1900, 1, 1)).total_seconds()
-                        else: attribute = (datetime.strptime(attribute, "%H%M%S") - datetime(1900, 1, 1)).total_seconds()
-                except:
-                    return None
-            else:
-                try:
-                    if isinstance(dataset[hex(dicomTag)].value, bytes) == True:
-                        try:
-                            attribute = list(struct.unpack('h', dataset[hex(dicomTag)].value))
-                            if len(attribute) == 1: attribute = attribute[0]
-                        except:
-                            attribute = dataset[hex(dicomTag)].value.decode('utf-8')
-                            if "\\" in attribute: attribute = list(map(eval, attribute.split("\\")))
-                    else:
-                        attribute = dataset[hex(dicomTag)].value
-                    if dataset[hex(dicomTag)].VR == "TM":
-                        if "." in attribute: attribute = (datetime.strptime(attribute, "%H%M%S.%f") - datetime(1900, 1, 1)).total_seconds()
-                        else: attribute = (datetime.strptime(attribute, "%H%M%S") - datetime(1900, 1, 1)).total_seconds()
-                except:
-                    return None
+            dataset = _getCachedDataset(imagePath, headerOnly=True)
+            attribute = getDatasetTagValue(dataset, dicomTag)
             del dataset
             return attribute
         else:
@@ -165,6 +187,38 @@ def getImageTagValue(imagePath, dicomTag):
         logger.exception('Error in ReadDICOM_Image.getImageTagValue: ' + str(e))
 
 
+def getDatasetTagValue(dataset, dicomTag):
+    """This method returns the value in the given DICOM tag of the DICOM Dataset object/class, 
+        converting bytes values and times (TM) in seconds. It returns None if the tag is not present.
+        Output is : attribute
+    """
+    # The following if statement is an exception for Multi-frame / Enhanced DICOM images (13/08/2021)
+    if (dicomTag == "SliceLocation" or dicomTag == (0x0020,0x1041)) and not hasattr(dataset, "SliceLocation"): dicomTag = (0x2001, 0x100a)
+    # This is not for Enhanced MRI. Only Classic DICOM
+    try:
+        if isinstance(dicomTag, str):
+            dataElement = dataset.data_element(dicomTag)
+        elif isinstance(dicomTag, tuple):
+            dataElement = dataset[dicomTag]
+        else:
+            dataElement = dataset[hex(dicomTag)]
+        if isinstance(dataElement.value, bytes) == True:
+            try:
+                attribute = list(struct.unpack('h', dataElement.value))
+                if len(attribute) == 1: attribute = attribute[0]
+            except:
+                attribute = dataElement.value.decode('utf-8')
+                if "\\" in attribute: attribute = list(map(eval, attribute.split("\\")))
+        else:
+            attribute = dataElement.value
+        if dataElement.VR == "TM":
+            if "." in attribute: attribute = (datetime.strptime(attribute, "%H%M%S.%f") - datetime(1900, 1, 1)).total_seconds()
+            else: attribute = (datetime.strptime(attribute, "%H%M%S") - datetime(1900, 1, 1)).total_seconds()
+        return attribute
+    except:
+        return None
+
+
 def getSeriesTagValues(imagePathList, dicomTag):
     """This method reads the DICOM files in imagePathList and returns the list of values in the given DICOM tag
         Outputs are : attributeList, numAttribute
@@ -174,7 +228,8 @@ def getSeriesTagValues(imagePathList, dicomTag):
     logger.info("ReadDICOM_Image.getSeriesTagValues called")
     try:
         if os.path.exists(imagePathList[0]):
-            datasetList = getSeriesDicomDataset(imagePathList)
+            # The headers are only read, so the cached datasets are not copied
+            datasetList = _getSeriesCachedHeaders(imagePathList)
             # The following if statement is an exception for Multi-frame / Enhanced DICOM images (13/08/2021)
             if (dicomTag == "SliceLocation" or dicomTag == (0x0020,0x1041)) and not hasattr(datasetList[0], "SliceLocation"): dicomTag = (0x2001, 0x100a)
             if not hasattr(datasetList[0], 'PerFrameFunctionalGroupsSequence'):
@@ -302,7 +357,7 @@ def sortSequenceByTag(imagePathList, dicomTag):
                 indices = [index for index, value in enumerate(attributeList) if value == attributeListUnique[i]]
                 indicesSorted.extend(indices)
             # If/Else regarding Multi-Frame DICOM
-            dataset = getDicomDataset(imagePathList[0])
+            dataset = _getCachedDataset(imagePathList[0], headerOnly=True)
             if not hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
                 sortedSequencePath = [imagePathList[index] for index in indicesSorted]
             else:
@@ -338,11 +393,14 @@ def getSeriesDicomDataset(imagePathList):
 
 
 def getDicomDataset(imagePath):
-    """This method reads the DICOM file in imagePath and returns the DICOM Dataset object/class"""
+    """This method reads the DICOM file in imagePath and returns the DICOM Dataset object/class.
+        Parsed datasets are kept in a process-wide LRU cache, so the returned object is a copy that the caller may modify
+        (see _copyDataset). The values of the data elements, such as PixelData, are shared with the cache and not copied.
+    """
     logger.info("ReadDICOM_Image.getDicomDataset called")
     try:
         if os.path.exists(imagePath):
-            return pydicom.dcmread(imagePath)
+            return _copyDataset(_getCachedDataset(imagePath))
         else:
             return None
     except Exception as e:
@@ -350,39 +408,285 @@ def getDicomDataset(imagePath):
         logger.exception('Error in ReadDICOM_Image.getDicomDataset: ' + str(e))
 
 
+def getDicomHeader(imagePath):
+    """This method reads the DICOM file in imagePath up to the pixel data and returns the DICOM Dataset object/class
+        without PixelData. It should be used whenever only the metadata of the file is needed.
+    """
+    logger.info("ReadDICOM_Image.getDicomHeader called")
+    try:
+        if os.path.exists(imagePath):
+            return _copyDataset(_getCachedDataset(imagePath, headerOnly=True))
+        else:
+            return None
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.getDicomHeader when imagePath = {}: '.format(imagePath) + str(e))
+        logger.exception('Error in ReadDICOM_Image.getDicomHeader: ' + str(e))
+
+
+def getSeriesDicomHeader(imagePathList):
+    """This method reads the DICOM files in imagePathList up to the pixel data and 
+    returns a list where each element is a DICOM Dataset object/class without PixelData"""
+    logger.info("ReadDICOM_Image.getSeriesDicomHeader called")
+    try:
+        datasetList = _getSeriesCachedHeaders(imagePathList)
+        if datasetList:
+            return [_copyDataset(dataset) for dataset in datasetList]
+        else:
+            return None
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.getSeriesDicomHeader: ' + str(e))
+        logger.exception('Error in ReadDICOM_Image.getSeriesDicomHeader: ' + str(e))
+
+
+def _getSeriesCachedHeaders(imagePathList):
+    """This method returns the list of the datasets without PixelData of the files in imagePathList 
+        that exist, shared by the cache. The returned datasets must not be modified by the caller."""
+    return [_getCachedDataset(imagePath, headerOnly=True) for imagePath in imagePathList if os.path.exists(imagePath)]
+
+
+def _getCachedDataset(imagePath, headerOnly=False):
+    """This method returns the dataset of imagePath shared by the cache, reading the file only if it's not cached 
+        or if it changed on disk since it was cached. The returned dataset must not be modified by the caller.
+        If headerOnly=True, the file is read with stop_before_pixels and a cached complete dataset is also accepted.
+    """
+    imagePath = os.path.abspath(imagePath)
+    fileStats = os.stat(imagePath)
+    stamp = (fileStats.st_mtime_ns, fileStats.st_size)
+    with _datasetCacheLock:
+        entry = _datasetCache.get(imagePath)
+        if entry is not None and entry[0] == stamp and (headerOnly or not entry[1]):
+            _datasetCache.move_to_end(imagePath)
+            _datasetCacheStatistics['hits'] += 1
+            return entry[2]
+        _datasetCacheStatistics['misses'] += 1
+    if headerOnly:
+        dataset = pydicom.dcmread(imagePath, stop_before_pixels=True)
+    else:
+        dataset = pydicom.dcmread(imagePath)
+    numBytes = _datasetMemoryBytes(dataset)
+    with _datasetCacheLock:
+        entry = _datasetCache.pop(imagePath, None)
+        if entry is not None:
+            _datasetCacheStatistics['bytes'] -= entry[3]
+        if numBytes <= DATASET_CACHE_MAX_BYTES:
+            _datasetCache[imagePath] = (stamp, headerOnly, dataset, numBytes)
+            _datasetCacheStatistics['bytes'] += numBytes
+            _evictDatasetCache()
+    return dataset
+
+
+def _copyDataset(dataset):
+    """This method returns a copy of the dataset shared by the cache that the caller may modify without changing the cached one.
+        Each data element is copied, so that setting a value on the copy doesn't reach the cache, but the values themselves 
+        are shared until they're replaced: PixelData and the other bytes and strings are immutable. Sequences and 
+        multi-valued elements are deep copied, because their items are modified in place.
+    """
+    datasetCopy = copy.copy(dataset)
+    # Elements that were not parsed yet (RawDataElement) are immutable, so they are shared
+    datasetCopy._dict = {tag: _copyDataElement(element) for tag, element in dataset._dict.items()}
+    if hasattr(dataset, '_private_blocks'):
+        datasetCopy._private_blocks = {}
+    if hasattr(dataset, '_pixel_array'):
+        datasetCopy._pixel_array = None
+        datasetCopy._pixel_id = {}
+    if getattr(dataset, 'file_meta', None) is not None:
+        datasetCopy.file_meta = _copyDataset(dataset.file_meta)
+    return datasetCopy
+
+
+def _copyDataElement(element):
+    """This method returns the copy of a data element used by _copyDataset"""
+    if isinstance(element, pydicom.dataelem.RawDataElement):
+        return element
+    if element.VR == 'SQ' or isinstance(element.value, MultiValue):
+        return copy.deepcopy(element)
+    return copy.copy(element)
+
+
+def _datasetMemoryBytes(dataset):
+    """This method returns an estimate of the memory used by a parsed dataset: the size of the value of each 
+        data element, including the elements in the items of its sequences, plus DATA_ELEMENT_OVERHEAD_BYTES each.
+    """
+    numBytes = 0
+    for element in dataset._dict.values():
+        numBytes += DATA_ELEMENT_OVERHEAD_BYTES
+        value = element.value
+        if isinstance(value, Sequence):
+            numBytes += sum(_datasetMemoryBytes(item) for item in value)
+        elif isinstance(value, (bytes, bytearray, str)):
+            numBytes += len(value)
+        elif value is not None:
+            numBytes += sys.getsizeof(value)
+    return numBytes
+
+
+def _evictDatasetCache():
+    """This method removes the least recently used datasets until the cache fits in DATASET_CACHE_MAX_BYTES.
+        It must be called with _datasetCacheLock acquired."""
+    while _datasetCache and _datasetCacheStatistics['bytes'] > DATASET_CACHE_MAX_BYTES:
+        _, entry = _datasetCache.popitem(last=False)
+        _datasetCacheStatistics['bytes'] -= entry[3]
+        _datasetCacheStatistics['evictions'] += 1
+
+
+def invalidateDatasetCache(imagePath):
+    """This method removes the cached dataset and pixel array of the DICOM file(s) in imagePath (string or list)"""
+    logger.info("ReadDICOM_Image.invalidateDatasetCache called")
+    try:
+        if isinstance(imagePath, str):
+            imagePath = [imagePath]
+        with _datasetCacheLock:
+            for path in imagePath:
+                entry = _datasetCache.pop(os.path.abspath(path), None)
+                if entry is not None:
+                    _datasetCacheStatistics['bytes'] -= entry[3]
+        with _sliceCacheLock:
+            for path in imagePath:
+                entry = _sliceCache.pop(os.path.abspath(path), None)
+                if entry is not None:
+                    _sliceCacheStatistics['bytes'] -= entry[1].nbytes
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.invalidateDatasetCache: ' + str(e))
+        logger.exception('Error in ReadDICOM_Image.invalidateDatasetCache: ' + str(e))
+
+
+def clearDatasetCache():
+    """This method empties the dataset cache and resets its counters"""
+    logger.info("ReadDICOM_Image.clearDatasetCache called")
+    with _datasetCacheLock:
+        _datasetCache.clear()
+        for counter in _datasetCacheStatistics:
+            _datasetCacheStatistics[counter] = 0
+
+
+def setDatasetCacheSize(maxBytes):
+    """This method sets the maximum number of bytes held in the dataset cache, evicting datasets if necessary"""
+    logger.info("ReadDICOM_Image.setDatasetCacheSize called")
+    global DATASET_CACHE_MAX_BYTES
+    with _datasetCacheLock:
+        DATASET_CACHE_MAX_BYTES = int(maxBytes)
+        _evictDatasetCache()
+
+
+def getCachedPixelArray(imagePath):
+    """This method returns the Image/Pixel array of the DICOM file in imagePath from the slice cache, decoding the file
+        only if it's not cached or if it changed on disk since it was cached. The returned array is shared by every caller,
+        so it's read-only: use returnPixelArray to get an array that can be modified.
+    """
+    logger.info("ReadDICOM_Image.getCachedPixelArray called")
+    try:
+        if not os.path.exists(imagePath):
+            return None
+        imagePath = os.path.abspath(imagePath)
+        fileStats = os.stat(imagePath)
+        stamp = (fileStats.st_mtime_ns, fileStats.st_size)
+        with _sliceCacheLock:
+            entry = _sliceCache.get(imagePath)
+            if entry is not None and entry[0] == stamp:
+                _sliceCache.move_to_end(imagePath)
+                _sliceCacheStatistics['hits'] += 1
+                return entry[1]
+            _sliceCacheStatistics['misses'] += 1
+        # Shallow copy, so that the decoded pixel array is not kept by the dataset shared in the dataset cache
+        pixelArray = getPixelArray(copy.copy(_getCachedDataset(imagePath)))
+        if pixelArray is None:
+            return None
+        pixelArray.setflags(write=False)
+        with _sliceCacheLock:
+            entry = _sliceCache.pop(imagePath, None)
+            if entry is not None:
+                _sliceCacheStatistics['bytes'] -= entry[1].nbytes
+            if pixelArray.nbytes <= SLICE_CACHE_MAX_BYTES:
+                _sliceCache[imagePath] = (stamp, pixelArray)
+                _sliceCacheStatistics['bytes'] += pixelArray.nbytes
+                _evictSliceCache()
+        return pixelArray
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.getCachedPixelArray when imagePath = {}: '.format(imagePath) + str(e))
+        logger.exception('Error in ReadDICOM_Image.getCachedPixelArray: ' + str(e))
+
+
+def _evictSliceCache():
+    """This method removes the least recently used pixel arrays until the cache fits in SLICE_CACHE_MAX_BYTES.
+        It must be called with _sliceCacheLock acquired."""
+    while _sliceCache and _sliceCacheStatistics['bytes'] > SLICE_CACHE_MAX_BYTES:
+        _, entry = _sliceCache.popitem(last=False)
+        _sliceCacheStatistics['bytes'] -= entry[1].nbytes
+        _sliceCacheStatistics['evictions'] += 1
+
+
+def clearSliceCache():
+    """This method empties the slice cache and resets its counters"""
+    logger.info("ReadDICOM_Image.clearSliceCache called")
+    with _sliceCacheLock:
+        _sliceCache.clear()
+        for counter in _sliceCacheStatistics:
+            _sliceCacheStatistics[counter] = 0
+
+
+def setSliceCacheSize(maxBytes):
+    """This method sets the maximum number of bytes held in the slice cache, evicting pixel arrays if necessary"""
+    logger.info("ReadDICOM_Image.setSliceCacheSize called")
+    global SLICE_CACHE_MAX_BYTES
+    with _sliceCacheLock:
+        SLICE_CACHE_MAX_BYTES = int(maxBytes)
+        _evictSliceCache()
+
+
+def getSliceCacheStatistics():
+    """This method returns a dictionary with the hits, misses, evictions, entries and bytes of the slice cache"""
+    with _sliceCacheLock:
+        statistics = dict(_sliceCacheStatistics)
+        statistics['entries'] = len(_sliceCache)
+        statistics['max_bytes'] = SLICE_CACHE_MAX_BYTES
+    return statistics
+
+
+def getDatasetCacheStatistics():
+    """This method returns a dictionary with the hits, misses, evictions, entries and bytes of the dataset cache"""
+    with _datasetCacheLock:
+        statistics = dict(_datasetCacheStatistics)
+        statistics['entries'] = len(_datasetCache)
+        statistics['max_bytes'] = DATASET_CACHE_MAX_BYTES
+    return statistics
+
+
 def getPixelArray(dataset):
     """This method reads the DICOM Dataset object/class and returns the Image/Pixel array"""
     logger.info("ReadDICOM_Image.getPixelArray called")
     try:
         if any(hasattr(dataset, attr) for attr in ['PixelData', 'FloatPixelData', 'DoubleFloatPixelData']):
+            # Decode the pixel data only once and rescale a single float32 copy of it in place
+            originalArray = dataset.pixel_array
             if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
-                imageList = list()
-                originalArray = dataset.pixel_array.astype(np.float32)
+                # The sequence can hold more items than there are decoded frames
+                frames = dataset.PerFrameFunctionalGroupsSequence
+                frames = frames[:1] if len(np.shape(originalArray)) == 2 else frames[:np.shape(originalArray)[0]]
+                slope = np.array([float(getattr(frame.PixelValueTransformationSequence[0], 'RescaleSlope', 1)) for frame in frames], dtype=np.float32)
+                intercept = np.array([float(getattr(frame.PixelValueTransformationSequence[0], 'RescaleIntercept', 0)) for frame in frames], dtype=np.float32)
                 if len(np.shape(originalArray)) == 2:
-                    slope = float(getattr(dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0], 'RescaleSlope', 1)) * np.ones(originalArray.shape)
-                    intercept = float(getattr(dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0], 'RescaleIntercept', 0)) * np.ones(originalArray.shape)
-                    pixelArray = np.transpose(originalArray * slope + intercept)
+                    slope, intercept = slope[0], intercept[0]
+                    pixelArray = np.transpose(originalArray)
                 else:
-                    for index in range(np.shape(originalArray)[0]):
-                        sliceArray = np.squeeze(originalArray[index, ...])
-                        slope = float(getattr(dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0], 'RescaleSlope', 1)) * np.ones(sliceArray.shape)
-                        intercept = float(getattr(dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0], 'RescaleIntercept', 0)) * np.ones(sliceArray.shape)
-                        tempArray = np.transpose(sliceArray * slope + intercept)
-                        imageList.append(tempArray)
-                    pixelArray = np.array(imageList)
-                    del sliceArray, tempArray, index
-                del originalArray, imageList
+                    # One slope/intercept per frame, broadcast over the rows and columns of each frame
+                    slope, intercept = slope[:, np.newaxis, np.newaxis], intercept[:, np.newaxis, np.newaxis]
+                    pixelArray = np.transpose(originalArray, (0, 2, 1))
             else:
-                slope = float(getattr(dataset, 'RescaleSlope', 1)) * np.ones(dataset.pixel_array.shape)
-                intercept = float(getattr(dataset, 'RescaleIntercept', 0)) * np.ones(dataset.pixel_array.shape)
-                if len(dataset.pixel_array.shape) == 3:
-                    pixelArray = np.rot90(np.array(dataset.pixel_array.astype(np.float32) * slope + intercept), k=1, axes=(0, 1))
+                slope = np.float32(getattr(dataset, 'RescaleSlope', 1))
+                intercept = np.float32(getattr(dataset, 'RescaleIntercept', 0))
+                if len(np.shape(originalArray)) == 3:
+                    pixelArray = np.rot90(originalArray, k=1, axes=(0, 1))
                 else:
-                    pixelArray = np.transpose(dataset.pixel_array.astype(np.float32) * slope + intercept)
+                    pixelArray = np.transpose(originalArray)
             if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
-                pixelArray = pixelArray / (slope * dataset[(0x2005, 0x100E)].value)
-            del slope, intercept
-            return np.nan_to_num(pixelArray)
+                # (pixel * slope + intercept) / (slope * scale) is folded into the slope and intercept
+                philipsSlope = slope * np.float32(dataset[(0x2005, 0x100E)].value)
+                slope, intercept = slope / philipsSlope, intercept / philipsSlope
+            pixelArray = pixelArray.astype(np.float32)
+            pixelArray *= slope
+            pixelArray += intercept
+            del originalArray, slope, intercept
+            return np.nan_to_num(pixelArray, copy=False)
         else:
             return None
     except Exception as e:
@@ -486,6 +790,40 @@ def mapMaskToImage(mask, datasetMask, datasetTarget):
         logger.exception('Error in ReadDICOM_Image.mapMaskToImage: ' + str(e))
 
 
+def mapMaskVolumeToImages(maskVolume, maskAffines, targetAffines, targetShape):
+    """This method maps the nonzero pixels of the mask images in `maskVolume`, with shape (N, Columns, Rows)
+        and affines `maskAffines` (N, 4, 4), to the target images with affines `targetAffines` (M, 4, 4) 
+        and pixel arrays of shape `targetShape`. It returns a boolean (M,) + targetShape array that is True 
+        where the mask maps, the same as scattering the result of mapMaskToImage for every mask and target pair.
+        The mask voxels of each mask image are transformed to all the target images in one matrix product.
+        Voxels that map outside a target image are left out.
+    """
+    logger.info("ReadDICOM_Image.mapMaskVolumeToImages called")
+    try:
+        maskVolume = np.reshape(maskVolume, (-1,) + np.shape(maskVolume)[-2:])
+        maskAffines = np.reshape(maskAffines, (-1, 4, 4))
+        targetAffines = np.reshape(targetAffines, (-1, 4, 4))
+        targetMask = np.zeros((len(targetAffines),) + tuple(targetShape), dtype=bool)
+        inverseTargetAffines = np.linalg.inv(targetAffines)
+        for maskIndex in np.flatnonzero(np.any(maskVolume != 0, axis=(1, 2))):
+            # (M, 4, 4) transforms from this mask image to each target image
+            maskToTarget = np.matmul(inverseTargetAffines, maskAffines[maskIndex])
+            rows, columns = np.nonzero(maskVolume[maskIndex] == 1)
+            coords = np.stack([rows, columns, np.zeros_like(rows)], axis=1)
+            newCoords = np.matmul(coords, np.transpose(maskToTarget[:, :3, :3], (0, 2, 1))) + maskToTarget[:, np.newaxis, :3, 3]
+            newCoords = np.round(newCoords, 3).astype(int)
+            # Keep the voxels in the plane of each target image that fall within it
+            inPlane = ((newCoords[..., 2] == 0) 
+                        & (newCoords[..., 0] >= 0) & (newCoords[..., 0] < targetShape[1])
+                        & (newCoords[..., 1] >= 0) & (newCoords[..., 1] < targetShape[0]))
+            targetIndex, voxelIndex = np.nonzero(inPlane)
+            targetMask[targetIndex, newCoords[targetIndex, voxelIndex, 1], newCoords[targetIndex, voxelIndex, 0]] = True
+        return targetMask
+    except Exception as e:
+        print('Error in function ReadDICOM_Image.mapMaskVolumeToImages: ' + str(e))
+        logger.exception('Error in ReadDICOM_Image.mapMaskVolumeToImages: ' + str(e))
+
+
 def mapCoordinates(indexes, affineTarget, affineMask):
     """This method returns a list of indexes that results from mapping the input argument 
         `indexes` to the coordinate system of the target image.
@@ -526,7 +864,7 @@ def getColourmap(imagePath):
     """This method reads the DICOM file in imagePath and returns the colourmap if there's any"""
     logger.info("ReadDICOM_Image.getColourmap called")
     try:
-        dataset = getDicomDataset(imagePath)
+        dataset = getDicomHeader(imagePath)
         if hasattr(dataset, 'ContentLabel'):
             if dataset.PhotometricInterpretation == 'PALETTE COLOR':
                 colourmapName = dataset.ContentLabel
@@ -3,20 +3,34 @@ Collection of functions that save meaningful content (related to image, colourma
 """
 
 import os
+import shutil
 import numpy as np
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
 from pydicom.sequence import Sequence
-from pydicom.datadict import dictionary_VR
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.tag import Tag
 from datetime import datetime, timedelta
 import copy
 import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib import cm
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
 import DICOM.ParametricMapsDictionary as param
 import logging
 logger = logging.getLogger(__name__)
 
+COPY_BUFFER_SIZE = 16*1024*1024
+# The pixel data elements (7FE0,0008), (7FE0,0009) and (7FE0,0010) and whatever follows them
+# are copied byte for byte by copyDicomFile, so only tags before them can be edited that way
+FIRST_PIXEL_DATA_TAG = 0x7FE00008
+DEFLATED_TRANSFER_SYNTAX = '1.2.840.10008.1.2.1.99'
+# Number of slices handed to each thread of saveDicomNewSeries before it waits for the first one to be written
+MAX_SLICES_IN_FLIGHT_PER_WORKER = 2
+# Number of pixels that _scanPixelValues checks first, so that most images that are not binary are not checked in full
+PIXEL_SCAN_SAMPLE_SIZE = 4096
+
 
 def returnFilePath(imagePath, suffix, new_path=None, output_folder=None):
     """This method returns the new filepath of the object to be saved."""
@@ -53,6 +67,36 @@ def returnFilePath(imagePath, suffix, new_path=None, output_folder=None):
         logger.exception('Error in SaveDICOM_Image.returnFilePath: ' + str(e))
 
 
+def returnFilePathList(imagePathList, suffix, output_folder=None):
+    """This method returns the new filepaths of the objects to be saved, as returnFilePath does for each image,
+        but each output folder is listed only once and no two images are given the same filepath."""
+    logger.info("SaveDICOM_Image.returnFilePathList called")
+    try:
+        usedFileNames = {}
+        newFilePathList = []
+        for imagePath in imagePathList:
+            if output_folder is None:
+                outputFolder = os.path.join(os.path.dirname(imagePath), "output" + suffix)
+            else:
+                outputFolder = output_folder
+            if outputFolder not in usedFileNames:
+                os.makedirs(outputFolder, exist_ok=True)
+                # normcase, because file names are not case sensitive on Windows
+                usedFileNames[outputFolder] = set(os.path.normcase(name) for name in os.listdir(outputFolder))
+            fileName = os.path.splitext(os.path.basename(imagePath))[0]
+            newFileName = fileName + suffix + '.dcm'
+            counter = 1
+            while os.path.normcase(newFileName) in usedFileNames[outputFolder]:
+                newFileName = fileName + suffix + '(' + str(counter) + ')' + '.dcm'
+                counter += 1
+            usedFileNames[outputFolder].add(os.path.normcase(newFileName))
+            newFilePathList.append(os.path.join(outputFolder, newFileName))
+        return newFilePathList
+    except Exception as e:
+        print('Error in function SaveDICOM_Image.returnFilePathList: ' + str(e))
+        logger.exception('Error in SaveDICOM_Image.returnFilePathList: ' + str(e))
+
+
 def saveNewSingleDicomImage(newFilePath, imagePath, pixelArray, suffix, series_id=None, series_uid=None, series_name=None, image_number=None, parametric_map=None, colourmap=None, list_refs_path=None):
     """This method saves the new pixelArray into DICOM in the given newFilePath"""
     logger.info("SaveDICOM_Image.saveNewSingleDicomImage called")
@@ -106,8 +150,11 @@ def updateSingleDicomImage(objWeasel, spinBoxIntensity, spinBoxContrast,
         logger.exception('Error in SaveDICOM_Image.updateSingleDicomImage: ' + str(e))
 
 
-def saveDicomNewSeries(derivedImagePathList, imagePathList, pixelArrayList, suffix, series_id=None, series_uid=None, series_name=None, parametric_map=None, colourmap=None, list_refs_path=None):
-    """This method saves the pixelArrayList into DICOM files with metadata pointing to the same series"""
+def saveDicomNewSeries(derivedImagePathList, imagePathList, pixelArrayList, suffix, series_id=None, series_uid=None, series_name=None, parametric_map=None, colourmap=None, list_refs_path=None, maxWorkers=None):
+    """This method saves the pixelArrayList into DICOM files with metadata pointing to the same series.
+        The images are encoded and written by a pool of maxWorkers threads. The slices of pixelArrayList
+        are indexed one at a time on the calling thread, with a bounded number of slices in flight, 
+        so a LazyPixelArray is not loaded whole."""
     # What if it's a map with less files than original? Think about iterating the first elements and sort path list by SliceLocation - see T2* algorithm
     # Think of a way to choose a select a new FilePath or Folder
     logger.info("SaveDICOM_Image.saveDicomNewSeries called")
@@ -123,26 +170,34 @@ def saveDicomNewSeries(derivedImagePathList, imagePathList, pixelArrayList, suff
             elif (series_id is None) and (series_uid is not None):
                 series_id = int(str(ReadDICOM_Image.getDicomDataset(imagePathList[0]).SeriesNumber) + str(random.randint(0, 9999)))
 
+            if maxWorkers is None:
+                maxWorkers = min(32, (os.cpu_count() or 1) + 4)
             refs = None
-            for index, newFilePath in enumerate(derivedImagePathList):
-                # Extra references, besides the main one, which is imagePathList
-                if list_refs_path is not None:
-                    if len(np.shape(list_refs_path)) == 1:
-                        refs = list_refs_path[index]
-                    else:
-                        refs = []
-                        for individualRef in list_refs_path:
-                            refs.append(individualRef[index])
-                if colourmap is not None:
-                    if isinstance(colourmap, str):
-                        colour = colourmap
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                pending = deque()
+                for index, newFilePath in enumerate(derivedImagePathList):
+                    # Extra references, besides the main one, which is imagePathList
+                    if list_refs_path is not None:
+                        if len(np.shape(list_refs_path)) == 1:
+                            refs = list_refs_path[index]
+                        else:
+                            refs = []
+                            for individualRef in list_refs_path:
+                                refs.append(individualRef[index])
+                    if colourmap is not None:
+                        if isinstance(colourmap, str):
+                            colour = colourmap
+                        else:
+                            colour = colourmap[index, ...]
                     else:
-                        colour = colourmap[index, ...]
-                else:
-                    colour = None
-
-                saveNewSingleDicomImage(newFilePath, imagePathList[index], pixelArrayList[index], suffix, series_id=series_id, series_uid=series_uid, series_name=series_name, image_number=index+1, parametric_map=parametric_map, 
-                                      colourmap=colour, list_refs_path=refs)
+                        colour = None
+                    if len(pending) >= maxWorkers * MAX_SLICES_IN_FLIGHT_PER_WORKER:
+                        pending.popleft().result()
+                    pending.append(executor.submit(saveNewSingleDicomImage, newFilePath, imagePathList[index], pixelArrayList[index], suffix, 
+                                        series_id=series_id, series_uid=series_uid, series_name=series_name, image_number=index+1, parametric_map=parametric_map, 
+                                        colourmap=colour, list_refs_path=refs))
+                for future in pending:
+                    future.result()
             del series_id, series_uid, refs
             return
         else:
@@ -180,6 +235,140 @@ def generateUIDs(dataset, seriesNumber=None, studyUID=None):
         logger.exception('Error in SaveDICOM_Image.generateUIDs: ' + str(e))
 
 
+def setDatasetTagValue(dataset, dicomTag, newValue):
+    """
+    This method writes the `newValue` into the `dicomTag` of the pydicom dataset in memory.
+    If `dicomTag` exists in `dataset`, this will overwrite.
+    Otherwise, it will create `dicomTag` and store the `newValue`.
+    """
+    if isinstance(dicomTag, str):
+        try: 
+            if dataset.data_element(dicomTag).VR == "TM": 
+                dataset.data_element(dicomTag).value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
+            else:
+                dataset.data_element(dicomTag).value = newValue
+        except:
+            if dictionary_VR(dicomTag) == "TM": 
+                dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
+            else:
+                dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue) 
+    elif isinstance(dicomTag, tuple):
+        try:
+            if dataset[dicomTag].VR == "TM":
+                dataset[dicomTag].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
+            else:
+                dataset[dicomTag].value = newValue
+        except:
+            if dataset[dicomTag].VR == "TM":
+                dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
+            else:
+                dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue)
+    else:
+        try:
+            if dataset[hex(dicomTag)].VR == "TM":
+                dataset[hex(dicomTag)].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
+            else:
+                dataset[hex(dicomTag)].value = newValue
+        except:
+            if dataset[hex(dicomTag)].VR == "TM":
+                dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
+            else:
+                dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), newValue)
+    return dataset
+
+
+def setDatasetTagValues(dataset, tagValues):
+    """
+    This method writes all values of the dictionary `tagValues` (DICOM tag -> new value)
+    into the pydicom dataset in memory, in the order of the dictionary, and returns the dataset.
+    """
+    for dicomTag, newValue in tagValues.items():
+        setDatasetTagValue(dataset, dicomTag, newValue)
+    return dataset
+
+
+def overwriteDicomFileTags(imagePath, tagValues):
+    """
+    This method writes all values of the dictionary `tagValues` (DICOM tag -> new value)
+    into the DICOM file `imagePath`, or into each file if `imagePath` is a list.
+    Each file is read once and written once, whatever the number of tags.
+    """
+    logger.info("SaveDICOM_Image.overwriteDicomFileTags called")
+    pathList = imagePath if isinstance(imagePath, list) else [imagePath]
+    for path in pathList:
+        # A file that can't be edited is left as it was and the other files are still edited
+        try:
+            copyDicomFile(path, path, tagValues)
+        except Exception as e:
+            print('Error in SaveDICOM_Image.overwriteDicomFileTags: ' + str(e))
+            logger.exception('Error in SaveDICOM_Image.overwriteDicomFileTags: ' + str(e))
+
+
+def copyDicomFile(imagePath, outputPath, tagValues=None):
+    """
+    This method copies the DICOM file `imagePath` to `outputPath`, writing the values of the 
+    dictionary `tagValues` (DICOM tag -> new value) into the copy. `outputPath` can be `imagePath`.
+
+    Only the header is decoded and written again. The pixel data and anything after it 
+    are copied from the original file as they are, without decoding them.
+    If that is not possible (deflated files or edits of tags after the pixel data), 
+    the whole dataset is read and written with pydicom.
+
+    Errors are raised to the caller. A copy that fails is deleted, and `imagePath` 
+    is left unchanged when `outputPath` is `imagePath`.
+    """
+    logger.info("SaveDICOM_Image.copyDicomFile called")
+    if tagValues is None:
+        tagValues = {}
+    sameFile = os.path.abspath(imagePath) == os.path.abspath(outputPath)
+    # When a file is edited in place, the new file is written next to it and only replaces it once it's complete
+    writePath = outputPath + '.tmp' if sameFile else outputPath
+    try:
+        with open(imagePath, 'rb') as inputFile:
+            dataset = pydicom.dcmread(inputFile, stop_before_pixels=True)
+            pixelDataOffset = inputFile.tell()
+            copyPixelDataBytes = _canCopyPixelDataBytes(dataset, tagValues)
+            if copyPixelDataBytes:
+                setDatasetTagValues(dataset, tagValues)
+                with open(writePath, 'wb') as outputFile:
+                    pydicom.filewriter.dcmwrite(outputFile, dataset, write_like_original=True)
+                    inputFile.seek(pixelDataOffset)
+                    shutil.copyfileobj(inputFile, outputFile, COPY_BUFFER_SIZE)
+        if not copyPixelDataBytes:
+            dataset = pydicom.dcmread(imagePath)
+            setDatasetTagValues(dataset, tagValues)
+            pydicom.filewriter.dcmwrite(writePath, dataset, write_like_original=True)
+        if sameFile:
+            os.replace(writePath, outputPath)
+    except Exception:
+        # Don't leave a partial file behind
+        if os.path.exists(writePath):
+            os.remove(writePath)
+        raise
+    finally:
+        ReadDICOM_Image.invalidateDatasetCache(outputPath)
+
+
+def _canCopyPixelDataBytes(dataset, tagValues):
+    """
+    Returns True if the bytes following the header of the file read into `dataset` can be copied 
+    as they are after writing the values of `tagValues` into the header.
+    """
+    fileMeta = getattr(dataset, 'file_meta', None)
+    if fileMeta is None or 'TransferSyntaxUID' not in fileMeta:
+        return False
+    if fileMeta.TransferSyntaxUID == DEFLATED_TRANSFER_SYNTAX:
+        return False
+    for dicomTag in tagValues:
+        if isinstance(dicomTag, str):
+            tagNumber = tag_for_keyword(dicomTag)
+        else:
+            tagNumber = Tag(dicomTag)
+        if tagNumber is None or tagNumber >= FIRST_PIXEL_DATA_TAG:
+            return False
+    return True
+
+
 def overwriteDicomFileTag(imagePath, dicomTag, newValue):
     """
     This method writes the `newValue` into the `dicomTag` in `imagePath`.
@@ -187,84 +376,7 @@ def overwriteDicomFileTag(imagePath, dicomTag, newValue):
     Otherwise, it will create `dicomTag` and store the `newValue`.
     """
     logger.info("SaveDICOM_Image.overwriteDicomFileTag called")
-    try:
-        if isinstance(imagePath, list):
-            datasetList = ReadDICOM_Image.getSeriesDicomDataset(imagePath)
-            for index, dataset in enumerate(datasetList):
-                if isinstance(dicomTag, str):
-                    try: 
-                        if dataset.data_element(dicomTag).VR == "TM": 
-                            dataset.data_element(dicomTag).value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                        else:
-                            dataset.data_element(dicomTag).value = newValue
-                    except:
-                        if dictionary_VR(dicomTag) == "TM": 
-                            dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                        else:
-                            dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue) 
-                elif isinstance(dicomTag, tuple):
-                    try:
-                        if dataset[dicomTag].VR == "TM":
-                            dataset[dicomTag].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                        else:
-                            dataset[dicomTag].value = newValue
-                    except:
-                        if dataset[dicomTag].VR == "TM":
-                            dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                        else:
-                            dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue)
-                else:
-                    try:
-                        if dataset[hex(dicomTag)].VR == "TM":
-                            dataset[hex(dicomTag)].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                        else:
-                            dataset[hex(dicomTag)].value = newValue
-                    except:
-                        if dataset[hex(dicomTag)].VR == "TM":
-                            dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                        else:
-                            dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), newValue)
-                saveDicomToFile(dataset, output_path=imagePath[index])
-        else:
-            dataset = ReadDICOM_Image.getDicomDataset(imagePath)
-            if isinstance(dicomTag, str):
-                try: 
-                    if dataset.data_element(dicomTag).VR == "TM": 
-                        dataset.data_element(dicomTag).value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                    else:
-                        dataset.data_element(dicomTag).value = newValue
-                except:
-                    if dictionary_VR(dicomTag) == "TM": 
-                        dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                    else:
-                        dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue) 
-            elif isinstance(dicomTag, tuple):
-                try:
-                    if dataset[dicomTag].VR == "TM":
-                        dataset[dicomTag].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                    else:
-                        dataset[dicomTag].value = newValue
-                except:
-                    if dataset[dicomTag].VR == "TM":
-                        dataset.add_new(dicomTag, dictionary_VR(dicomTag), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                    else:
-                        dataset.add_new(dicomTag, dictionary_VR(dicomTag), newValue)
-            else:
-                try:
-                    if dataset[hex(dicomTag)].VR == "TM":
-                        dataset[hex(dicomTag)].value = datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S")
-                    else:
-                        dataset[hex(dicomTag)].value = newValue
-                except:
-                    if dataset[hex(dicomTag)].VR == "TM":
-                        dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), datetime.strptime(str(timedelta(seconds=int(newValue))), "%H:%M:%S"))
-                    else:
-                        dataset.add_new(hex(dicomTag), dictionary_VR(hex(dicomTag)), newValue)
-            saveDicomToFile(dataset, output_path=imagePath)
-        return
-    except Exception as e:
-        print('Error in SaveDICOM_Image.overwriteDicomFileTag: ' + str(e))
-        logger.exception('Error in SaveDICOM_Image.overwriteDicomFileTag: ' + str(e))
+    overwriteDicomFileTags(imagePath, {dicomTag: newValue})
 
 
 def createNewPixelArray(imageArray, dataset):
@@ -275,57 +387,77 @@ def createNewPixelArray(imageArray, dataset):
         # Delete 'Philips Rescale Slope' tag if it exists
         if [0x2005, 0x100E] in dataset:
             del dataset[0x2005, 0x100E]
-        # If the new array is a binary image / mask
-        if len(np.unique(imageArray)) == 2:
-            param.editDicom(dataset, imageArray, "SEG")
-            return dataset
         numberFrames = 1
         enhancedArrayInt = []
         numDimensions = len(np.shape(imageArray))
         # If Enhanced MRI, then:
         # For each frame, slope and intercept are M and B. For registration, I will have to add Image Position and Orientation
         if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
-            if numDimensions == 2:
-                dataset.NumberOfFrames = 1
-            else:
-                dataset.NumberOfFrames = np.shape(imageArray)[0]
-            del dataset.PerFrameFunctionalGroupsSequence[dataset.NumberOfFrames:]
-            numberFrames = dataset.NumberOfFrames
+            numberFrames = 1 if numDimensions == 2 else np.shape(imageArray)[0]
+        # The minimum, maximum and, for binary images, the distinct values of each frame
+        frameList = []
+        frameValues = set()
         for index in range(numberFrames):
             if len(np.shape(imageArray)) == 2:
                 tempArray = imageArray
             else:
                 tempArray = np.squeeze(imageArray[index, ...])
+            minimum, maximum, values = _scanPixelValues(tempArray)
+            frameList.append((tempArray, minimum, maximum))
+            frameValues = None if (values is None or frameValues is None) else frameValues | values
+        # If the new array is a binary image / mask
+        if frameValues is not None and len(frameValues) == 2:
+            param.editDicom(dataset, imageArray, "SEG")
+            return dataset
+        if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+            dataset.NumberOfFrames = numberFrames
+            del dataset.PerFrameFunctionalGroupsSequence[dataset.NumberOfFrames:]
+            numberFrames = dataset.NumberOfFrames
+        if dataset.BitsAllocated == 8:
+            integerType = np.uint8
+        elif dataset.BitsAllocated == 16:
+            integerType = np.uint16
+        elif dataset.BitsAllocated == 32:
+            integerType = np.uint32
+        elif dataset.BitsAllocated == 64:
+            integerType = np.uint64
+        else:
+            integerType = dataset.pixel_array.dtype
+        imageScaled = None
+        for index, (tempArray, minimum, maximum) in enumerate(frameList):
             dataset.PixelRepresentation = 0
-            target = (np.power(2, dataset.BitsAllocated) - 1) * np.ones(np.shape(tempArray))
-            maximum = np.ones(np.shape(tempArray)) * np.amax(tempArray)
-            minimum = np.ones(np.shape(tempArray)) * np.amin(tempArray)
-            imageScaled = target * (tempArray - minimum) / (maximum - minimum)
-            slope =  target / (maximum - minimum)
-            intercept = (- target * minimum)/ (maximum - minimum)
-            rescaleSlope = np.ones(np.shape(tempArray)) / slope
-            rescaleIntercept = - intercept / slope
-            if dataset.BitsAllocated == 8:
-                imageArrayInt = imageScaled.astype(np.uint8)
-            elif dataset.BitsAllocated == 16:
-                imageArrayInt = imageScaled.astype(np.uint16)
-            elif dataset.BitsAllocated == 32:
-                imageArrayInt = imageScaled.astype(np.uint32)
-            elif dataset.BitsAllocated == 64:
-                imageArrayInt = imageScaled.astype(np.uint64)
+            # Slope and intercept are scalars, computed in float64 as the pixels are
+            target = np.float64(np.power(2, dataset.BitsAllocated) - 1)
+            valueRange = np.float64(maximum) - np.float64(minimum)
+            if valueRange == 0:
+                # Constant image: every pixel is stored as 0 and the intercept restores the value
+                rescaleSlope, rescaleIntercept = 1.0, np.float64(minimum)
             else:
-                imageArrayInt = imageScaled.astype(dataset.pixel_array.dtype)
-            dataset.add_new('0x00280106', 'US', int(np.amin(imageArrayInt)))
+                slope =  target / valueRange
+                intercept = (- target * np.float64(minimum)) / valueRange
+                rescaleSlope = 1.0 / slope
+                rescaleIntercept = - intercept / slope
+            # target * (tempArray - minimum) / (maximum - minimum), reusing one float64 buffer
+            if imageScaled is None or np.shape(imageScaled) != np.shape(tempArray):
+                imageScaled = np.empty(np.shape(tempArray), dtype=np.float64)
+            np.subtract(tempArray, np.float64(minimum), out=imageScaled, dtype=np.float64)
+            if valueRange != 0:
+                np.multiply(imageScaled, target, out=imageScaled)
+                np.divide(imageScaled, valueRange, out=imageScaled)
+            imageArrayInt = np.empty(np.shape(tempArray), dtype=integerType)
+            np.copyto(imageArrayInt, imageScaled, casting='unsafe')
+            # The scaled minimum is 0
+            dataset.add_new('0x00280106', 'US', 0)
             dataset.add_new('0x00280107', 'US', int(np.amax(imageArrayInt)))
             if hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
                 # Rotate back to Original Position
                 enhancedArrayInt.append(np.transpose(imageArrayInt))
                 # Rescsale Slope and Intercept
-                dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleSlope = rescaleSlope.flatten()[0]
-                dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleIntercept = rescaleIntercept.flatten()[0]
+                dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleSlope = rescaleSlope
+                dataset.PerFrameFunctionalGroupsSequence[index].PixelValueTransformationSequence[0].RescaleIntercept = rescaleIntercept
                 # Set Window Center and Width
-                center = (np.amax(tempArray) + np.amin(tempArray)) / 2 # (0 if int(np.amin(imageArrayInt)) < 0 else int(target.flatten()[0]/2))
-                width = np.amax(tempArray) - np.amin(tempArray) # int(target.flatten()[0])
+                center = (maximum + minimum) / 2 # (0 if int(np.amin(imageArrayInt)) < 0 else int(target.flatten()[0]/2))
+                width = maximum - minimum # int(target.flatten()[0])
                 if width == 1.0: width = 1.1 
                 dataset.PerFrameFunctionalGroupsSequence[index].FrameVOILUTSequence[0].WindowCenter = center
                 dataset.PerFrameFunctionalGroupsSequence[index].FrameVOILUTSequence[0].WindowWidth = width
@@ -333,11 +465,11 @@ def createNewPixelArray(imageArray, dataset):
                 # Rotate back to Original Position
                 imageArrayInt = np.transpose(imageArrayInt)
                 # Rescsale Slope and Intercept
-                dataset.RescaleSlope = rescaleSlope.flatten()[0]
-                dataset.RescaleIntercept = rescaleIntercept.flatten()[0]
+                dataset.RescaleSlope = rescaleSlope
+                dataset.RescaleIntercept = rescaleIntercept
                 # Set Window Center and Width
-                center = (np.amax(tempArray) + np.amin(tempArray)) / 2
-                width = np.amax(tempArray) - np.amin(tempArray)
+                center = (maximum + minimum) / 2
+                width = maximum - minimum
                 if width == 1.0: width = 1.1
                 dataset.add_new('0x00281050', 'DS', center)
                 dataset.add_new('0x00281051', 'DS', width)
@@ -350,13 +482,30 @@ def createNewPixelArray(imageArray, dataset):
         dataset.Rows = np.shape(imageArrayInt)[-2]
         dataset.Columns = np.shape(imageArrayInt)[-1]
         dataset.PixelData = imageArrayInt.tobytes()
-        del imageScaled, enhancedArrayInt, tempArray
+        del imageScaled, enhancedArrayInt, tempArray, frameList
         return dataset
     except Exception as e:
         print('Error in SaveDICOM_Image.createNewPixelArray: ' + str(e))
         logger.exception('Error in SaveDICOM_Image.createNewPixelArray: ' + str(e))
 
 
+def _scanPixelValues(imageArray):
+    """This method returns the minimum and the maximum of imageArray and the set of its distinct values,
+        or None instead of the set if there are more than 2. The distinct values are only checked 
+        in the whole array if the first PIXEL_SCAN_SAMPLE_SIZE pixels hold no other value than the minimum and the maximum.
+    """
+    flatArray = np.ravel(imageArray)
+    minimum, maximum = np.amin(flatArray), np.amax(flatArray)
+    if minimum == maximum:
+        return minimum, maximum, {minimum.item()}
+    sample = flatArray[:PIXEL_SCAN_SAMPLE_SIZE]
+    if not np.all((sample == minimum) | (sample == maximum)):
+        return minimum, maximum, None
+    if not np.all((flatArray == minimum) | (flatArray == maximum)):
+        return minimum, maximum, None
+    return minimum, maximum, {minimum.item(), maximum.item()}
+
+
 def createNewSingleDicom(dicomData, imageArray, series_id=None, series_uid=None, series_name=None, comment=None, parametric_map=None, colourmap=None, list_refs=None):
     """This function takes a DICOM Object, copies most of the DICOM tags from the DICOM given in input
         and writes the imageArray into the new DICOM Object in PixelData. 
@@ -604,6 +753,7 @@ def saveDicomToFile(dicomData, output_path=None):
                     output_path = os.getcwd() + str(dicomData.SOPInstanceUID) + ".dcm"
 
         pydicom.filewriter.dcmwrite(output_path, dicomData, write_like_original=True)
+        ReadDICOM_Image.invalidateDatasetCache(output_path)
         # Try to read the new generated file to check if it's corrupted
         #list_tags = ['InstanceNumber', 'SOPInstanceUID', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData', 'AcquisitionTime',
         #             'AcquisitionDate', 'SeriesTime', 'SeriesDate', 'PatientName', 'PatientID', 'StudyDate', 'StudyTime', 
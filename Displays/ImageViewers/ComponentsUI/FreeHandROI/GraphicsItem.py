@@ -15,12 +15,11 @@ enclosed by this boundary in infilled with red.
 """
 from PyQt5.QtCore import (QRectF, QRect, QPoint, Qt)
 from PyQt5 import QtGui, QtCore
-from PyQt5.QtGui import (QPainter, QPixmap, QColor, QImage, QCursor, qRgb)
+from PyQt5.QtGui import (QPainter, QPixmap, QImage, QCursor)
 from PyQt5.QtWidgets import  QGraphicsObject, QApplication, QMenu, QAction
 import numpy as np
 from scipy.stats import iqr
 from numpy import nanmin, nanmax
-from matplotlib.path import Path as MplPath
 import sys
 from .HelperFunctions import *
 from .Resources import * 
@@ -56,13 +55,18 @@ class GraphicsItem(QGraphicsObject):
         self.start_y = None
         self.pathCoordsList = []
         self.setAcceptHoverEvents(True)
-        self.listROICoords = None
         self.xMouseCoord  = None
         self.yMouseCoord  = None
         self.pixelValue = None
         self.mouseMoved = False
         self.mask = None
         self.pixelArray = None
+        #ARGB arrays of the image as returned by makeARGB, indexed [x, y].
+        #origImgData is the image without the ROI and imgData the image
+        #displayed, with the ROI coloured red.
+        self.origImgData = None
+        self.imgData = None
+        self.alpha = None
 
 
     def setImage(self, pixelArray, roi, path):
@@ -79,7 +83,6 @@ class GraphicsItem(QGraphicsObject):
         path - file path to the image file
         """
         logger.info("GraphicsItem.setImage called")
-        self.origQImage = None
         self.qImage = None
         self.mask = None
         self.pixelArray = pixelArray
@@ -89,15 +92,15 @@ class GraphicsItem(QGraphicsObject):
             minValue, maxValue = self.__quickMinMax(self.pixelArray)
         self.contrast = maxValue - minValue
         self.intensity = minValue + (maxValue - minValue)/2
-        imgData, alpha = makeARGB(data=self.pixelArray, levels=[minValue, maxValue])
-        self.origQImage = makeQImage(imgData, alpha)
-        self.qImage = makeQImage(imgData, alpha)
+        self.origImgData, self.alpha = makeARGB(data=self.pixelArray, levels=[minValue, maxValue])
+        self.imgData = self.origImgData.copy()
         if roi is not None:
             #add roi to pixel map
             self.addROItoImage(roi)
             self.mask = roi
         #The contents of self.pixMap are displayed in this graphics item 
         #in the paint event
+        self.qImage = makeQImage(self.imgData, self.alpha)
         self.pixMap = QPixmap.fromImage(self.qImage)
         self.width = float(self.pixMap.width()) 
         self.height = float(self.pixMap.height())
@@ -129,14 +132,13 @@ class GraphicsItem(QGraphicsObject):
         try:
             minValue = intensity - (contrast/2)
             maxValue = contrast + minValue
-            imgData, alpha = makeARGB(data=self.pixelArray, levels=[minValue, maxValue])
-            self.qImage = makeQImage(imgData, alpha)
-            self.pixMap = QPixmap.fromImage(self.qImage)
+            self.origImgData, self.alpha = makeARGB(data=self.pixelArray, levels=[minValue, maxValue])
+            self.imgData = self.origImgData.copy()
             #Need to reapply mask
             if roi is not None and roi.any():
-                self.reloadMask(roi)
+                colourPixelsRed(self.imgData, np.nonzero(np.transpose(roi)))
             #repaint the image with the new contrast & intensity values. 
-            self.update()
+            self.updatePixMap()
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.updateImageLevels: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.updateImageLevels: ' + str(e))
@@ -351,9 +353,7 @@ class GraphicsItem(QGraphicsObject):
 
             self.sigRecalculateMeanROI.emit()
             
-            self.listROICoords = self.getListRoiInnerPoints(self.mask)
             self.fillFreeHandRoi()
-            self.update()
             self.start_x = None 
             self.start_y = None
             self.last_x = None
@@ -449,26 +449,12 @@ class GraphicsItem(QGraphicsObject):
         if self.mask is None:
             self.createBlankMask()
             
-        if self.linkToGraphicsView.pixelSquareSize == 1:
-            #indices reversed for setting mask values to
-            #fit with the numpy [rows, columns] format
-            self.mask[self.yMouseCoord, self.xMouseCoord] = True
-            self.setPixelToRed(self.xMouseCoord, self.yMouseCoord)
-        else:
-            increment = (self.linkToGraphicsView.pixelSquareSize - 1)/2
-            lowX = int(self.xMouseCoord - increment)
-            highX = int(self.xMouseCoord + increment)
-            lowY = int(self.yMouseCoord - increment)
-            highY = int(self.yMouseCoord + increment)
-            
-            for x in range(lowX, highX+1, 1):
-                for y in range(lowY, highY+1, 1):
-                    if x > -1 and  y > -1:
-                        #indices reversed for setting mask values to
-                        #fit with the numpy [rows, columns] format
-                        self.mask[y, x] = True
-                        self.setPixelToRed(x, y)    
-        self.update()
+        columns, rows = self.getBrushSquare()
+        #indices reversed for setting mask values to
+        #fit with the numpy [rows, columns] format
+        self.mask[rows, columns] = True
+        colourPixelsRed(self.imgData, (columns, rows))
+        self.updatePixMap()
         self.sigGetDetailsROI.emit()
         self.linkToGraphicsView.dictROIs.addMask(self.mask)
         self.sigRecalculateMeanROI.emit()
@@ -484,25 +470,12 @@ class GraphicsItem(QGraphicsObject):
         #Make sure we are erasing the RIO on the latest version of the mask
         self.mask = self.linkToGraphicsView.dictROIs.getUpdatedMask()
         if self.mask is not None:
-            if self.linkToGraphicsView.pixelSquareSize == 1:
-                self.resetPixelToOriginalValue(self.xMouseCoord, self.yMouseCoord)
-                #indices reversed for setting mask values to
-                #fit with the numpy [rows, columns] format
-                self.mask[self.yMouseCoord, self.xMouseCoord] = False
-            else:
-                increment = (self.linkToGraphicsView.pixelSquareSize - 1)/2
-                lowX = int(self.xMouseCoord - increment)
-                highX = int(self.xMouseCoord + increment)
-                lowY = int(self.yMouseCoord - increment)
-                highY = int(self.yMouseCoord + increment)
-            
-                for x in range(lowX, highX+1, 1):
-                    for y in range(lowY, highY+1, 1):
-                        if x > -1 and  y > -1:
-                            self.resetPixelToOriginalValue(x, y)
-                            #indices reversed for setting mask values to
-                            #fit with the numpy [rows, columns] format
-                            self.mask[y, x] = False
+            columns, rows = self.getBrushSquare()
+            self.imgData[columns, rows] = self.origImgData[columns, rows]
+            #indices reversed for setting mask values to
+            #fit with the numpy [rows, columns] format
+            self.mask[rows, columns] = False
+            self.updatePixMap()
                             
             self.sigGetDetailsROI.emit()
             #update existing mask
@@ -521,12 +494,8 @@ class GraphicsItem(QGraphicsObject):
         """
         logger.info("FreeHandROI.GraphicsItem.resetPixelToOriginalValue called")
         try:
-            origPixelValue = self.origQImage.pixel(x, y) 
-            self.qImage.setPixel(x, y,  origPixelValue)
-            #convert QImage to QPixmap to be able to update image
-            self.pixMap = QPixmap.fromImage(self.qImage)
-            #repaint image by updating it
-            self.update()
+            self.imgData[x, y] = self.origImgData[x, y]
+            self.updatePixMap()
             
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.resetPixelToOriginalValue: ' + str(e))
@@ -540,22 +509,8 @@ class GraphicsItem(QGraphicsObject):
         """
         logger.info("FreeHandROI.GraphicsItem.setPixelToRed called")
         try:
-            pixelColour = self.qImage.pixel(x, y) 
-            pixelRGB =  QColor(pixelColour).getRgb()
-            redVal = pixelRGB[0]
-            greenVal = pixelRGB[1]
-            blueVal = pixelRGB[2]
-            if greenVal > 240 and blueVal > 240:
-                #This pixel would be white if red channel set to 255
-                #so set the green and blue channels to 240
-                greenVal = blueVal = 240
-            value = qRgb(255, greenVal, blueVal)
-            self.qImage.setPixel(x, y, value)
-            #convert QImage to QPixmap to be able to update image
-            #with filled ROI
-            self.pixMap = QPixmap.fromImage(self.qImage)
-            #repaint image
-            self.update()
+            colourPixelsRed(self.imgData, (slice(x, x + 1), slice(y, y + 1)))
+            self.updatePixMap()
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.setPixelToRed: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.setPixelToRed: ' + str(e))
@@ -565,16 +520,15 @@ class GraphicsItem(QGraphicsObject):
         """
         Redisplays the ROI represented by mask on the image.
 
-        This function makes a list of the coordinates of the elements
-        in the input argument mask that have the value True and therefore correspond
-        to the RIO. Then the pixels in the image, within the RIO, have 
-        their Red channel set to 255, to make them appear red. 
+        The pixels in the image corresponding to the elements
+        in the input argument mask that have the value True, and therefore 
+        to the RIO, have their Red channel set to 255, to make them appear red. 
         """
         logger.info("FreeHandROI.GraphicsItem.reloadMask called")
         try:
-            self.listROICoords = self.getListRoiInnerPoints(mask)
-            self.fillFreeHandRoi()
-            self.listROICoords = []
+            if mask is not None:
+                colourPixelsRed(self.imgData, np.nonzero(np.transpose(mask)))
+                self.updatePixMap()
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.reloadMask: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.reloadMask: ' + str(e))
@@ -587,13 +541,8 @@ class GraphicsItem(QGraphicsObject):
         """
         logger.info("FreeHandROI.GraphicsItem.fillFreeHandRoi called")
         try:
-            #self.listROICoords is a list of the coordinates of the pixels
-            #within the RIO
-            if self.listROICoords is not None:
-                for coords in self.listROICoords:
-                    x = coords[0]
-                    y = coords[1]
-                    self.setPixelToRed(x, y)
+            #self.mask is True for the pixels within the RIO
+            self.reloadMask(self.mask)
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.fillFreeHandRoi: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.fillFreeHandRoi: ' + str(e))
@@ -609,27 +558,51 @@ class GraphicsItem(QGraphicsObject):
         """
         logger.info("FreeHandROI.GraphicsItem.addROItoImage called")
         try:
-            listROICoords = self.getListRoiInnerPoints(roi)
-            if listROICoords is not None:
-                for coords in listROICoords:
-                    x = coords[0]
-                    y = coords[1]
-                    pixelColour = self.qImage.pixel(x, y) 
-                    pixelRGB =  QColor(pixelColour).getRgb()
-                    redVal = pixelRGB[0]
-                    greenVal = pixelRGB[1]
-                    blueVal = pixelRGB[2]
-                    if greenVal > 240 and blueVal > 240:
-                        #This pixel would be white if red channel set to 255
-                        #so set the green and blue channels to 240
-                        greenVal = blueVal = 240
-                    value = qRgb(255, greenVal, blueVal)
-                    self.qImage.setPixel(x, y, value)
+            if roi is not None:
+                colourPixelsRed(self.imgData, np.nonzero(np.transpose(roi)))
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.addROItoImage: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.addROItoImage: ' + str(e))
 
 
+    def updatePixMap(self):
+        """
+        Converts the ARGB array of the displayed image, self.imgData, into 
+        the QPixmap painted in this GraphicsItem object and repaints the image.
+
+        This is the only conversion to a QPixmap, so a brush stroke or 
+        the filling of a RIO is displayed with a single conversion, 
+        however many pixels it changes.
+        """
+        logger.info("FreeHandROI.GraphicsItem.updatePixMap called")
+        try:
+            self.qImage = makeQImage(self.imgData, self.alpha)
+            self.pixMap = QPixmap.fromImage(self.qImage)
+            self.update()
+        except Exception as e:
+            print('Error in FreeHandROI.GraphicsItem.updatePixMap: ' + str(e))
+            logger.error('Error in FreeHandROI.GraphicsItem.updatePixMap: ' + str(e))
+
+
+    def getBrushSquare(self):
+        """
+        Returns a tuple of slices (columns, rows) selecting the square of pixels 
+        under the brush or eraser, whose size is set by pixelSquareSize,  
+        centred on the mouse pointer and clipped to the image.
+        The slices are empty when the square is outside the image,
+        which happens while the mouse is dragged off the image.
+        """
+        numberOfColumns, numberOfRows = np.shape(self.pixelArray)[:2]
+        increment = (self.linkToGraphicsView.pixelSquareSize - 1)/2
+        lowX = max(int(self.xMouseCoord - increment), 0)
+        highX = min(int(self.xMouseCoord + increment), numberOfColumns - 1)
+        lowY = max(int(self.yMouseCoord - increment), 0)
+        highY = min(int(self.yMouseCoord + increment), numberOfRows - 1)
+        if highX < lowX or highY < lowY:
+            return slice(0, 0), slice(0, 0)
+        return slice(lowX, highX + 1), slice(lowY, highY + 1)
+
+
     def getMaskData(self):
         """
         This function returns the mask (boolean array) associated with 
@@ -639,29 +612,6 @@ class GraphicsItem(QGraphicsObject):
         return self.mask
 
 
-    def getListRoiInnerPoints(self, mask):
-        """
-        This function returns a list of the coordinates 
-        of the elements in the mask whose values are True. 
-       
-        Input argument
-        ***************
-        mask - a boolean array the same size as the image. 
-            Elements in the mask whose value is True correspond  
-            to the pixels in the ROI drawn on the image.
-        """
-        logger.info("FreeHandROI.GraphicsItem.getListRoiInnerPoints called")
-        try:
-            if mask is not None:
-                roi = np.where(mask == True)
-                return list(zip(roi[1], roi[0]))
-            else:
-                return None
-        except Exception as e:
-            print('Error in FreeHandROI.GraphicsItem.getListRoiInnerPoints: ' + str(e))
-            logger.error('Error in FreeHandROI.GraphicsItem.getListRoiInnerPoints: ' + str(e))
-
-
     def createBlankMask(self):
         """
         Creates a boolean array with the same shape as the image's
@@ -688,21 +638,12 @@ class GraphicsItem(QGraphicsObject):
         logger.info("FreeHandROI.GraphicsItem.createMaskFromDrawnROI called")
         try:
             self.mask = None
-            #1. Create a list called points
-            # of x,y coordinates for each element 
-            #in self.pixelArray, the pixel array of the DICOM image
             nx, ny = np.shape(self.pixelArray)
-            x, y = np.meshgrid(np.arange(nx), np.arange(ny))
-            points = list(zip(x.flatten(),y.flatten()))
-
-            #2. Convert the ROI boundary coordinates into a path object
-            roiPath = MplPath(roiBoundaryCoords, closed=True)
-
-            #3.Create a boolean array representing the original pixel array
+            #Create a boolean array representing the original pixel array
             #with all elements set to False except those falling within the
-            #ROI that are set to True.  
-            #Setting radius=0.0 does not include the drawn boundary in the ROI
-            self.mask = roiPath.contains_points(points, radius=0.0).reshape((ny, nx))   
+            #ROI that are set to True. Only the bounding box of the ROI is scanned. 
+            #Pixels on the drawn boundary are added by addROIBoundaryToMask
+            self.mask = polygonToMask(roiBoundaryCoords, (ny, nx))
         except Exception as e:
             print('Error in FreeHandROI.GraphicsItem.createMaskFromDrawnROI: ' + str(e))
             logger.error('Error in FreeHandROI.GraphicsItem.createMaskFromDrawnROI: ' + str(e))
@@ -3,6 +3,7 @@ A library of helper functions used by the class GraphicsItem to render
 a pixel array in a PyQt5 QGraphicsObject widget.
 """
 
+import os
 import numpy as np
 from PyQt5 import QtGui
 import ctypes
@@ -11,6 +12,15 @@ import DICOM.ReadDICOM_Image as ReadDICOM_Image
 import logging
 logger = logging.getLogger(__name__)
 
+#Maximum number of pixels used to estimate the levels of an image
+#that does not have a window centre and width in its header
+LEVELS_SAMPLE_SIZE = 65536
+
+#Levels estimated from the pixel values, cached per series so that they 
+#are not estimated again every time the image slider moves.
+#{SeriesInstanceUID: (levels, path of the image they were estimated from, its modification time)}
+seriesLevelsCache = {}
+
 
 def applyLookupTable(data, lut):
     """
@@ -290,6 +300,70 @@ def makeQImage(imgData, alpha=None, copy=True, transpose=True):
     return img
 
 
+def colourPixelsRed(imgData, pixels):
+    """
+    Sets the red channel of the pixels of the ARGB array imgData (as returned
+    by makeARGB) selected by pixels to 255, so that they appear red. 
+    The array is modified in place, all the pixels in one numpy operation.
+
+    pixels is a tuple (x, y) of index arrays or of slices into the first 
+    two axes of imgData. Pixels that would be white once 
+    their red channel is set to 255 have their green and blue channels set to 240.
+    """
+    roiPixels = imgData[pixels]
+    whitePixels = (roiPixels[..., 1] > 240) & (roiPixels[..., 0] > 240)
+    roiPixels[whitePixels, :2] = 240
+    roiPixels[..., 2] = 255
+    #index arrays return a copy rather than a view, so write it back
+    imgData[pixels] = roiPixels
+
+
+def polygonToMask(vertices, shape):
+    """
+    Rasterizes a polygon with a scanline fill. Returns a boolean array with
+    the given shape (rows, columns) that is True for the pixels (x, y) inside 
+    the closed polygon with the given list of (x, y) vertices.
+
+    Pixels are tested with the same even-odd crossing rule, including the 
+    treatment of pixels on the boundary, as matplotlib's 
+    Path.contains_points(radius=0.0). Only the rows & columns in the bounding
+    box of the polygon are scanned, and the edge crossings of all the rows 
+    are computed in one numpy operation.
+    """
+    rows, columns = shape
+    mask = np.zeros((rows, columns), dtype=bool)
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if len(vertices) < 3:
+        return mask
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    #the edges run from each vertex to the next, closing the polygon
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    lowX, highX = max(int(np.ceil(x0.min())), 0), min(int(np.floor(x0.max())), columns - 1)
+    lowY, highY = max(int(np.ceil(y0.min())), 0), min(int(np.floor(y0.max())), rows - 1)
+    if lowX > highX or lowY > highY:
+        return mask
+
+    #An edge crosses the scanline y when one end is below it and the other on or above it
+    scanlines = np.arange(lowY, highY + 1)
+    crossings = ((np.minimum(y0, y1) < scanlines[:, np.newaxis]) 
+                    & (scanlines[:, np.newaxis] <= np.maximum(y0, y1)))
+    scanlineIndex, edge = np.nonzero(crossings)
+    y = scanlines[scanlineIndex]
+    x0, y0, x1, y1 = x0[edge], y0[edge], x1[edge], y1[edge]
+    xCrossing = x1 - (y1 - y) * (x0 - x1) / (y0 - y1)
+    #Pixels to the left of the crossing, or on it if the edge goes upwards,
+    #see the edge on their right. numberOfPixels counts them in the bounding box.
+    numberOfPixels = np.where(y1 >= y, np.floor(xCrossing) + 1, np.ceil(xCrossing)) - lowX
+    numberOfPixels = np.clip(numberOfPixels, 0, highX - lowX + 1).astype(np.intp)
+
+    #A pixel is inside when an odd number of edges are on its right
+    crossingsCount = np.zeros((len(scanlines), highX - lowX + 2), dtype=np.int32)
+    np.add.at(crossingsCount, (scanlineIndex, numberOfPixels), 1)
+    edgesOnTheRight = np.cumsum(crossingsCount[:, :0:-1], axis=1)[:, ::-1]
+    mask[lowY:highY + 1, lowX:highX + 1] = (edgesOnTheRight % 2 == 1)
+    return mask
+
+
 def readLevels(path, pixelArray): 
         """Reads levels directly from the DICOM image.
         
@@ -305,42 +379,85 @@ def readLevels(path, pixelArray):
         """
         try:
             logger.info("HelperFunctions.readLevels called")
-            #set default values
-            centre = -1 
-            width = -1 
-            maximumValue = -1  
-            minimumValue = -1 
-            dataset = ReadDICOM_Image.getDicomDataset(path)
-            if dataset and hasattr(dataset, 'WindowCenter') and hasattr(dataset, 'WindowWidth'):
-                slope = float(getattr(dataset, 'RescaleSlope', 1))
-                intercept = float(getattr(dataset, 'RescaleIntercept', 0))
-                centre = dataset.WindowCenter # * slope + intercept
-                width = dataset.WindowWidth # * slope
-                if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
-                    centre = centre / dataset[(0x2005, 0x100E)].value
-                    width = width / dataset[(0x2005, 0x100E)].value
-                maximumValue = centre + width/2
-                minimumValue = centre - width/2
-            elif dataset and hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
-                # In Enhanced MRIs, this display will retrieve the centre and width values of the first slice
-                slope = dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0].RescaleSlope
-                intercept = dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0].RescaleIntercept
-                centre = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowCenter # * slope + intercept
-                width = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowWidth # * slope
-                if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
-                    centre = centre / dataset[(0x2005, 0x100E)].value
-                    width = width / dataset[(0x2005, 0x100E)].value
-                maximumValue = centre + width/2
-                minimumValue = centre - width/2 
-            else:
-                minimumValue = np.amin(pixelArray) if (np.median(pixelArray) - iqr(pixelArray, rng=(
-                1, 99))/2) < np.amin(pixelArray) else np.median(pixelArray) - iqr(pixelArray, rng=(1, 99))/2
-                maximumValue = np.amax(pixelArray) if (np.median(pixelArray) + iqr(pixelArray, rng=(
-                1, 99))/2) > np.amax(pixelArray) else np.median(pixelArray) + iqr(pixelArray, rng=(1, 99))/2
-                centre = minimumValue + (abs(maximumValue) - abs(minimumValue))/2
-                width = maximumValue - abs(minimumValue)
-
+            dataset = ReadDICOM_Image.getDicomHeader(path)
+            _, _, maximumValue, minimumValue = readLevelsFromDICOMImage(dataset, pixelArray, path)
             return minimumValue, maximumValue
         except Exception as e:
             print('Error in HelperFunctions.readLevels: ' + str(e))
-            logger.error('Error in HelperFunctions.readLevels: ' + str(e))
\ No newline at end of file
+            logger.error('Error in HelperFunctions.readLevels: ' + str(e))
+
+
+def readLevelsFromDICOMImage(dataset, pixelArray, path=None):
+    """Reads levels from the header of a DICOM image. If the header
+    does not have them, they are estimated from its pixel array and,
+    if path is given, cached for the whole series.
+
+    Input arguments
+    ***************
+    dataset - DICOM header of the image
+    pixelArray - pixel array representing the image
+    path - optional file path of the image
+
+    Returns
+    *****************
+    centre - Image intensity
+    width - Image contrast
+    maximumValue - Maximum pixel value in the image
+    minimumValue - Minimum pixel value in the image
+    """
+    try:
+        logger.info("HelperFunctions.readLevelsFromDICOMImage called")
+        if dataset and hasattr(dataset, 'WindowCenter') and hasattr(dataset, 'WindowWidth'):
+            centre = dataset.WindowCenter # * slope + intercept
+            width = dataset.WindowWidth # * slope
+        elif dataset and hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
+            # In Enhanced MRIs, this display will retrieve the centre and width values of the first slice
+            centre = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowCenter # * slope + intercept
+            width = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowWidth # * slope
+        else:
+            seriesUID = getattr(dataset, 'SeriesInstanceUID', None)
+            if path is None or seriesUID is None:
+                return estimateLevels(pixelArray)
+            cachedLevels = seriesLevelsCache.get(seriesUID)
+            # The levels are estimated again if the image they came from was overwritten
+            if (cachedLevels is not None and os.path.exists(cachedLevels[1]) 
+                and os.stat(cachedLevels[1]).st_mtime_ns == cachedLevels[2]):
+                return cachedLevels[0]
+            levels = estimateLevels(pixelArray)
+            seriesLevelsCache[seriesUID] = (levels, path, os.stat(path).st_mtime_ns)
+            return levels
+
+        if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
+            centre = centre / dataset[(0x2005, 0x100E)].value
+            width = width / dataset[(0x2005, 0x100E)].value
+        maximumValue = centre + width/2
+        minimumValue = centre - width/2
+        return centre, width, maximumValue, minimumValue
+    except Exception as e:
+        print('Error in HelperFunctions.readLevelsFromDICOMImage: ' + str(e))
+        logger.error('Error in HelperFunctions.readLevelsFromDICOMImage: ' + str(e))
+
+
+def estimateLevels(pixelArray):
+    """Estimates the levels of an image from its median and the range
+    between its 1st and 99th percentiles, clipped to its minimum and 
+    maximum values. The percentiles are computed on a regular subsample
+    of at most LEVELS_SAMPLE_SIZE pixels instead of sorting the whole image.
+
+    Returns
+    *****************
+    centre - Image intensity
+    width - Image contrast
+    maximumValue - Maximum pixel value in the image
+    minimumValue - Minimum pixel value in the image
+    """
+    #order='K' avoids a copy of the transposed arrays returned by ReadDICOM_Image
+    pixelValues = np.ravel(pixelArray, order='K')
+    step = max(1, pixelValues.size // LEVELS_SAMPLE_SIZE)
+    lowerValue, medianValue, upperValue = np.percentile(pixelValues[::step], [1, 50, 99])
+    halfRange = (upperValue - lowerValue)/2
+    minimumValue = max(np.amin(pixelValues), medianValue - halfRange)
+    maximumValue = min(np.amax(pixelValues), medianValue + halfRange)
+    centre = minimumValue + (abs(maximumValue) - abs(minimumValue))/2
+    width = maximumValue - abs(minimumValue)
+    return centre, width, maximumValue, minimumValue
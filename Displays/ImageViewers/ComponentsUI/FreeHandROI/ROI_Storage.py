@@ -6,6 +6,51 @@ __version__ = '1.0'
 __author__ = 'Steve Shillitoe'
 #October/November 2020
 
+
+class CroppedMask():
+    """
+    Compact form of a mask that is not blank. Only the smallest rectangle
+    of the mask containing all its True values, its bounding box, is stored 
+    together with the shape and the position of this rectangle in the full mask.
+    """
+    def __init__(self, mask):
+        """Crops the boolean array mask, which must contain at least one True value"""
+        self.shape = np.shape(mask)
+        rows = np.flatnonzero(mask.any(axis=1))
+        columns = np.flatnonzero(mask.any(axis=0))
+        self.top, self.left = rows[0], columns[0]
+        self.box = mask[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1].copy()
+
+
+    def __repr__(self):
+        """Represents this class's objects as a string"""
+        return '{}(shape={}, box={} at ({}, {}))'.format(
+           self.__class__.__name__, self.shape, self.box.shape, self.top, self.left)
+
+
+    def toArray(self):
+        """Returns the full size boolean mask"""
+        mask = np.full(self.shape, False, dtype=bool)
+        rows, columns = self.box.shape
+        mask[self.top:self.top + rows, self.left:self.left + columns] = self.box
+        return mask
+
+
+    def numberOfPixels(self):
+        """Returns the number of True values in the mask"""
+        return int(np.count_nonzero(self.box))
+
+
+def compressMask(mask):
+    """
+    Returns None if mask is None or blank, otherwise mask cropped
+    to its bounding box as a CroppedMask object.
+    """
+    if mask is None or not np.any(mask):
+        return None
+    return CroppedMask(np.asarray(mask, dtype=bool))
+
+
 class ROIs():
     """
     This class provides a data structure and associated input and 
@@ -25,7 +70,10 @@ class ROIs():
 
     Mask data is stored in a Python dictionary, where the key is the 
     ROI's name and the value a list of masks, one mask for each image
-    in the DICOM series. Initially all the masks in this list are blank.
+    in the DICOM series. To save memory on large series, a blank mask 
+    is stored as None and any other mask as a CroppedMask object holding 
+    only its bounding box. Initially all the masks in this list are blank.
+    getMask returns the full size boolean array.
    """
     def __init__(self, numberOfImages, linkToGraphicsView):
         """Instantiates an ROIs object
@@ -39,6 +87,7 @@ class ROIs():
         self.regionNumber = 1
         self.prevRegionName = "region1"
         self.NumOfImages = numberOfImages
+        self.maskShape = None
         self.linkToGraphicsView = linkToGraphicsView
         logger.info("ROI_Storage object created")
 
@@ -64,19 +113,19 @@ class ROIs():
             if self.linkToGraphicsView.currentROIName in self.dictMasks:
                 imageMaskList = self.dictMasks[self.linkToGraphicsView.currentROIName]
                 if imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] is None:
-                    #empty list
-                    imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = mask
+                    #blank mask
+                    imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = compressMask(mask)
                 else:
                     #already contains a mask, so add to an existing ROI 
                     #using boolean OR (|) to get the union 
-                    imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] | mask
+                    existingMask = imageMaskList[self.linkToGraphicsView.currentImageNumber - 1].toArray()
+                    imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = compressMask(existingMask | mask)
                 self.dictMasks[self.linkToGraphicsView.currentROIName] = imageMaskList
             else:
                 #a new ROI
-                #Make a copy of the list of image mask lists
                 imageMaskList = self.createListOfBlankMasks(mask)
                 #Add the current mask to the correct list in the list of lists
-                imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = mask
+                imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] = compressMask(mask)
                 self.dictMasks[self.linkToGraphicsView.currentROIName] = imageMaskList
         except Exception as e:
             print('Error in ROI_Storage.addMask: ' + str(e))
@@ -94,7 +143,7 @@ class ROIs():
         try:
             if self.linkToGraphicsView.currentROIName in self.dictMasks:
                 imageMaskList = self.dictMasks[self.linkToGraphicsView.currentROIName]
-                imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] =  newMask 
+                imageMaskList[self.linkToGraphicsView.currentImageNumber - 1] =  compressMask(newMask) 
                 self.dictMasks[self.linkToGraphicsView.currentROIName] = imageMaskList
         except Exception as e:
             print('Error in ROI_Storage.replaceMask: ' + str(e))
@@ -105,16 +154,14 @@ class ROIs():
         """
         Creates a list of blank masks. 
         
-        Each mask is a boolean array with all
-        elements set to False. It is the same size as
-        the DICOM images in the series. There is one mask for
-        each image in the series.
+        A blank mask is stored as None rather than as a boolean array 
+        with all elements set to False, so no memory is allocated for
+        images without the ROI. There is one mask for each image in the series.
         """
         try:
             logger.info("ROI_Storage.createListOfBlankMasks called")
-            ny, nx = np.shape(mask)
-            blankMask = np.full((ny, nx), False, dtype=bool)
-            return [blankMask for _ in range(self.NumOfImages)]
+            self.maskShape = np.shape(mask)
+            return [None for _ in range(self.NumOfImages)]
         except Exception as e:
             print('Error in ROI_Storage.createListOfBlankMasks: ' + str(e))
 
@@ -168,14 +215,7 @@ class ROIs():
         try:
             regionName = self.linkToGraphicsView.currentROIName
             imageNumber = self.linkToGraphicsView.currentImageNumber
-            if regionName in self.dictMasks: 
-                mask = self.dictMasks[regionName][imageNumber - 1]
-                if mask.any():
-                    return mask
-                else:
-                    return None
-            else:
-                return None
+            return self.getMask(regionName, imageNumber)
         except Exception as e:
             print('Error in ROI_Storage.getUpdatedMask when imageNumber={}: '.format(imageNumber) + str(e))
             logger.exception('Error in ROI_Storage.getUpdatedMask when imageNumber={}: '.format(imageNumber) + str(e))
@@ -194,14 +234,15 @@ class ROIs():
 
         Returns
         *******
-        True or False
+        The boolean mask, decompressed to the full image size, 
+        or None if the ROI is not on this image.
         """
         logger.info("ROI_Storage.getMask called")
         try:
             if regionName in self.dictMasks: 
                 mask = self.dictMasks[regionName][imageNumber - 1]
-                if mask.any():
-                    return mask
+                if mask is not None:
+                    return mask.toArray()
                 else:
                     return None
             else:
@@ -211,6 +252,22 @@ class ROIs():
             logger.exception('Error in ROI_Storage.getMask when imageNumber={}: '.format(imageNumber) + str(e))
 
 
+    def getMaskList(self, regionName):
+        """
+        Returns a generator of the full size boolean masks of the ROI
+        regionName, one for each image in the series, including the blank masks.
+        Each mask is only decompressed when the generator reaches it.
+        """
+        logger.info("ROI_Storage.getMaskList called")
+        try:
+            maskList = self.dictMasks[regionName]
+            return (mask.toArray() if mask is not None else np.full(self.maskShape, False, dtype=bool)
+                        for mask in maskList)
+        except Exception as e:
+            print('Error in ROI_Storage.getMaskList: ' + str(e))
+            logger.exception('Error in ROI_Storage.getMaskList: ' + str(e))
+
+
     def hasRegionGotMask(self, regionName):
         """
         This function returns True if a ROI has masks stored in the 
@@ -251,11 +308,7 @@ class ROIs():
         logger.info("ROI_Storage.hasImageGotMask called")
         try:
             if regionName in self.dictMasks: 
-                mask = self.dictMasks[regionName][imageNumber - 1]
-                if mask.any():
-                    return True
-                else:
-                    return False
+                return self.dictMasks[regionName][imageNumber - 1] is not None
             else:
                 return False
         except Exception as e:
@@ -273,10 +326,7 @@ class ROIs():
             listImagesWithMasks = []
             if regionName in self.dictMasks: 
                 maskList = self.dictMasks[regionName]
-                for i in range(self.NumOfImages):
-                   mask = self.dictMasks[regionName][i]
-                   if mask.any():
-                        listImagesWithMasks.append(i)
+                listImagesWithMasks = [i for i, mask in enumerate(maskList) if mask is not None]
            
             return listImagesWithMasks
 
@@ -342,9 +392,9 @@ class ROIs():
         print("Contents of self.dictMasks")
         for key, value in self.dictMasks.items():
             numMasks = 0
+            numTrueValues = 0
             for item in value:
-                if item.any():
+                if item is not None:
                     numMasks +=1
-                    result = np.where(item == True)
-                    numTrueValues = list(zip(result[1], result[0]))
+                    numTrueValues += item.numberOfPixels()
             print(key, ' : ', numMasks, ' Number True Coords: {}'.format(numTrueValues))
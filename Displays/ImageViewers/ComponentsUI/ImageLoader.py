@@ -0,0 +1,73 @@
+from PyQt5.QtCore import  pyqtSignal, QObject, QRunnable
+import DICOM.ReadDICOM_Image as ReadDICOM_Image
+from Displays.ImageViewers.ComponentsUI.FreeHandROI.HelperFunctions import readLevelsFromDICOMImage
+import logging
+logger = logging.getLogger(__name__)
+
+__author__ = "Steve Shillitoe"
+#September 2021
+
+
+class ImageLoaderSignals(QObject):
+    """
+    Signals emitted by an ImageLoader. A QRunnable is not a QObject,
+    so it cannot define signals itself.
+
+    imageLoaded passes the request number, the image file path and a
+    dictionary with the pixel array, colour table, look up table and
+    levels of the image.
+    """
+    imageLoaded = pyqtSignal(int, str, object)
+
+
+class ImageLoader(QRunnable):
+    """
+    Reads and decodes a DICOM image and computes its levels on a
+    worker thread of a QThreadPool, so that the GUI thread is not blocked
+    while large or compressed images load. The results are delivered
+    to the GUI thread by the imageLoaded signal.
+    """
+    def __init__(self, requestNumber, imagePath, isCurrentRequest=None):
+        """
+        Input arguments
+        ***************
+        requestNumber - number that identifies this request, emitted with the results
+        imagePath - file path of the DICOM image
+        isCurrentRequest - optional function of the request number that returns False
+                once the request is outdated, in which case the image is not read
+        """
+        super().__init__()
+        self.requestNumber = requestNumber
+        self.imagePath = imagePath
+        self.isCurrentRequest = isCurrentRequest
+        self.signals = ImageLoaderSignals()
+
+
+    def run(self):
+        try:
+            if self.isCurrentRequest is not None and not self.isCurrentRequest(self.requestNumber):
+                return
+            image = loadImage(self.imagePath)
+            self.signals.imageLoaded.emit(self.requestNumber, self.imagePath, image)
+        except Exception as e:
+            print('Error in ImageLoader.run: ' + str(e))
+            logger.exception('Error in ImageLoader.run: ' + str(e))
+
+
+def loadImage(imagePath):
+    """
+    Returns a dictionary with the pixel array, the colour table and
+    look up table and the levels (centre, width, maximum, minimum)
+    saved in the DICOM image in imagePath. The pixel array is None
+    if the image is missing.
+    """
+    pixelArray = ReadDICOM_Image.getCachedPixelArray(imagePath)
+    image = {'pixelArray': pixelArray, 'colourTable': None, 'lut': None, 'levels': None}
+    if pixelArray is not None:
+        colourmap = ReadDICOM_Image.getColourmap(imagePath)
+        if colourmap is not None:
+            image['colourTable'], image['lut'] = colourmap
+        dataset = ReadDICOM_Image.getDicomHeader(imagePath)
+        image['levels'] = readLevelsFromDICOMImage(dataset, pixelArray, imagePath)
+    return image
+
@@ -12,9 +12,11 @@ from PyQt5.QtWidgets import (QMessageBox,
                             QListView,
                             QCheckBox)
 import numpy as np
-import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
+import DICOM.MetadataIndex as MetadataIndex
 from DICOM.Classes import Series
 from Displays.ImageViewers.ComponentsUI.FreeHandROI.Resources import *
 from External.Tools.PandasDICOM import DICOM_to_DataFrame
@@ -29,6 +31,10 @@ listImageTypes = ["SliceLocation", "AcquisitionTime", "AcquisitionNumber",
                   "FlipAngle", "InversionTime", "EchoTime", "DiffusionBValue", 
                   "DiffusionGradientOrientation", (0x2005, 0x1572)] # This last element is a good example of private tag
 
+#Number of slices decoded in the background ahead of (and behind) 
+#the image displayed when the main slider is moved
+PREFETCH_SLICES = 4
+
 class SortedImageSlider(QSlider):
     """Subclass of the QSlider class with the added property attribute,
     DicomAttribute, which identifies what the image subset has been filtered for. 
@@ -67,6 +73,155 @@ class SortedImageCheckBox(QCheckBox):
         return self.colNumber
 
 
+class SlicePrefetcher:
+    """Decodes the neighbours of the displayed image on a worker thread, 
+    so that the image viewer finds them in the slice cache of 
+    ReadDICOM_Image when the user scrolls through the series."""
+    def __init__(self, numberSlices=PREFETCH_SLICES):
+        self.numberSlices = numberSlices
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pendingRequests = []
+        self.previousIndex = None
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.isShutDown = False
+
+
+    def prefetch(self, imagePathList, currentIndex):
+        """
+        Cancels the requests that have not started yet, which are stale
+        after the slider moved, and schedules the decoding of the next and
+        previous numberSlices images, nearest first. At each distance, the 
+        image in the direction of travel of the slider is decoded first.
+
+        Input arguments
+        ***************
+        imagePathList - list of the file paths of the images in the series
+        currentIndex - index in imagePathList of the image displayed
+        """
+        try:
+            if self.previousIndex is not None and currentIndex < self.previousIndex:
+                direction = -1
+            else:
+                direction = 1
+            self.previousIndex = currentIndex
+            with self.lock:
+                if self.isShutDown:
+                    return
+                self.generation += 1
+                generation = self.generation
+                for request in self.pendingRequests:
+                    request.cancel()
+                self.pendingRequests = []
+                for step in range(1, self.numberSlices + 1):
+                    for index in (currentIndex + direction*step, currentIndex - direction*step):
+                        if 0 <= index < len(imagePathList):
+                            self.pendingRequests.append(self.executor.submit(
+                                self.__decodeSlice, imagePathList[index], generation))
+        except Exception as e:
+            print('Error in SlicePrefetcher.prefetch: ' + str(e))
+            logger.error('Error in SlicePrefetcher.prefetch: ' + str(e))
+
+
+    def cancel(self):
+        """Cancels all the requests that have not started yet"""
+        with self.lock:
+            self.generation += 1
+            for request in self.pendingRequests:
+                request.cancel()
+            self.pendingRequests = []
+
+
+    def shutdown(self):
+        """Cancels all the requests that have not started yet and stops
+        the worker thread, without waiting for the image being decoded.
+        Called when the image viewer closes."""
+        self.cancel()
+        with self.lock:
+            self.isShutDown = True
+        self.executor.shutdown(wait=False)
+
+
+    def __decodeSlice(self, imagePath, generation):
+        """Decodes the image in imagePath into the slice cache, unless
+        the slider moved again since this request was scheduled."""
+        if generation != self.generation:
+            return
+        ReadDICOM_Image.getCachedPixelArray(imagePath)
+
+
+class SliderGrid:
+    """N-dimensional lookup table of the images of a series for the sorted image sliders. 
+    
+    The grid has one axis per DICOM tag, whose positions are the sorted unique 
+    values of the tag, and holds the index in the series of the image with that 
+    combination of tag values, or -1 where there is no such image. When some 
+    combinations of tag values have more than one image, or some are missing, 
+    there is one more axis, Instance, along which the images with the same tag 
+    values are in the order of the rows of the DICOM table.
+    
+    The grid is built once, so moving a slider is an array lookup instead 
+    of filtering the DICOM table."""
+    def __init__(self, dicomTable, tagsList, imagePathList):
+        """
+        Input arguments
+        ***************
+        dicomTable - DataFrame with one row per image, indexed by file path, 
+                and one column per DICOM tag
+        tagsList - list of the DICOM tags of the sorted image sliders
+        imagePathList - list of the file paths of the images in the series
+        """
+        self.axes = []
+        indices = []
+        for tag in tagsList:
+            values = sorted(dicomTable[tag].unique())
+            self.axes.append(values)
+            positions = {value: index for index, value in enumerate(values)}
+            indices.append(dicomTable[tag].map(positions).to_numpy(dtype=np.intp))
+        shape = tuple(len(values) for values in self.axes)
+        #Number the images that have the same tag values
+        combination = np.ravel_multi_index(indices, shape)
+        instances = pd.Series(combination).groupby(combination).cumcount().to_numpy(dtype=np.intp)
+        numberOfInstances = int(instances.max()) + 1
+        self.hasInstanceAxis = (np.prod(shape) != len(imagePathList)) or numberOfInstances > 1
+        if self.hasInstanceAxis:
+            shape += (numberOfInstances,)
+            indices.append(instances)
+        pathIndex = {path: index for index, path in enumerate(imagePathList)}
+        imageIndices = np.array([pathIndex[path] for path in dicomTable.index], dtype=np.intp)
+        self.grid = np.full(shape, -1, dtype=np.intp)
+        self.grid[tuple(indices)] = imageIndices
+        #position in the grid of each image in the series
+        self.coordinates = np.full((len(imagePathList), len(shape)), -1, dtype=np.intp)
+        self.coordinates[imageIndices] = np.stack(indices, axis=1)
+
+    @property
+    def shape(self):
+        return self.grid.shape
+
+    def getImageIndex(self, position):
+        """
+        Returns the index in the series of the image at position, a tuple 
+        with one index per axis. Raises IndexError if there is no image there.
+        
+        If there is only one image with the tag values in position,
+        it is returned whatever the position on the Instance axis. 
+        """
+        if self.hasInstanceAxis:
+            instances = self.grid[tuple(position[:-1])]
+            instances = instances[instances >= 0]
+            imageIndex = instances[position[-1]] if len(instances) > 1 else instances[0]
+        else:
+            imageIndex = self.grid[tuple(position)]
+        if imageIndex < 0:
+            raise IndexError("There is no image at position {}".format(position))
+        return int(imageIndex)
+
+    def getPosition(self, imageIndex):
+        """Returns the position in the grid of the image with index imageIndex in the series"""
+        return self.coordinates[imageIndex]
+
+
 class ImageSliders(QObject):
     """Creates a custom, composite widget composed of one or more sliders for 
     navigating a DICOM series of images."""
@@ -94,10 +249,12 @@ class ImageSliders(QObject):
             self.shapeList = []
             self.multiSliderPositionList = []
             self.dicomTable = pd.DataFrame()
+            self.sliderGrid = None
             #A list of the sorted image sliders, 
             #updated as they are added and removed 
             #from the subwindow
             self.listSortedImageSliders = []
+            self.prefetcher = SlicePrefetcher()
 
             #Create the custom, composite sliders widget
             self.__setUpLayouts()
@@ -122,6 +279,16 @@ class ImageSliders(QObject):
         return self.mainImageSlider
 
 
+    def close(self):
+        """A public function that stops the prefetching of 
+        images when the subwindow displaying the sliders closes"""
+        try:
+            self.prefetcher.shutdown()
+        except Exception as e:
+            print('Error in ImageSliders.close: ' + str(e))
+            logger.error('Error in ImageSliders.close: ' + str(e))
+
+
     def displayFirstImage(self):
         """A public function that displays the first image 
         in Weasel"""
@@ -220,36 +387,22 @@ class ImageSliders(QObject):
                 self.imageNumberLabel.setText(imageNumberString)
                 self.selectedImagePath = self.imagePathList[currentImageNumber]
 
-                if len(self.listSortedImageSliders) > 0:
-                    self.multiSliderPositionList = []
-                    subTable = copy.copy(self.dicomTable)
-                    for index, tag in enumerate(self.dynamicListImageType):
-                        tagValue = subTable.loc[self.selectedImagePath, tag]
-                        listAttr = sorted(subTable[tag].unique())
-                        newIndex = listAttr.index(tagValue)
-                        self.multiSliderPositionList.append(newIndex)
-                        maxAttr = self.listSortedImageSliders[index][0].maximum()
-                        self.listSortedImageSliders[index][0].blockSignals(True)
-                        self.listSortedImageSliders[index][1].blockSignals(True)
-                        self.listSortedImageSliders[index][0].setValue(newIndex+1)
-                        self.listSortedImageSliders[index][1].setText("image {} of {}".format(newIndex+1, maxAttr))
-                        self.listSortedImageSliders[index][0].blockSignals(False)
-                        self.listSortedImageSliders[index][1].blockSignals(False)
-                        # subTable will be needed in the case of extra "nameless" slider
-                        subTable = subTable[subTable[tag] == tagValue]
-                    if len(self.listSortedImageSliders) > len(self.dynamicListImageType):
-                        newIndex = subTable.index.to_list().index(self.selectedImagePath)
-                        self.multiSliderPositionList.append(newIndex)
-                        maxAttr = self.listSortedImageSliders[index+1][0].maximum()
-                        self.listSortedImageSliders[index+1][0].blockSignals(True)
-                        self.listSortedImageSliders[index+1][1].blockSignals(True)
-                        self.listSortedImageSliders[index+1][0].setValue(newIndex+1)
-                        self.listSortedImageSliders[index+1][1].setText("image {} of {}".format(newIndex+1, maxAttr))
-                        self.listSortedImageSliders[index+1][0].blockSignals(False)
-                        self.listSortedImageSliders[index+1][1].blockSignals(False)
+                if len(self.listSortedImageSliders) > 0 and self.sliderGrid is not None:
+                    #Look up the position of this image on each sorted image slider
+                    self.multiSliderPositionList = self.sliderGrid.getPosition(currentImageNumber).tolist()
+                    for sliderImagePair, newIndex in zip(self.listSortedImageSliders, self.multiSliderPositionList):
+                        maxAttr = sliderImagePair[0].maximum()
+                        sliderImagePair[0].blockSignals(True)
+                        sliderImagePair[1].blockSignals(True)
+                        sliderImagePair[0].setValue(newIndex+1)
+                        sliderImagePair[1].setText("image {} of {}".format(newIndex+1, maxAttr))
+                        sliderImagePair[0].blockSignals(False)
+                        sliderImagePair[1].blockSignals(False)
 
                 #Send the file path of current image to the parent application
                 self.sliderMoved.emit(self.selectedImagePath)
+                #Decode the neighbouring images while the user looks at this one
+                self.prefetcher.prefetch(self.imagePathList, currentImageNumber)
         except TypeError as e: 
             print('Type Error in ImageSliders.__mainImageSliderMoved: ' + str(e))
             logger.error('Type Error in ImageSliders.__mainImageSliderMoved: ' + str(e))
@@ -274,6 +427,20 @@ class ImageSliders(QObject):
             logger.error('Error in ImageSliders.__addMultiSliderButtonToLayout: ' + str(e))
     
 
+    def __getDicomTable(self, tagsList):
+        """Returns a DataFrame with one row per image in the series and one column
+        per DICOM tag in tagsList. The values are taken from the metadata index of 
+        the DICOM folder when it's available, otherwise they are read from the files."""
+        try:
+            dicomTable = MetadataIndex.getTagTable(self.imagePathList, tagsList)
+            if dicomTable is None:
+                dicomTable = DICOM_to_DataFrame(self.imagePathList, tags=tagsList)
+            return dicomTable
+        except Exception as e:
+            print('Error in ImageSliders.__getDicomTable: ' + str(e))
+            logger.error('Error in ImageSliders.__getDicomTable: ' + str(e))
+
+
     ##Functions below support the display/hiding of the multi-sliders##   
     def __displayHideImageTypeCheckBoxes(self, state):
         """This function shows or hides a checkbox for each DICOM attribute
@@ -291,7 +458,7 @@ class ImageSliders(QObject):
                 self.btnMultiSliders.setStyleSheet("background-color: red")
                 self.__setUpImageTypeCheckBoxes()
                 tagsList = [self.checkboxList[i].dicomAttribute for i in range(len(self.checkboxList))]
-                self.dicomTable = DICOM_to_DataFrame(self.imagePathList, tags=tagsList)
+                self.dicomTable = self.__getDicomTable(tagsList)
             elif state == False:
                 logger.info("ImageSliders.__displayHideImageTypeCheckBoxes to hide image type checkboxes")
                 #reset the button to grey
@@ -303,6 +470,7 @@ class ImageSliders(QObject):
                 self.dynamicListImageType.clear()
                 self.listSortedImageSliders.clear()
                 self.shapeList = []    
+                self.sliderGrid = None
         except Exception as e:
             print('Error in ImageSliders.__displayHideImageTypeCheckBoxes: ' + str(e))
             logger.exception('Error in ImageSliders.__displayHideImageTypeCheckBoxes: ' + str(e))
@@ -336,7 +504,7 @@ class ImageSliders(QObject):
         in the DICOM files and presents them with checkboxes in the image viewer.
         """
         try:
-            self.dicomTable = DICOM_to_DataFrame(self.imagePathList, tags=listImageTypes) # Consider commenting if it takes too long
+            self.dicomTable = self.__getDicomTable(listImageTypes) # Consider commenting if it takes too long
             columnNumber = 0 
             self.checkboxList = []
             for index, imageType in enumerate(listImageTypes):
@@ -419,10 +587,14 @@ class ImageSliders(QObject):
    
             self.shapeList = []
             self.listSortedImageSliders = []
+            self.sliderGrid = None
+            if len(self.dynamicListImageType) > 0:
+                #The slider ranges are the lengths of the axes of the grid
+                self.sliderGrid = SliderGrid(self.dicomTable, self.dynamicListImageType, self.imagePathList)
            
-            for tag in self.dynamicListImageType:
+            for index, tag in enumerate(self.dynamicListImageType):
                 columnNumber = self.getCheckBoxColumnNumber(tag)
-                numAttr = len(self.dicomTable[tag].unique())
+                numAttr = self.sliderGrid.shape[index]
                 self.shapeList.append(numAttr)
                 imageSlider = SortedImageSlider(tag)
                 imageLabel = QLabel()
@@ -442,7 +614,7 @@ class ImageSliders(QObject):
                 
             
             # Create a new slider with empty label string if there is more than 1 image per combination of tags
-            if np.prod(self.shapeList) != len(self.imagePathList) and len(self.dynamicListImageType) > 0:
+            if self.sliderGrid is not None and self.sliderGrid.hasInstanceAxis:
                 imageSlider = SortedImageSlider('Instance')
                 instanceLabel = QLabel('Instance')
                 imageLabel = QLabel()
@@ -458,16 +630,10 @@ class ImageSliders(QObject):
                 self.sortedImageSliderLayout.addWidget(imageSlider, 1, 1, alignment=Qt.AlignLeft)
                 self.sortedImageSliderLayout.addWidget(imageLabel, 1, 2, alignment=Qt.AlignLeft)
                 
-                subTable = copy.copy(self.dicomTable)
-                # Filter first values of each slider
-                
-                for tag in self.dynamicListImageType:
-                    listAttr = sorted(self.dicomTable[tag].unique())
-                    subTable = subTable[subTable[tag] == listAttr[0]]
-                starting_point_lenght = len(subTable.index.to_list())
-                imageSlider.setMaximum(starting_point_lenght)
+                numInstances = self.sliderGrid.shape[-1]
+                imageSlider.setMaximum(numInstances)
                 imageSlider.valueChanged.connect(self.__multipleImageSliderMoved)
-                imageLabel.setText("image 1 of {}".format(starting_point_lenght))
+                imageLabel.setText("image 1 of {}".format(numInstances))
         except Exception as e:
             print('Error in ImageSliders.__updateSliders when tag={}: '.format(tag) + str(e))
             logger.exception('Error in ImageSliders.__updateSliders: ' + str(e))
@@ -482,31 +648,20 @@ class ImageSliders(QObject):
         multiple slider.  The slider is identified by the DicomAttribute parameter. 
         """
         try:
-            indexDict = {}
-            #Create a dictionary of DICOM attribute:slider index pairs
             self.multiSliderPositionList = []
             for sliderImagePair in self.listSortedImageSliders:
                 #update the text of the image x of y label
-                indexDict[sliderImagePair[0].attribute] = sliderImagePair[0].value()
                 currentImageNumberThisSlider = sliderImagePair[0].value()
                 maxNumberImagesThisSlider =  sliderImagePair[0].maximum()
                 labelText = "image {} of {}".format(currentImageNumberThisSlider, maxNumberImagesThisSlider)
                 sliderImagePair[1].setText(labelText)
                 self.multiSliderPositionList.append(currentImageNumberThisSlider-1)
-            subTable = copy.copy(self.dicomTable)
-            for index, tag in enumerate(self.dynamicListImageType):
-                position = self.multiSliderPositionList[index]
-                listAttr = sorted(self.dicomTable[tag].unique())
-                subTable = subTable[subTable[tag] == listAttr[position]]
-            if len(subTable.index.to_list()) > 1:
-                self.selectedImagePath = subTable.index.to_list()[self.multiSliderPositionList[-1]]
-            else:    
-                self.selectedImagePath = subTable.index.to_list()[0]
+            indexImageInMainList = self.sliderGrid.getImageIndex(self.multiSliderPositionList)
+            self.selectedImagePath = self.imagePathList[indexImageInMainList]
             self.sliderMoved.emit(self.selectedImagePath)
             
             #update the position of the main slider so that it points to the
             #same image as the sorted image sliders.
-            indexImageInMainList = self.imagePathList.index(self.selectedImagePath)
             self.mainImageSlider.setValue(indexImageInMainList+1)
         except IndexError:
             print("Warning - due to the DICOM attribute sliders you have selected, you may not be able to navigate the series of images.")
@@ -529,6 +684,8 @@ class ImageSliders(QObject):
         """
         try:
             self.imagePathList = newImagePathList
+            #The grid refers to the images of the old list, it's rebuilt by __updateSliders
+            self.sliderGrid = None
             #readjust the maximum value of the main image slider
             self.mainImageSlider.setMaximum(len(newImagePathList))
             #Display the image before the deleted image
@@ -541,7 +698,7 @@ class ImageSliders(QObject):
             #and calling setMaximum(len(image list)) for each slider
             if len(self.listSortedImageSliders) > 0:
                 tagsList = [self.checkboxList[i].dicomAttribute for i in range(len(self.checkboxList))]
-                self.dicomTable = DICOM_to_DataFrame(self.imagePathList, tags=tagsList)
+                self.dicomTable = self.__getDicomTable(tagsList)
                 self.__updateSliders()
         except Exception as e:
             print('Error in ImageSliders.imageDeleted: ' + str(e))
\ No newline at end of file
@@ -4,7 +4,7 @@
     It also has multiple sliders for browsing series of images."""
 
 from PyQt5 import QtCore 
-from PyQt5.QtCore import  Qt
+from PyQt5.QtCore import  Qt, QThreadPool
 from PyQt5.QtGui import QPixmap, QIcon,  QCursor
 from PyQt5.QtWidgets import (QFileDialog, QApplication,                           
                             QMessageBox, 
@@ -29,7 +29,6 @@ from matplotlib import cm
 import numpy as np
 import math
 import copy
-from scipy.stats import iqr
 import External.pyqtgraph as pg 
 import DICOM.ReadDICOM_Image as ReadDICOM_Image
 import DICOM.SaveDICOM_Image as SaveDICOM_Image
@@ -37,6 +36,8 @@ import DICOM.SaveDICOM_Image as SaveDICOM_Image
 
 from Displays.ImageViewers.DataStructures.UserImageColourSelection import UserSelection
 from Displays.ImageViewers.ComponentsUI.ImageSliders import ImageSliders as imageSliders
+from Displays.ImageViewers.ComponentsUI.ImageLoader import ImageLoader
+from Displays.ImageViewers.ComponentsUI.FreeHandROI.HelperFunctions import readLevelsFromDICOMImage
 from Displays.ImageViewers.ComponentsUI.PixelValueLabel import PixelValueComponent 
 from Displays.ImageViewers.ComponentsUI.ImageLevelsSpinBoxes import ImageLevelsSpinBoxes as imageLevelsSpinBoxes
 from Displays.ImageViewers.ComponentsUI.FreeHandROI.Resources import * 
@@ -104,6 +105,11 @@ class ImageViewer(QMdiSubWindow):
             self.cmbColours = QComboBox()  
             self.lut = ""
             self.weasel = weasel
+            #Images are read and decoded on worker threads. Only the result 
+            #of the latest display request is shown, older ones are dropped.
+            self.threadPool = QThreadPool()
+            self.threadPool.setMaxThreadCount(1)
+            self.displayRequestNumber = 0
 
             if dcm.__class__.__name__ == "Image":
                 self.isSeries = False
@@ -155,6 +161,20 @@ class ImageViewer(QMdiSubWindow):
             logger.error('Error in ImageViewer.__init__: ' + str(e))
 
 
+    def closeEvent(self, event):
+        """
+        Stops the prefetching of the images of the series 
+        by the sliders before the subwindow closes.
+        """
+        try:
+            if hasattr(self, 'slidersWidget'):
+                self.slidersWidget.close()
+        except Exception as e:
+            print('Error in ImageViewer.closeEvent: ' + str(e))
+            logger.error('Error in ImageViewer.closeEvent: ' + str(e))
+        super().closeEvent(event)
+
+
     def setUpMainLayout(self):
         """
         All the inner layouts and widgets are contained within one outer
@@ -715,7 +735,7 @@ class ImageViewer(QMdiSubWindow):
         self.spinBoxContrast.setValue(width)
 
 
-    def getColourTableForThisImage(self):
+    def getColourTableForThisImage(self, colourmap=None):
         """
         This function sets the class property, self.colourTable with the name of the
         colour table applied to the image or series being viewed.
@@ -726,6 +746,11 @@ class ImageViewer(QMdiSubWindow):
         Otherwise, the name of the colour table in the DICOM file is retrieved and
         self.colourTable is set to this value. Likewise the Look Up Table is retrieved
         and used to set the value of self.lut
+
+        Input argument
+        **************
+        colourmap - optional (colour table, look up table) tuple already read from the
+                DICOM file, by an ImageLoader for example
         """
         try:
             logger.info("ImageViewer.getColourTableForThisImage called")
@@ -736,17 +761,17 @@ class ImageViewer(QMdiSubWindow):
                     imageName = os.path.basename(self.selectedImagePath)
                     self.colourTable, _, _ = self.userSelection.returnUserSelection(imageName)  
                     if self.colourTable == 'default':
-                        self.colourTable, self.lut = ReadDICOM_Image.getColourmap(self.selectedImagePath)
+                        self.colourTable, self.lut = colourmap or ReadDICOM_Image.getColourmap(self.selectedImagePath)
                 else:  #no user selection, so get colour table saved to DICOM
-                    self.colourTable, self.lut = ReadDICOM_Image.getColourmap(self.selectedImagePath)
+                    self.colourTable, self.lut = colourmap or ReadDICOM_Image.getColourmap(self.selectedImagePath)
             elif self.isImage: 
-                self.colourTable, self.lut = ReadDICOM_Image.getColourmap(self.selectedImagePath)
+                self.colourTable, self.lut = colourmap or ReadDICOM_Image.getColourmap(self.selectedImagePath)
         except Exception as e:
                 print('Error in ImageViewer.getColourTableForThisImage: ' + str(e))
                 logger.error('Error in ImageViewer.getColourTableForThisImage: ' + str(e))
 
 
-    def getAndSetLevels(self):
+    def getAndSetLevels(self, dicomLevels=None):
         """
         This function gets the minimum and maximum values for the image being viewed 
         and uses them to calculate the image contrast and intensity.  
@@ -758,6 +783,11 @@ class ImageViewer(QMdiSubWindow):
         The image contrast & intensity values are used to set the values of the 
         corresponding spinboxes.
 
+        Input argument
+        **************
+        dicomLevels - optional (centre, width, maximum, minimum) tuple already read from
+                the DICOM file, by an ImageLoader for example
+
         Returns
         ********
         maximumValue  - maximum pixel value
@@ -770,7 +800,7 @@ class ImageViewer(QMdiSubWindow):
                 width = maximumValue - minimumValue
                 centre = minimumValue + (width/2)
             if not success or self.isImage:
-                centre, width, maximumValue, minimumValue = self.readLevelsFromDICOMImage()
+                centre, width, maximumValue, minimumValue = dicomLevels or self.readLevelsFromDICOMImage()
 
             self.levelsCompositeComponentLayout.blockLevelsSpinBoxSignals(True)
             self.spinBoxIntensity.setValue(centre)
@@ -804,19 +834,51 @@ class ImageViewer(QMdiSubWindow):
         """Displays an image's pixel array in a pyqtGraph imageView widget 
         & sets its colour table, contrast and intensity levels. 
         Also, sets the contrast and intensity in the associated histogram.
+
+        The image is read, decoded and its levels computed by an ImageLoader
+        on a worker thread, so that the GUI does not freeze while it loads.
+        It is displayed by displayLoadedImage when the worker finishes.
         """
         try:
             logger.info("ImageViewer.displayPixelArrayOfSingleImage called")
             self.selectedImagePath = imagePath
+            self.displayRequestNumber += 1
+            #Requests still waiting for the worker thread are outdated
+            self.threadPool.clear()
+            imageLoader = ImageLoader(self.displayRequestNumber, imagePath, 
+                                      lambda requestNumber: requestNumber == self.displayRequestNumber)
+            imageLoader.signals.imageLoaded.connect(self.displayLoadedImage)
+            self.threadPool.start(imageLoader)
+        except Exception as e:
+            print('Error in ImageViewer.displayPixelArrayOfSingleImage: ' + str(e))
+            logger.exception('Error in ImageViewer.displayPixelArrayOfSingleImage: ' + str(e))
+
+
+    def displayLoadedImage(self, requestNumber, imagePath, image):
+        """Displays the image read by an ImageLoader. The image is dropped
+        if the user has moved on to another image since it was requested.
+
+        Input arguments
+        ***************
+        requestNumber - number of the display request
+        imagePath - file path of the image
+        image - dictionary with the pixel array, colour table, look up table 
+                and levels of the image returned by ImageLoader.loadImage
+        """
+        try:
+            logger.info("ImageViewer.displayLoadedImage called")
+            if requestNumber != self.displayRequestNumber:
+                return
+            self.selectedImagePath = imagePath
             imageName = os.path.basename(self.selectedImagePath)
-            self.pixelArray = ReadDICOM_Image.returnPixelArray(self.selectedImagePath)
+            self.pixelArray = image['pixelArray']
 
             imageNumber = 1
                 
             self.lut = None
 
             #Get colour table of the image to be displayed
-            self.getColourTableForThisImage()
+            self.getColourTableForThisImage((image['colourTable'], image['lut']))
 
             #display above colour table in colour table dropdown list
             self.displayColourTableInComboBox()
@@ -832,7 +894,7 @@ class ImageViewer(QMdiSubWindow):
                 self.graphicsView.setImage(np.array([[0,0,0],[0,0,0]]))  
             else:
                 self.lblImageMissing.hide() 
-                maximumValue, minimumValue = self.getAndSetLevels()
+                maximumValue, minimumValue = self.getAndSetLevels(image['levels'])
                 
                 if len(np.shape(self.pixelArray)) < 3:
                         self.graphicsView.setImage(self.pixelArray, 
@@ -854,8 +916,8 @@ class ImageViewer(QMdiSubWindow):
                 self.graphicsView.getView().scene().sigMouseDragged.connect(
                         lambda ev: self.adjustLevelsByRightButtonDrag(ev))
         except Exception as e:
-            print('Error in ImageViewer.displayPixelArrayOfSingleImage: ' + str(e))
-            logger.exception('Error in ImageViewer.displayPixelArrayOfSingleImage: ' + str(e))
+            print('Error in ImageViewer.displayLoadedImage: ' + str(e))
+            logger.exception('Error in ImageViewer.displayLoadedImage: ' + str(e))
 
 
     def adjustLevelsByRightButtonDrag(self, ev):
@@ -1072,42 +1134,8 @@ class ImageViewer(QMdiSubWindow):
         """
         try:
             logger.info("ImageViewer.readLevelsFromDICOMImage called")
-            #set default values
-            centre = -1 
-            width = -1 
-            maximumValue = -1  
-            minimumValue = -1 
-            dataset = ReadDICOM_Image.getDicomDataset(self.selectedImagePath)
-            if dataset and hasattr(dataset, 'WindowCenter') and hasattr(dataset, 'WindowWidth'):
-                slope = float(getattr(dataset, 'RescaleSlope', 1))
-                intercept = float(getattr(dataset, 'RescaleIntercept', 0))
-                centre = dataset.WindowCenter # * slope + intercept
-                width = dataset.WindowWidth # * slope
-                if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
-                    centre = centre / dataset[(0x2005, 0x100E)].value
-                    width = width / dataset[(0x2005, 0x100E)].value
-                maximumValue = centre + width/2
-                minimumValue = centre - width/2
-            elif dataset and hasattr(dataset, 'PerFrameFunctionalGroupsSequence'):
-                # In Enhanced MRIs, this display will retrieve the centre and width values of the first slice
-                slope = dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0].RescaleSlope
-                intercept = dataset.PerFrameFunctionalGroupsSequence[0].PixelValueTransformationSequence[0].RescaleIntercept
-                centre = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowCenter # * slope + intercept
-                width = dataset.PerFrameFunctionalGroupsSequence[0].FrameVOILUTSequence[0].WindowWidth # * slope
-                if [0x2005, 0x100E] in dataset: # 'Philips Rescale Slope'
-                    centre = centre / dataset[(0x2005, 0x100E)].value
-                    width = width / dataset[(0x2005, 0x100E)].value
-                maximumValue = centre + width/2
-                minimumValue = centre - width/2 
-            else:
-                minimumValue = np.amin(self.pixelArray) if (np.median(self.pixelArray) - iqr(self.pixelArray, 
-                rng=(1, 99))/2) < np.amin(self.pixelArray) else np.median(self.pixelArray) - iqr(self.pixelArray, rng=(1, 99))/2
-                maximumValue = np.amax(self.pixelArray) if (np.median(self.pixelArray) + iqr(self.pixelArray, rng=(
-                1, 99))/2) > np.amax(self.pixelArray) else np.median(self.pixelArray) + iqr(self.pixelArray, rng=(1, 99))/2
-                centre = minimumValue + (abs(maximumValue) - abs(minimumValue))/2
-                width = maximumValue - abs(minimumValue)
-
-            return centre, width, maximumValue, minimumValue
+            dataset = ReadDICOM_Image.getDicomHeader(self.selectedImagePath)
+            return readLevelsFromDICOMImage(dataset, self.pixelArray, self.selectedImagePath)
         except Exception as e:
             print('Error in ImageViewer.readLevelsFromDICOMImage: ' + str(e))
             logger.error('Error in ImageViewer.readLevelsFromDICOMImage: ' + str(e))
@@ -157,6 +157,20 @@ class ImageViewerROI(QMdiSubWindow):
             logger.exception('Error in ImageViewerROI.__init__: ' + str(e))
 
 
+    def closeEvent(self, event):
+        """
+        Stops the prefetching of the images of the series 
+        by the sliders before the subwindow closes.
+        """
+        try:
+            if hasattr(self, 'slidersWidget'):
+                self.slidersWidget.close()
+        except Exception as e:
+            print('Error in ImageViewerROI.closeEvent: ' + str(e))
+            logger.error('Error in ImageViewerROI.closeEvent: ' + str(e))
+        super().closeEvent(event)
+
+
     def setUpMainLayout(self):
         """
         All the inner layouts and widgets are contained within one outer
@@ -371,9 +385,7 @@ class ImageViewerROI(QMdiSubWindow):
             logger.info("ImageViewerROI.saveROI called")
             regionName = self.cmbNamesROIs.currentText()
             # get the list of boolean masks for this series
-            maskList = self.graphicsView.dictROIs.dictMasks[regionName] 
-            # Convert each 2D boolean to 0s and 1s
-            maskList = [np.transpose(np.array(mask, dtype=np.int)) for mask in maskList]
+            maskList = self.graphicsView.dictROIs.getMaskList(regionName) 
             suffix = str("_"+ regionName)
             if isinstance(self.imagePathList, list):
                 inputPath = self.imagePathList
@@ -390,7 +402,9 @@ class ImageViewerROI(QMdiSubWindow):
             for index, path in enumerate(inputPath):
                 self.weasel.progressBar.set_value(index)
                 outputPath = SaveDICOM_Image.returnFilePath(path, suffix)
-                SaveDICOM_Image.saveNewSingleDicomImage(outputPath, path, maskList[index], suffix, series_id=seriesID, series_uid=seriesUID, parametric_map="SEG")
+                # Convert each 2D boolean to 0s and 1s
+                mask = np.transpose(np.array(next(maskList), dtype=np.int))
+                SaveDICOM_Image.saveNewSingleDicomImage(outputPath, path, mask, suffix, series_id=seriesID, series_uid=seriesUID, parametric_map="SEG")
                 if "philips" in ReadDICOM_Image.getImageTagValue(outputPath, "Manufacturer").lower():
                     slope = ReadDICOM_Image.getImageTagValue(outputPath, "RescaleSlope")
                     SaveDICOM_Image.overwriteDicomFileTag(outputPath, (0x2005, 0x100E), 1/slope) #[(0x2005, 0x100E)]
@@ -452,26 +466,13 @@ class ImageViewerROI(QMdiSubWindow):
                         maskList = np.transpose(maskInput)
                     self.weasel.close_message()
                 else:
-                    for index, dicomFile in enumerate(targetPath):
-                        self.weasel.progress_bar(msg="<H4>Loading selected ROI into target image {}</H4>".format(index + 1))
-                        self.weasel.progressBar.set_maximum(len(targetPath))
-                        self.weasel.progressBar.set_value(index + 1)
-                        dataset_original = ReadDICOM_Image.getDicomDataset(dicomFile)
-                        tempArray = np.zeros(np.shape(ReadDICOM_Image.getPixelArray(dataset_original)))
-                        for maskFile in imagePathList:
-                            dataset = ReadDICOM_Image.getDicomDataset(maskFile)
-                            maskArray = ReadDICOM_Image.getPixelArray(dataset)
-                            maskArray[maskArray != 0] = 1
-                            affineResults = ReadDICOM_Image.mapMaskToImage(maskArray, dataset, dataset_original)
-                            if affineResults:
-                                try:
-                                    coords = zip(*affineResults)
-                                    tempArray[tuple(coords)] = list(np.ones(len(affineResults)).flatten())
-                                except:
-                                    pass
-                        maskList.append(tempArray)
-                        self.weasel.progressBar.set_value(index+2)
-                    self.weasel.progressBar.close()
+                    self.weasel.message(msg="<H4>Loading selected ROI into target image</H4>")
+                    # All the mask images are mapped to all the target images in one go
+                    maskAffines = ReadDICOM_Image.returnSeriesAffineArray(imagePathList)
+                    targetAffines = ReadDICOM_Image.returnSeriesAffineArray(targetPath)
+                    targetShape = np.shape(targetImage)[-2:]
+                    maskList = list(ReadDICOM_Image.mapMaskVolumeToImages(maskInput, maskAffines, targetAffines, targetShape))
+                    self.weasel.close_message()
 
                 # First populate the ROI_Storage data structure in a loop
                 self.graphicsView.currentROIName = region
@@ -672,7 +673,7 @@ class ImageViewerROI(QMdiSubWindow):
                 imageNumber = self.mainImageSlider.value()
             else:
                 imageNumber = 1
-            pixelArray = ReadDICOM_Image.returnPixelArray(self.selectedImagePath)
+            pixelArray = ReadDICOM_Image.getCachedPixelArray(self.selectedImagePath)
             regionName = self.cmbNamesROIs.currentText()
             mask = self.graphicsView.dictROIs.getMask(regionName, imageNumber)   
             if mask is not None:
@@ -1172,7 +1173,7 @@ class ImageViewerROI(QMdiSubWindow):
 
                 self.selectedImagePath = imagePath
                 imageName = os.path.basename(self.selectedImagePath)
-                self.pixelArray = ReadDICOM_Image.returnPixelArray(self.selectedImagePath)
+                self.pixelArray = ReadDICOM_Image.getCachedPixelArray(self.selectedImagePath)
                 
                 self.setWindowTitle(self.subjectID + ' - ' + self.studyID + ' - '+ self.seriesID + ' - ' 
                          + imageName)
@@ -11,12 +11,9 @@ def main(weasel):
     for i, image in enumerate(list_of_images):      # Loop over Series in the list and display a progress Bar
         weasel.progress_bar(max=len(list_of_images), index=i+1, msg="Anonymising images {}")
 
-        image["PatientName"] = "Anonymous"    # replace PatientName
-        image["PatientID"] = "Anonymous"
-        image["PatientBirthDate"] = "19000101"
-        image["OtherPatientNames"] = ["Anonymous 1", "Anonymous 2"]
-        image["OtherPatientIDsSequence"] = [Dataset(),Dataset()]
-        image["ReferencePatientPhotoSequence"] = [Dataset(),Dataset()]
+        # replace the patient details, writing each file once
+        image.set_value(["PatientName", "PatientID", "PatientBirthDate", "OtherPatientNames", "OtherPatientIDsSequence", "ReferencePatientPhotoSequence"],
+                        ["Anonymous", "Anonymous", "19000101", ["Anonymous 1", "Anonymous 2"], [Dataset(),Dataset()], [Dataset(),Dataset()]])
 
     weasel.refresh()                # Refresh weasel
 
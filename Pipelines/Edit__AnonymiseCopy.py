@@ -10,12 +10,9 @@ def main(weasel):
         weasel.progress_bar(max=len(list_of_images), index=i+1, msg="Anonymising images {}")
 
         new_image = image.copy()
-        new_image["PatientName"] = "Anonymous"    # replace PatientName
-        new_image["PatientID"] = "Anonymous"
-        new_image["PatientBirthDate"] = "19000101"
-        new_image["OtherPatientNames"] = ["Anonymous 1", "Anonymous 2"]
-        new_image["OtherPatientIDsSequence"] = [Dataset(),Dataset()]
-        new_image["ReferencePatientPhotoSequence"] = [Dataset(),Dataset()]         
+        # replace the patient details, writing each file once
+        new_image.set_value(["PatientName", "PatientID", "PatientBirthDate", "OtherPatientNames", "OtherPatientIDsSequence", "ReferencePatientPhotoSequence"],
+                            ["Anonymous", "Anonymous", "19000101", ["Anonymous 1", "Anonymous 2"], [Dataset(),Dataset()], [Dataset(),Dataset()]])
 
     weasel.refresh()                # Refresh weasel
 
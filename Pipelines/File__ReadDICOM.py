@@ -1,5 +1,6 @@
 """
 Reopen and load the DICOM folder and presented in the display.
+Only the files added, changed or removed since the folder was last read are processed.
 """
 
 import logging
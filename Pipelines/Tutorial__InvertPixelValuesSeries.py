@@ -6,6 +6,6 @@ def main(weasel):
     list_of_series = weasel.series()    # get the list of all series checked by the user
     for i, series in enumerate(list_of_series): # Loop over series and display a progress Bar
         weasel.progress_bar(max=len(list_of_series), index=i+1, msg="Inverting series {}", title="Invert pixel values ")
-        series.write(-series.PixelArray)     # Invert the pixel array and overwrite existing pixel array
+        series.write(-series.LazyPixelArray)     # Invert the pixel array and overwrite existing pixel array, slice by slice
     list_of_series.display()        # Display all Series in the list
     weasel.refresh()
\ No newline at end of file
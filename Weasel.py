@@ -43,6 +43,7 @@ sys.path.append(os.path.dirname(sys.path[0])) # Add the parent directory to sys
 
 import CoreModules.StyleSheet as styleSheet
 from CoreModules.XMLConfigReader import XMLConfigReader
+import DICOM.ReadDICOM_Image as ReadDICOM_Image
 from CoreModules.WeaselXMLReader import WeaselXMLReader
 from CoreModules.TreeView import TreeView
 from CoreModules.MenuBuilder import MenuBuilder
@@ -90,6 +91,7 @@ class Weasel(QMainWindow, WeaselProgrammingInterface):
         self.objXMLReader = None 
 
         self.weaselDataFolder = self.objConfigXMLReader.getWeaselDataFolder()
+        ReadDICOM_Image.setSliceCacheSize(self.objConfigXMLReader.getSliceCacheSize())
         self.menuBuilder.buildMenus()
         
         self.setStyleSheet(styleSheet.WEASEL_GREY)